@@ -0,0 +1,210 @@
+"""API 余额查询基准测试
+
+在本地启动一个 aiohttp 假服务 模拟 one-api/new-api 的 dashboard/billing 接口
+按 Key 前缀决定行为: sk-ok 正常返回 sk-slow 超过超时时间才返回 sk-err 返回 HTTP 500
+检查 BalanceQuerier 的:
+1. 单飞: 同一个 Key 的大量并发查询只产生一次上游请求
+2. 缓存 TTL: TTL 内重复查询不访问上游 过期后重新查询
+3. 单个提供商超时和出错不影响其他提供商 整体耗时受超时时间约束
+4. 大量 Key 并发查询时的耗时和连接复用情况
+
+用法:
+    python benchmarks/balance_bench.py
+    python benchmarks/balance_bench.py --keys 500 --server-latency 0.05 --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import load_plugin_module  # noqa: E402
+
+class StubBillingServer:
+    """假的 one-api 余额接口 记录每个 Key 的请求次数和客户端连接"""
+
+    def __init__(self, latency: float, slow_latency: float):
+        self.latency = latency
+        self.slow_latency = slow_latency
+        self.requests: Dict[str, int] = {}
+        self.connections: Set[Tuple[str, int]] = set()
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _respond(self, request: web.Request, body: Dict[str, Any]) -> web.Response:
+        key = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        self.requests[key] = self.requests.get(key, 0) + 1
+        peer = request.transport.get_extra_info("peername") if request.transport else None
+        if peer:
+            self.connections.add(tuple(peer[:2]))
+        if key.startswith("sk-slow"):
+            await asyncio.sleep(self.slow_latency)
+        else:
+            await asyncio.sleep(self.latency)
+        if key.startswith("sk-err"):
+            return web.json_response({"error": "internal"}, status=500)
+        return web.json_response(body)
+
+    async def subscription(self, request: web.Request) -> web.Response:
+        return await self._respond(request, {"hard_limit_usd": 100.0})
+
+    async def usage(self, request: web.Request) -> web.Response:
+        return await self._respond(request, {"total_usage": 1234.0})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/v1/dashboard/billing/subscription", self.subscription)
+        app.router.add_get("/v1/dashboard/billing/usage", self.usage)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/v1"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def reset(self) -> None:
+        self.requests.clear()
+        self.connections.clear()
+
+async def check_single_flight(module: Any, server: StubBillingServer, args: argparse.Namespace) -> Dict[str, Any]:
+    """同一个 Key 并发查询 上游只应收到一次 subscription + usage"""
+    querier = module.BalanceQuerier(args.timeout, 60.0)
+    target = module.BalanceTarget("ok", server.url, "sk-ok-single-flight")
+    server.reset()
+    results = await asyncio.gather(*(querier.query_many([target]) for _ in range(args.concurrent)))
+    await querier.close()
+    upstream = server.requests.get(target.key, 0)
+    return {
+        "concurrent_queries": args.concurrent,
+        "upstream_requests": upstream,
+        "all_succeeded": all(r[0][1] for r in results),
+        "passed": upstream == 2 and all(r[0][1] for r in results),
+    }
+
+async def check_ttl(module: Any, server: StubBillingServer, args: argparse.Namespace) -> Dict[str, Any]:
+    """TTL 内复用缓存 过期后重新查询"""
+    querier = module.BalanceQuerier(args.timeout, args.ttl)
+    target = module.BalanceTarget("ok", server.url, "sk-ok-ttl")
+    server.reset()
+    await querier.query_many([target])
+    first = server.requests.get(target.key, 0)
+    await querier.query_many([target])
+    cached = server.requests.get(target.key, 0)
+    await asyncio.sleep(args.ttl + 0.1)
+    await querier.query_many([target])
+    expired = server.requests.get(target.key, 0)
+    await querier.close()
+    return {
+        "after_first": first,
+        "after_cached": cached,
+        "after_expiry": expired,
+        "passed": first == 2 and cached == 2 and expired == 4,
+    }
+
+async def check_isolation(module: Any, server: StubBillingServer, args: argparse.Namespace) -> Dict[str, Any]:
+    """慢的和出错的提供商不影响正常的提供商 整体耗时约等于超时时间"""
+    querier = module.BalanceQuerier(args.timeout, 0)
+    targets = [
+        module.BalanceTarget("正常", server.url, "sk-ok-isolation"),
+        module.BalanceTarget("超时", server.url, "sk-slow-isolation"),
+        module.BalanceTarget("出错", server.url, "sk-err-isolation"),
+    ]
+    begin = time.perf_counter()
+    results = await querier.query_many(targets)
+    elapsed = time.perf_counter() - begin
+    await querier.close()
+    outcome = {target.name: {"ok": ok, "text": text} for target, ok, text in results}
+    return {
+        "results": outcome,
+        "seconds": elapsed,
+        "timeout": querier.timeout,
+        "passed": (outcome["正常"]["ok"] and outcome["超时"]["text"] == "查询超时"
+                   and outcome["出错"]["text"] == "HTTP 500" and elapsed < querier.timeout + 0.5),
+    }
+
+async def bench_many(module: Any, server: StubBillingServer, args: argparse.Namespace) -> Dict[str, Any]:
+    """大量不同 Key 并发查询 连接池限制每个主机的连接数并复用连接"""
+    querier = module.BalanceQuerier(args.timeout, 0)
+    targets = [module.BalanceTarget(f"key{i}", server.url, f"sk-ok-many-{i:05d}") for i in range(args.keys)]
+    server.reset()
+    begin = time.perf_counter()
+    results = await querier.query_many(targets)
+    elapsed = time.perf_counter() - begin
+    await querier.close()
+    return {
+        "keys": args.keys,
+        "seconds": elapsed,
+        "keys_per_second": args.keys / elapsed,
+        "succeeded": sum(ok for _, ok, _ in results),
+        "upstream_requests": sum(server.requests.values()),
+        "connections": len(server.connections),
+        "pool_per_host": module.BALANCE_POOL_PER_HOST,
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    server = StubBillingServer(args.server_latency, args.timeout * 2.5)
+    await server.start()
+    try:
+        return {
+            "single_flight": await check_single_flight(module, server, args),
+            "ttl": await check_ttl(module, server, args),
+            "isolation": await check_isolation(module, server, args),
+            "many": await bench_many(module, server, args),
+        }
+    finally:
+        await server.stop()
+
+def print_report(report: Dict[str, Any]) -> None:
+    s = report["single_flight"]
+    print(f"单飞: {s['concurrent_queries']} 个并发查询 上游请求 {s['upstream_requests']} 次 "
+          f"{'通过' if s['passed'] else '失败'}")
+    t = report["ttl"]
+    print(f"缓存: 首次 {t['after_first']} 次 TTL 内 {t['after_cached']} 次 过期后 {t['after_expiry']} 次 "
+          f"{'通过' if t['passed'] else '失败'}")
+    i = report["isolation"]
+    detail = " ".join(f"{name}={r['text']}" for name, r in i["results"].items())
+    print(f"隔离: {detail} | 用时 {i['seconds']:.2f}s (超时 {i['timeout']:g}s) {'通过' if i['passed'] else '失败'}")
+    m = report["many"]
+    print(f"并发: {m['keys']} 个 Key 用时 {m['seconds']:.2f}s ({m['keys_per_second']:.0f} 个/s) 成功 {m['succeeded']} "
+          f"| 上游请求 {m['upstream_requests']} 次 使用连接 {m['connections']} 个 (每主机上限 {m['pool_per_host']})")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction API 余额查询基准测试")
+    parser.add_argument("--keys", type=int, default=200, help="并发查询的 Key 数")
+    parser.add_argument("--concurrent", type=int, default=50, help="单飞检查中同一个 Key 的并发查询数")
+    parser.add_argument("--server-latency", type=float, default=0.05, help="假服务的响应延迟(秒)")
+    parser.add_argument("--timeout", type=float, default=1.0, help="单个提供商的查询超时(秒)")
+    parser.add_argument("--ttl", type=float, default=0.5, help="缓存检查使用的 TTL(秒)")
+    parser.add_argument("--seed", type=int, default=20240701, help="保留参数 与其他压测脚本一致")
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    checks = ("single_flight", "ttl", "isolation")
+    many = report["many"]
+    ok = all(report[name]["passed"] for name in checks) and many["succeeded"] == many["keys"]
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
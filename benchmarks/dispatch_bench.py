@@ -0,0 +1,225 @@
+"""指令匹配开销基准测试
+
+只喂非指令消息(群聊闲聊、带唤醒词但不是指令的消息) 测量每条消息花在指令匹配上的时间
+对比四种写法:
+- legacy: 基线版本的匹配 状态和点赞两个 ALL 消息处理器各调用一次 _check_awake_and_trigger
+  每次都从原始消息的字符串形式里重新截取 raw_message 并格式化一条 info 日志
+- dispatcher: 只计 CommandDispatcher.match 本身 输入为事先解析好的消息文本
+- match: 当前插件的事件解析 + CommandDispatcher.match
+- hook: 当前插件的 on_message_command 完整入口 包括事件解析和耗时统计
+另外用几条指令消息检查新旧写法的匹配结果一致
+
+用法:
+    python benchmarks/dispatch_bench.py
+    python benchmarks/dispatch_bench.py --messages 20000 --repeat 5 --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import CHAT_TEXTS, StubMessageEvent, TrafficGenerator, load_plugin_module  # noqa: E402
+
+AWAKE_WORDS = ["XYTU", "XYTUFT"]
+STATUS_TRIGGERS = ["状态", "status"]
+LIKE_TRIGGERS = ["赞我", "zanwo"]
+# 以唤醒词开头但不是指令 会走到触发词比较这一步
+AWAKE_CHATTER = ["XYTU 你好", "XYTU 今天天气怎么样", "XYTUFT 在吗", "XYTU", "XYTU 状态怎么样"]
+
+# ==================== 基线版本的匹配 ====================
+logger = logging.getLogger("astrbot")
+
+def legacy_get_raw_message(event: Any) -> str:
+    """基线版本的 _get_raw_message"""
+    try:
+        if hasattr(event, 'message_obj') and hasattr(event.message_obj, 'raw_message'):
+            if isinstance(event.message_obj.raw_message, str):
+                return event.message_obj.raw_message
+            elif hasattr(event.message_obj.raw_message, '__str__'):
+                raw_str = str(event.message_obj.raw_message)
+                if "'raw_message':" in raw_str:
+                    try:
+                        start = raw_str.find("'raw_message':") + len("'raw_message':")
+                        end = raw_str.find(",", start)
+                        if end == -1:
+                            end = raw_str.find("}", start)
+                        if end != -1:
+                            raw_msg = raw_str[start:end].strip()
+                            if raw_msg.startswith("'") and raw_msg.endswith("'"):
+                                raw_msg = raw_msg[1:-1]
+                            elif raw_msg.startswith('"') and raw_msg.endswith('"'):
+                                raw_msg = raw_msg[1:-1]
+                            return raw_msg
+                    except:
+                        pass
+                return raw_str
+        if hasattr(event, 'raw_message'):
+            return str(event.raw_message)
+        return event.message_str
+    except Exception as e:
+        logger.error(f"获取原始消息失败: {e}")
+        return ""
+
+def legacy_check_awake_and_trigger(event: Any, awake_words: List[str], trigger_words: List[str]) -> bool:
+    """基线版本的 _check_awake_and_trigger"""
+    try:
+        raw_msg = legacy_get_raw_message(event)
+        if not raw_msg:
+            raw_msg = event.message_str
+        logger.info(f"原始消息内容: '{raw_msg}'，唤醒词列表: {awake_words}")
+        for awake_word in awake_words:
+            if raw_msg.startswith(awake_word):
+                remaining = raw_msg[len(awake_word):].strip()
+                for word in trigger_words:
+                    if remaining.lower() == word.lower():
+                        logger.info(f"匹配成功: 唤醒词='{awake_word}', 触发词='{word}'")
+                        return True
+        return False
+    except Exception as e:
+        logger.error(f"检查唤醒和触发失败: {e}")
+        return False
+
+def legacy_match(event: Any, config: Dict[str, Any]) -> Optional[str]:
+    """基线版本每条消息依次经过状态和点赞两个处理器"""
+    if config.get("status_enabled", False):
+        trigger_words = config.get("status_trigger_words", STATUS_TRIGGERS) or STATUS_TRIGGERS
+        if legacy_check_awake_and_trigger(event, AWAKE_WORDS, trigger_words):
+            return "status"
+    if config.get("like_enabled", False):
+        trigger_words = config.get("like_trigger_words", LIKE_TRIGGERS) or LIKE_TRIGGERS
+        if legacy_check_awake_and_trigger(event, AWAKE_WORDS, trigger_words):
+            return "like"
+    return None
+
+# ==================== 压测驱动 ====================
+def make_events(args: argparse.Namespace) -> List[StubMessageEvent]:
+    traffic = TrafficGenerator(args.groups, 5000, AWAKE_WORDS[0], args.seed)
+    rng = random.Random(args.seed)
+    events = []
+    for _ in range(args.messages):
+        text = rng.choice(AWAKE_CHATTER) if rng.random() < args.awake_ratio else rng.choice(CHAT_TEXTS)
+        raw = traffic.message(text)
+        events.append(StubMessageEvent(raw, TrafficGenerator.session(raw)))
+    return events
+
+def time_sync(fn: Callable[[StubMessageEvent], Any], args: argparse.Namespace) -> float:
+    """每轮用新的事件 避免命中解析缓存 取最快一轮的每条耗时"""
+    best = float("inf")
+    for _ in range(args.repeat):
+        events = make_events(args)
+        started = time.perf_counter()
+        for event in events:
+            fn(event)
+        best = min(best, (time.perf_counter() - started) / len(events))
+    return best
+
+def time_dispatcher(module: Any, plugin: Any, args: argparse.Namespace) -> float:
+    best = float("inf")
+    for _ in range(args.repeat):
+        texts = [module.get_parsed_message(event).raw_text for event in make_events(args)]
+        match = plugin._dispatcher.match
+        started = time.perf_counter()
+        for text in texts:
+            match(text)
+        best = min(best, (time.perf_counter() - started) / len(texts))
+    return best
+
+async def time_hook(plugin: Any, args: argparse.Namespace) -> float:
+    best = float("inf")
+    for _ in range(args.repeat):
+        events = make_events(args)
+        started = time.perf_counter()
+        for event in events:
+            async for _ in plugin.on_message_command(event):
+                pass
+        best = min(best, (time.perf_counter() - started) / len(events))
+    return best
+
+def check_agreement(module: Any, plugin: Any, config: Dict[str, Any], args: argparse.Namespace) -> Dict[str, Any]:
+    """指令和非指令消息上 新旧写法给出相同的结果"""
+    traffic = TrafficGenerator(args.groups, 5000, AWAKE_WORDS[0], args.seed)
+    texts = AWAKE_CHATTER + CHAT_TEXTS + [f"{awake} {word}" for awake in AWAKE_WORDS
+                                         for word in STATUS_TRIGGERS + LIKE_TRIGGERS + ["STATUS", "赞我 "]]
+    mismatches = []
+    for text in texts:
+        event = StubMessageEvent(traffic.message(text), "aiocqhttp:GroupMessage:700001")
+        old = legacy_match(event, config)
+        matched = plugin._dispatcher.match(module.get_parsed_message(event).raw_text)
+        new = matched[0] if matched else None
+        if old != new:
+            mismatches.append({"text": text, "legacy": old, "new": new})
+    return {"messages": len(texts), "mismatches": mismatches}
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    config = {
+        "awake_words": AWAKE_WORDS,
+        "status_enabled": True,
+        "status_trigger_words": STATUS_TRIGGERS,
+        "like_enabled": True,
+        "like_trigger_words": LIKE_TRIGGERS,
+    }
+    plugin = module.XYTUFunctionPlugin(None, config)
+    legacy = time_sync(lambda event: legacy_match(event, config), args)
+    dispatcher = time_dispatcher(module, plugin, args)
+    match = time_sync(lambda event: plugin._dispatcher.match(module.get_parsed_message(event).raw_text), args)
+    hook = await time_hook(plugin, args)
+    agreement = check_agreement(module, plugin, config, args)
+    await plugin.terminate()
+    return {
+        "messages": args.messages,
+        "awake_ratio": args.awake_ratio,
+        "legacy_ns": legacy * 1e9,
+        "dispatcher_ns": dispatcher * 1e9,
+        "match_ns": match * 1e9,
+        "hook_ns": hook * 1e9,
+        "dispatcher_speedup": legacy / dispatcher,
+        "match_speedup": legacy / match,
+        "hook_speedup": legacy / hook,
+        "agreement": agreement,
+    }
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{report['messages']} 条非指令消息 其中以唤醒词开头 {report['awake_ratio']:.0%}")
+    print(f"  legacy (两个处理器各匹配一次): {report['legacy_ns']:.0f} ns/条")
+    print(f"  dispatcher (只计 CommandDispatcher.match): {report['dispatcher_ns']:.0f} ns/条 "
+          f"快 {report['dispatcher_speedup']:.1f}x")
+    print(f"  match  (解析 + CommandDispatcher.match): {report['match_ns']:.0f} ns/条 快 {report['match_speedup']:.1f}x")
+    print(f"  hook   (on_message_command 完整入口): {report['hook_ns']:.0f} ns/条 快 {report['hook_speedup']:.1f}x")
+    a = report["agreement"]
+    print(f"  匹配结果一致性: {a['messages']} 条 不一致 {len(a['mismatches'])} 条")
+    for item in a["mismatches"]:
+        print(f"    '{item['text']}': legacy={item['legacy']} new={item['new']}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 指令匹配开销基准测试")
+    parser.add_argument("--messages", type=int, default=20000, help="每轮的非指令消息数")
+    parser.add_argument("--repeat", type=int, default=5, help="重复轮数 取最快一轮")
+    parser.add_argument("--awake-ratio", type=float, default=0.05, help="以唤醒词开头的非指令消息占比")
+    parser.add_argument("--groups", type=int, default=200, help="模拟的群数量")
+    parser.add_argument("--seed", type=int, default=20240701)
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    ok = not report["agreement"]["mismatches"] and report["match_speedup"] > 1.0
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
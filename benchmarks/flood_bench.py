@@ -0,0 +1,191 @@
+"""刷屏检测基准测试
+
+1. 单独测 FloodDetector.check 的单条耗时
+2. 按固定速率(默认 10000 条/s)把群消息喂给插件的 on_group_flood 其中混入少量刷屏用户
+   统计实际达到的速率、处理耗时分位数、检出的刷屏用户和误判的正常用户 以及合并后的 OneBot 调用次数
+3. 再让大量只说一句话的新用户涌入 检查检测器内存不随不活跃用户增长
+
+用法:
+    python benchmarks/flood_bench.py
+    python benchmarks/flood_bench.py --rate 10000 --duration 10 --users 100000 --actions warn,mute,recall --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import CHAT_TEXTS, StubBot, StubMessageEvent, load_plugin_module  # noqa: E402
+
+SPAM_TEXT = "加群领福利 速来"
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+def group_message(message_id: int, group_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    return {
+        "post_type": "message", "message_type": "group", "sub_type": "normal", "time": int(time.time()),
+        "self_id": 20000, "user_id": user_id, "group_id": group_id, "message_id": message_id,
+        "message": [{"type": "text", "data": {"text": text}}], "raw_message": text, "font": 0,
+        "sender": {"user_id": user_id, "nickname": f"用户{user_id}", "card": "", "role": "member"},
+    }
+
+def bench_check(module: Any, args: argparse.Namespace) -> Dict[str, float]:
+    detector = module.FloodDetector(args.window, args.max_messages, args.max_duplicates, 0, 60.0)
+    rng = random.Random(args.seed)
+    messages = [(str(rng.randrange(args.groups)), str(rng.randrange(args.users)), rng.choice(CHAT_TEXTS))
+                for _ in range(100000)]
+    now = time.monotonic()
+    begin = time.perf_counter()
+    for i in range(args.check_count):
+        group_id, user_id, text = messages[i % len(messages)]
+        detector.check(group_id, user_id, text, now + i / args.rate)
+    elapsed = time.perf_counter() - begin
+    return {"messages": args.check_count, "us_per_message": elapsed / args.check_count * 1e6,
+            "messages_per_second": args.check_count / elapsed}
+
+async def bench_stream(module: Any, plugin: Any, bot: StubBot, args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    spammers = {(rng.randrange(args.groups), 90000000 + i) for i in range(args.spammers)}
+    spam_ids: Dict[int, List[int]] = {}
+    flagged_users = set()
+    latencies: List[float] = []
+    message_id = 1
+    total = int(args.rate * args.duration)
+    # 刷屏用户每秒 spam_rate 条 其余流量均匀分给普通用户
+    spam_every = max(int(args.rate / max(args.spam_rate * args.spammers, 1)), 1)
+    spammer_list = sorted(spammers)
+    tick = 0.01
+    per_tick = max(int(args.rate * tick), 1)
+    begin = time.perf_counter()
+    behind = 0.0
+    sent = 0
+    while sent < total:
+        for _ in range(min(per_tick, total - sent)):
+            message_id += 1
+            if args.spammers and sent % spam_every == 0:
+                group_id, user_id = spammer_list[(sent // spam_every) % len(spammer_list)]
+                raw = group_message(message_id, 700000 + group_id, user_id, SPAM_TEXT)
+                spam_ids.setdefault(user_id, []).append(message_id)
+            else:
+                raw = group_message(message_id, 700000 + rng.randrange(args.groups),
+                                    10000 + rng.randrange(args.users), rng.choice(CHAT_TEXTS))
+            event = StubMessageEvent(raw, f"aiocqhttp:GroupMessage:{raw['group_id']}", bot)
+            started = time.perf_counter()
+            await plugin.on_group_flood(event)
+            latencies.append(time.perf_counter() - started)
+            if event.is_stopped():
+                flagged_users.add(raw["user_id"])
+            sent += 1
+        target = begin + sent / args.rate
+        delay = target - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            behind = max(behind, -delay)
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - begin
+    # 等最后一个批次执行完
+    await asyncio.sleep(plugin._moderation.interval + 1.0)
+    spam_users = {user_id for _, user_id in spammers}
+    return {
+        "messages": sent,
+        "seconds": elapsed,
+        "achieved_rate": sent / elapsed,
+        "max_behind_ms": behind * 1000,
+        "handler_p50_us": percentile(latencies, 0.50) * 1e6,
+        "handler_p99_us": percentile(latencies, 0.99) * 1e6,
+        "spam_messages": sum(len(ids) for ids in spam_ids.values()),
+        "spammers": len(spam_users),
+        "spammers_detected": len(flagged_users & spam_users),
+        "false_positives": len(flagged_users - spam_users),
+        "onebot_calls": dict(bot.api.calls),
+        "dropped_actions": plugin._moderation.dropped,
+    }
+
+def bench_idle_users(module: Any, args: argparse.Namespace) -> Dict[str, Any]:
+    """大量只说一句话的用户涌入 检测器内存应停在上限"""
+    detector = module.FloodDetector(args.window, args.max_messages, args.max_duplicates, 0, 60.0)
+    now = time.monotonic()
+    tracemalloc.start()
+    samples = []
+    for wave in range(1, 4):
+        for i in range(args.idle_users):
+            detector.check(str(i % args.groups), f"{wave}_{i}", "你好", now + i / args.rate)
+        samples.append({"users_seen": wave * args.idle_users, "tracked_users": detector.tracked[0],
+                        "memory_bytes": tracemalloc.get_traced_memory()[0]})
+    tracemalloc.stop()
+    return {"limit": module.FLOOD_TRACKED_USERS, "waves": samples}
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    config = {
+        "flood_enabled": True,
+        "flood_window_seconds": args.window,
+        "flood_max_messages": args.max_messages,
+        "flood_max_duplicates": args.max_duplicates,
+        "flood_actions": [a for a in args.actions.split(",") if a],
+    }
+    plugin = module.XYTUFunctionPlugin(None, config)
+    bot = StubBot(args.api_latency)
+    report = {"check": bench_check(module, args)}
+    report["stream"] = await bench_stream(module, plugin, bot, args)
+    report["idle_users"] = bench_idle_users(module, args)
+    await plugin.terminate()
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    c = report["check"]
+    print(f"FloodDetector.check: {c['us_per_message']:.2f}us/条 ({c['messages_per_second']:.0f} 条/s)")
+    s = report["stream"]
+    print(f"插件处理 {s['messages']} 条 用时 {s['seconds']:.2f}s 实际 {s['achieved_rate']:.0f} 条/s "
+          f"最多落后 {s['max_behind_ms']:.1f}ms | 单条 p50 {s['handler_p50_us']:.1f}us p99 {s['handler_p99_us']:.1f}us")
+    print(f"  刷屏 {s['spam_messages']} 条 检出 {s['spammers_detected']}/{s['spammers']} 个刷屏用户 "
+          f"误判 {s['false_positives']} 个 | OneBot 调用 {s['onebot_calls']} 丢弃 {s['dropped_actions']}")
+    idle = report["idle_users"]
+    for wave in idle["waves"]:
+        print(f"  新用户累计 {wave['users_seen']}: 跟踪 {wave['tracked_users']} (上限 {idle['limit']}) "
+              f"内存 {wave['memory_bytes'] / 1024 / 1024:.2f} MiB")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 刷屏检测基准测试")
+    parser.add_argument("--rate", type=float, default=10000.0, help="每秒消息数")
+    parser.add_argument("--duration", type=float, default=5.0, help="持续时间(秒)")
+    parser.add_argument("--groups", type=int, default=500)
+    parser.add_argument("--users", type=int, default=100000, help="普通用户数")
+    parser.add_argument("--spammers", type=int, default=20, help="刷屏用户数")
+    parser.add_argument("--spam-rate", type=float, default=5.0, help="每个刷屏用户每秒发送条数")
+    parser.add_argument("--window", type=float, default=10.0)
+    parser.add_argument("--max-messages", type=int, default=8)
+    parser.add_argument("--max-duplicates", type=int, default=3)
+    parser.add_argument("--actions", default="warn,mute", help="逗号分隔的处理方式")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="模拟 OneBot 接口往返延迟(秒)")
+    parser.add_argument("--check-count", type=int, default=500000, help="单独测 check 的消息数")
+    parser.add_argument("--idle-users", type=int, default=50000, help="每一波涌入的新用户数")
+    parser.add_argument("--seed", type=int, default=20240701)
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    stream = report["stream"]
+    return 0 if stream["achieved_rate"] >= args.rate * 0.95 and stream["spammers_detected"] == stream["spammers"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""点赞限速基准测试
+
+用本地的假 OneBot 端点(记录每次 send_like 的时间 带可配置往返延迟)驱动插件的赞我 / 赞他
+1. 赞他批量给大量用户点赞 统计实际吞吐量 并检查任意 1 秒窗口内的调用数不超过 令牌桶速率 + 突发量
+2. 同一批用户同时发赞我和被赞他 检查每个用户只调用一次 send_like 两边拿到的结果一致
+
+用法:
+    python benchmarks/like_bench.py
+    python benchmarks/like_bench.py --targets 500 --rate 20 --burst 5 --concurrency 4 --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import StubMessageEvent, load_plugin_module  # noqa: E402
+
+class FakeOneBotAPI:
+    """假 OneBot 端点 记录 send_like 的调用时间 按比例返回已达上限"""
+
+    def __init__(self, latency: float, capped_ratio: float, seed: int):
+        self.latency = latency
+        self.capped_ratio = capped_ratio
+        self.random = random.Random(seed)
+        self.calls: Dict[str, int] = {}
+        self.like_times: List[float] = []
+        self.like_users: Dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def call_action(self, action: str, **params):
+        self.calls[action] = self.calls.get(action, 0) + 1
+        if action != "send_like":
+            await asyncio.sleep(self.latency)
+            return {"status": "ok", "retcode": 0, "data": None}
+        self.like_times.append(time.perf_counter())
+        user_id = str(params.get("user_id"))
+        self.like_users[user_id] = self.like_users.get(user_id, 0) + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        if self.random.random() < self.capped_ratio:
+            return {"status": "failed", "retcode": 100, "message": "今日点赞次数已达上限"}
+        return {"status": "ok", "retcode": 0, "data": None}
+
+class FakeBot:
+    def __init__(self, api: FakeOneBotAPI):
+        self.api = api
+
+def group_message(user_id: int, text: str) -> Dict[str, Any]:
+    return {
+        "post_type": "message", "message_type": "group", "sub_type": "normal", "time": int(time.time()),
+        "self_id": 20000, "user_id": user_id, "group_id": 700001, "message_id": user_id,
+        "message": [{"type": "text", "data": {"text": text}}], "raw_message": text, "font": 0,
+        "sender": {"user_id": user_id, "nickname": f"用户{user_id}", "card": "", "role": "member"},
+    }
+
+def max_window_calls(times: List[float], window: float) -> int:
+    """任意长度为 window 的时间窗口内最多的调用数"""
+    times = sorted(times)
+    best = 0
+    start = 0
+    for end, t in enumerate(times):
+        while t - times[start] >= window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+async def collect(gen) -> List[Any]:
+    return [item async for item in gen]
+
+async def bench_bulk(plugin: Any, api: FakeOneBotAPI, args: argparse.Namespace) -> Dict[str, Any]:
+    """赞他批量点赞 吞吐量应贴近令牌桶速率 且任意 1 秒内不超过 速率 + 突发量"""
+    targets = [str(1000000 + i) for i in range(args.targets)]
+    event = StubMessageEvent(group_message(9000001, "赞他"), "aiocqhttp:GroupMessage:700001", FakeBot(api))
+    begin = time.perf_counter()
+    replies = await collect(plugin._handle_like_other(event, " ".join(targets)))
+    elapsed = time.perf_counter() - begin
+    times = list(api.like_times)
+    span = times[-1] - times[0] if len(times) > 1 else 0.0
+    limit = args.rate + args.burst
+    window_max = max_window_calls(times, 1.0)
+    return {
+        "targets": len(targets),
+        "send_like_calls": len(times),
+        "seconds": elapsed,
+        # 去掉开头的突发量后按稳定速率计算
+        "steady_rate": (len(times) - args.burst) / span if span > 0 and len(times) > args.burst else 0.0,
+        "max_calls_per_second_window": window_max,
+        "window_limit": limit,
+        "max_in_flight": api.max_in_flight,
+        "concurrency_limit": args.concurrency,
+        "rate_limit_held": window_max <= limit and api.max_in_flight <= args.concurrency,
+        "reply": replies[-1][1] if replies else "",
+    }
+
+async def bench_overlap(plugin: Any, api: FakeOneBotAPI, args: argparse.Namespace) -> Dict[str, Any]:
+    """同一批用户同时赞我和被赞他 每个用户只应调用一次 send_like"""
+    users = [2000000 + i for i in range(args.overlap_users)]
+    bot = FakeBot(api)
+    before = dict(api.like_users)
+    like_me = [
+        collect(plugin._handle_like(StubMessageEvent(group_message(u, "赞我"), "aiocqhttp:GroupMessage:700001", bot)))
+        for u in users
+    ]
+    like_other = collect(plugin._handle_like_other(
+        StubMessageEvent(group_message(9000002, "赞他"), "aiocqhttp:GroupMessage:700001", bot),
+        " ".join(str(u) for u in users)
+    ))
+    results = await asyncio.gather(like_other, *like_me)
+    calls = {u: api.like_users.get(str(u), 0) - before.get(str(u), 0) for u in users}
+    like_me_replies = [r[-1][1] for r in results[1:] if r]
+    return {
+        "users": len(users),
+        "send_like_calls": sum(calls.values()),
+        "duplicate_calls": sum(max(c - 1, 0) for c in calls.values()),
+        "like_me_failed_replies": sum("失败" in r for r in like_me_replies),
+        "like_other_reply": results[0][-1][1] if results[0] else "",
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    config = {
+        "like_enabled": True,
+        "like_other_enabled": True,
+        "like_rate_per_second": args.rate,
+        "like_rate_burst": args.burst,
+        "like_max_concurrency": args.concurrency,
+        "like_bulk_max_targets": max(args.targets, args.overlap_users),
+    }
+    plugin = module.XYTUFunctionPlugin(None, config)
+    report = {"bulk": await bench_bulk(plugin, FakeOneBotAPI(args.api_latency, args.capped_ratio, args.seed), args)}
+    report["overlap"] = await bench_overlap(plugin, FakeOneBotAPI(args.api_latency, 0.0, args.seed), args)
+    await plugin.terminate()
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    b = report["bulk"]
+    print(f"赞他 {b['targets']} 人: send_like {b['send_like_calls']} 次 用时 {b['seconds']:.2f}s "
+          f"稳定速率 {b['steady_rate']:.2f} 次/s")
+    print(f"  任意 1 秒最多 {b['max_calls_per_second_window']} 次 (上限 {b['window_limit']:g}) "
+          f"同时进行最多 {b['max_in_flight']} 个 (上限 {b['concurrency_limit']}) "
+          f"{'限速生效' if b['rate_limit_held'] else '超出限速'}")
+    o = report["overlap"]
+    print(f"赞我与赞他重叠 {o['users']} 人: send_like {o['send_like_calls']} 次 重复 {o['duplicate_calls']} 次 "
+          f"赞我误报失败 {o['like_me_failed_replies']} 次")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 点赞限速基准测试")
+    parser.add_argument("--targets", type=int, default=100, help="赞他的目标人数")
+    parser.add_argument("--rate", type=float, default=20.0, help="令牌桶每秒令牌数")
+    parser.add_argument("--burst", type=int, default=5, help="令牌桶突发量")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的 send_like 上限")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="模拟 OneBot 接口往返延迟(秒)")
+    parser.add_argument("--capped-ratio", type=float, default=0.1, help="返回已达上限的比例")
+    parser.add_argument("--overlap-users", type=int, default=20, help="同时赞我和被赞他的用户数")
+    parser.add_argument("--seed", type=int, default=20240701)
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    bulk, overlap = report["bulk"], report["overlap"]
+    ok = (bulk["rate_limit_held"] and bulk["steady_rate"] >= args.rate * 0.9
+          and overlap["duplicate_calls"] == 0 and overlap["like_me_failed_replies"] == 0)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
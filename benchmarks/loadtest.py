@@ -0,0 +1,517 @@
+"""XYTUFunction 离线压测工具
+
+不依赖 AstrBot / NapCat 直接加载插件的 main.py
+用桩对象模拟 AstrMessageEvent / ProviderRequest / LLMResponse 和 aiocqhttp 的消息、撤回通知
+按设定速率把消息推过 指令分发 / 撤回检测 / LLM 生命周期四个钩子
+输出各钩子延迟分位数、吞吐量和内存占用 可选输出 JSON 方便在版本之间对比
+
+用法:
+    python benchmarks/loadtest.py --rate 2000 --duration 10
+    python benchmarks/loadtest.py --rate 500 --duration 30 --llm-ratio 0.2 --json result.json
+"""
+import argparse
+import asyncio
+import enum
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from typing import Any, Dict, List, Optional, Tuple
+
+PLUGIN_MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+# ==================== AstrBot 桩对象 ====================
+class StubFilter:
+    """filter 装饰器桩 所有装饰器原样返回被装饰函数"""
+
+    class EventMessageType(enum.Enum):
+        ALL = "all"
+
+    class PlatformAdapterType(enum.Enum):
+        AIOCQHTTP = "aiocqhttp"
+
+    class PermissionType(enum.Enum):
+        ADMIN = "admin"
+        MEMBER = "member"
+
+    def __getattr__(self, name: str):
+        def decorator_factory(*args, **kwargs):
+            def decorator(func):
+                return func
+            return decorator
+        return decorator_factory
+
+class StubMessageObject:
+    __slots__ = ("raw_message", "message_id", "timestamp", "message", "group_id", "self_id")
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.raw_message = raw
+        self.message_id = str(raw.get("message_id", ""))
+        self.timestamp = raw.get("time")
+        self.message = raw.get("message", [])
+        self.group_id = str(raw.get("group_id", "") or "")
+        self.self_id = str(raw.get("self_id", ""))
+
+class StubMessageEvent:
+    """AstrMessageEvent 桩 只实现插件用到的接口"""
+
+    def __init__(self, raw: Dict[str, Any], unified_msg_origin: str, bot: Any = None):
+        self.message_obj = StubMessageObject(raw)
+        self.message_str = raw.get("raw_message", "") or ""
+        self.unified_msg_origin = unified_msg_origin
+        self.bot = bot
+        self._stopped = False
+        self._result: Any = None
+        sender = raw.get("sender") or {}
+        self._sender_id = str(raw.get("user_id", ""))
+        self._sender_name = sender.get("card") or sender.get("nickname") or self._sender_id
+        self._role = sender.get("role", "member")
+
+    def get_sender_id(self) -> str:
+        return self._sender_id
+
+    def get_sender_name(self) -> str:
+        return self._sender_name
+
+    def get_platform_name(self) -> str:
+        return "aiocqhttp"
+
+    def get_group_id(self) -> str:
+        return self.message_obj.group_id
+
+    def get_self_id(self) -> str:
+        return self.message_obj.self_id
+
+    def is_admin(self) -> bool:
+        return self._role in ("admin", "owner")
+
+    def stop_event(self) -> None:
+        self._stopped = True
+
+    def is_stopped(self) -> bool:
+        return self._stopped
+
+    def plain_result(self, text: str):
+        return ("plain", text)
+
+    def set_result(self, result: Any) -> None:
+        self._result = result
+
+    def get_result(self) -> Any:
+        return self._result
+
+    def clear_result(self) -> None:
+        self._result = None
+
+class StubPlain:
+    """message_components.Plain 桩"""
+
+    def __init__(self, text: str, **kwargs):
+        self.text = text
+
+class StubProviderRequest:
+    def __init__(self, prompt: str = ""):
+        self.prompt = prompt
+        self.contexts: List[Dict[str, Any]] = []
+
+class StubUsage:
+    __slots__ = ("completion_tokens",)
+
+    def __init__(self, completion_tokens: int):
+        self.completion_tokens = completion_tokens
+
+class StubLLMResponse:
+    def __init__(self, completion_text: str = "", completion_tokens: int = 0, role: str = "assistant"):
+        self.role = role
+        self.completion_text = completion_text
+        self.usage = StubUsage(completion_tokens)
+
+class StubProvider:
+    """模拟提供商 生成耗时在给定区间内随机 记录开始和完整跑完的调用数"""
+
+    def __init__(self, latency: Tuple[float, float], seed: int):
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.started = 0
+        self.completed = 0
+
+    async def text_chat(self, prompt: str = "", **kwargs) -> StubLLMResponse:
+        self.started += 1
+        await asyncio.sleep(self.random.uniform(*self.latency))
+        self.completed += 1
+        return StubLLMResponse("好的" * 20, completion_tokens=self.random.randint(20, 400))
+
+class StubContext:
+    def __init__(self, provider: Any = None):
+        self.provider = provider
+
+    def get_using_provider(self, umo: Optional[str] = None) -> Any:
+        return self.provider
+
+    def get_all_providers(self) -> List[Any]:
+        return [self.provider] if self.provider else []
+
+class StubMessageChain:
+    def __init__(self, chain: Optional[List[Any]] = None):
+        self.chain = list(chain or [])
+
+    def message(self, text: str) -> "StubMessageChain":
+        self.chain.append(text)
+        return self
+
+class StubOneBotAPI:
+    """模拟 NapCat 的 call_action 带可配置的往返延迟"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+
+    async def call_action(self, action: str, **params):
+        self.calls[action] = self.calls.get(action, 0) + 1
+        await asyncio.sleep(self.latency)
+        return {"status": "ok", "retcode": 0, "data": None}
+
+class StubBot:
+    def __init__(self, latency: float):
+        self.api = StubOneBotAPI(latency)
+
+class StubStar:
+    def __init__(self, context: Any):
+        self.context = context
+
+class StubStarTools:
+    _data_dir = tempfile.mkdtemp(prefix="xytu_loadtest_")
+
+    @classmethod
+    def get_data_dir(cls, name: Optional[str] = None) -> str:
+        path = os.path.join(cls._data_dir, name or "plugin")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+def install_astrbot_stubs() -> None:
+    """真实 AstrBot 不可用时注册桩模块"""
+    try:
+        import astrbot.api  # noqa: F401
+        return
+    except ImportError:
+        pass
+    modules: Dict[str, types.ModuleType] = {}
+    for name in ("astrbot", "astrbot.api", "astrbot.api.event", "astrbot.api.star", "astrbot.api.provider",
+                 "astrbot.api.message_components",
+                 "astrbot.core", "astrbot.core.platform", "astrbot.core.platform.sources",
+                 "astrbot.core.platform.sources.aiocqhttp",
+                 "astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event"):
+        modules[name] = types.ModuleType(name)
+    api = modules["astrbot.api"]
+    api.logger = logging.getLogger("astrbot")
+    api.AstrBotConfig = dict
+    event = modules["astrbot.api.event"]
+    event.filter = StubFilter()
+    event.AstrMessageEvent = StubMessageEvent
+    event.MessageChain = StubMessageChain
+    star = modules["astrbot.api.star"]
+    star.Context = object
+    star.Star = StubStar
+    star.StarTools = StubStarTools
+    star.register = lambda *args, **kwargs: (lambda cls: cls)
+    provider = modules["astrbot.api.provider"]
+    provider.LLMResponse = StubLLMResponse
+    provider.ProviderRequest = StubProviderRequest
+    modules["astrbot.api.message_components"].Plain = StubPlain
+    modules["astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event"].AiocqhttpMessageEvent = StubMessageEvent
+    sys.modules.update(modules)
+
+def load_plugin_module():
+    install_astrbot_stubs()
+    spec = importlib.util.spec_from_file_location("xytu_plugin_main", PLUGIN_MAIN)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# ==================== aiocqhttp 消息生成 ====================
+CHAT_TEXTS = [
+    "今天吃什么", "哈哈哈哈哈", "有人打本吗", "[CQ:image,file=abc.image]", "晚安", "这个好",
+    "在吗", "牛", "我也想要", "等下开黑", "6666", "？", "笑死", "确实",
+]
+
+class TrafficGenerator:
+    """生成真实结构的 aiocqhttp 消息字典和撤回通知"""
+
+    def __init__(self, groups: int, users: int, awake_word: str, seed: int):
+        self.groups = groups
+        self.users = users
+        self.awake_word = awake_word
+        self.random = random.Random(seed)
+        self.self_id = 2854196310
+        self._next_message_id = 1_000_000
+
+    def _message_id(self) -> int:
+        self._next_message_id += self.random.randint(1, 7)
+        return self._next_message_id
+
+    def message(self, text: Optional[str] = None) -> Dict[str, Any]:
+        user_id = 10000 + self.random.randrange(self.users)
+        text = text if text is not None else self.random.choice(CHAT_TEXTS)
+        private = self.random.random() < 0.1
+        raw = {
+            "post_type": "message",
+            "message_type": "private" if private else "group",
+            "sub_type": "friend" if private else "normal",
+            "time": int(time.time()),
+            "self_id": self.self_id,
+            "user_id": user_id,
+            "message_id": self._message_id(),
+            "message": [{"type": "text", "data": {"text": text}}],
+            "raw_message": text,
+            "font": 0,
+            "sender": {"user_id": user_id, "nickname": f"用户{user_id}", "card": "", "role": "member"},
+        }
+        if not private:
+            raw["group_id"] = 700000 + self.random.randrange(self.groups)
+        return raw
+
+    def command(self, trigger: str) -> Dict[str, Any]:
+        return self.message(f"{self.awake_word} {trigger}")
+
+    def recall(self, original: Dict[str, Any]) -> Dict[str, Any]:
+        raw = {
+            "post_type": "notice",
+            "time": int(time.time()),
+            "self_id": self.self_id,
+            "message_id": original["message_id"],
+            "user_id": original["user_id"],
+        }
+        if original.get("group_id"):
+            raw["notice_type"] = "group_recall"
+            raw["group_id"] = original["group_id"]
+            raw["operator_id"] = original["user_id"]
+        else:
+            raw["notice_type"] = "friend_recall"
+        return raw
+
+    @staticmethod
+    def session(raw: Dict[str, Any]) -> str:
+        if raw.get("group_id"):
+            return f"aiocqhttp:GroupMessage:{raw['group_id']}"
+        return f"aiocqhttp:FriendMessage:{raw['user_id']}"
+
+# ==================== 压测驱动 ====================
+class LatencyRecorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    def add(self, hook: str, seconds: float) -> None:
+        self.samples.setdefault(hook, []).append(seconds)
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], q: float) -> float:
+        if not sorted_values:
+            return 0.0
+        index = min(int(q * len(sorted_values)), len(sorted_values) - 1)
+        return sorted_values[index]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for hook, values in sorted(self.samples.items()):
+            values = sorted(values)
+            result[hook] = {
+                "count": len(values),
+                "mean_us": sum(values) / len(values) * 1e6,
+                "p50_us": self._percentile(values, 0.50) * 1e6,
+                "p90_us": self._percentile(values, 0.90) * 1e6,
+                "p99_us": self._percentile(values, 0.99) * 1e6,
+                "max_us": values[-1] * 1e6,
+            }
+        return result
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.module = load_plugin_module()
+        config = {
+            "awake_words": ["XYTU", "XYTUFT"],
+            "recall_prevention_enabled": True,
+            "status_enabled": True,
+            "status_trigger_words": ["状态", "status"],
+            "like_enabled": True,
+            "like_trigger_words": ["赞我", "zanwo"],
+            "recall_grace_mode": args.grace_mode,
+        }
+        self.provider = StubProvider(tuple(args.llm_latency), args.seed + 2)
+        self.plugin = self.module.XYTUFunctionPlugin(StubContext(self.provider), config)
+        self.traffic = TrafficGenerator(args.groups, args.users, "XYTU", args.seed)
+        self.bot = StubBot(args.api_latency)
+        self.latency = LatencyRecorder()
+        self.random = random.Random(args.seed + 1)
+        self.recent_llm: List[Dict[str, Any]] = []
+        self.messages_sent = 0
+        self.replies_blocked = 0
+        self.errors = 0
+
+    async def _timed(self, hook: str, coro) -> Any:
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.latency.add(hook, time.perf_counter() - start)
+
+    async def _drain(self, hook: str, agen) -> None:
+        start = time.perf_counter()
+        try:
+            async for _ in agen:
+                pass
+        finally:
+            self.latency.add(hook, time.perf_counter() - start)
+
+    def _event(self, raw: Dict[str, Any]) -> StubMessageEvent:
+        return StubMessageEvent(raw, self.traffic.session(raw), self.bot)
+
+    async def _handle_message(self, raw: Dict[str, Any], llm: bool) -> None:
+        try:
+            event = self._event(raw)
+            await self._timed("on_all_message", self.plugin.on_all_message(event))
+            await self._drain("on_message_command", self.plugin.on_message_command(event))
+            if not llm or event.is_stopped():
+                return
+            self.recent_llm.append(raw)
+            if len(self.recent_llm) > 256:
+                del self.recent_llm[:128]
+            await self._timed("on_llm_request", self.plugin.on_llm_request(event, StubProviderRequest(raw["raw_message"])))
+            if event.is_stopped():
+                self.replies_blocked += 1
+                return
+            # 与 AstrBot 一样在同一个任务里调用提供商 撤回会取消进行中的调用
+            response = await self.provider.text_chat(prompt=raw["raw_message"])
+            await self._timed("on_llm_response", self.plugin.on_llm_response(event, response))
+            await self._timed("on_decorating_result", self.plugin.on_decorating_result(event))
+            if event.is_stopped():
+                self.replies_blocked += 1
+                return
+            await self._timed("after_message_sent", self.plugin.after_message_sent(event))
+        except Exception:
+            self.errors += 1
+            logging.getLogger("loadtest").exception("处理消息出错")
+
+    async def _handle_recall(self) -> None:
+        if not self.recent_llm:
+            return
+        original = self.random.choice(self.recent_llm)
+        event = self._event(self.traffic.recall(original))
+        await self._timed("on_all_message[recall]", self.plugin.on_all_message(event))
+
+    def _next_raw(self):
+        roll = self.random.random()
+        if roll < self.args.command_ratio / 2:
+            return self.traffic.command("状态"), False
+        if roll < self.args.command_ratio:
+            return self.traffic.command("赞我"), False
+        return self.traffic.message(), self.random.random() < self.args.llm_ratio
+
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        tasks = set()
+        tick = 0.001
+        tracemalloc.start()
+        baseline_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        deadline = start + args.duration
+        due = 0.0
+        now = start
+        while now < deadline:
+            # 开环发送 按实际流逝时间补齐应发送的消息数
+            due += args.rate * tick
+            while due >= 1:
+                due -= 1
+                if self.random.random() < args.recall_ratio:
+                    task = asyncio.ensure_future(self._handle_recall())
+                else:
+                    raw, llm = self._next_raw()
+                    task = asyncio.ensure_future(self._handle_message(raw, llm))
+                    self.messages_sent += 1
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.sleep(tick)
+            tick = max(time.perf_counter() - now, 0.001)
+            now = time.perf_counter()
+        send_elapsed = time.perf_counter() - start
+        if tasks:
+            await asyncio.wait(tasks)
+        total_elapsed = time.perf_counter() - start
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        state_pending, state_recalled = await self.plugin._state.get_stats()
+        stats = self.plugin._stats
+        await self.plugin.terminate()
+        return {
+            "version": 1,
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "config": {k: v for k, v in vars(args).items() if k != "json"},
+            "messages": self.messages_sent,
+            "send_seconds": send_elapsed,
+            "total_seconds": total_elapsed,
+            "throughput_msgs_per_s": self.messages_sent / send_elapsed if send_elapsed else 0.0,
+            "replies_blocked": self.replies_blocked,
+            "errors": self.errors,
+            "like_api_calls": self.bot.api.calls.get("send_like", 0),
+            "provider_calls": {"started": self.provider.started, "completed": self.provider.completed},
+            "memory": {
+                "retained_bytes": current_memory - baseline_memory,
+                "peak_bytes": peak_memory - baseline_memory,
+            },
+            "state": {"pending": state_pending, "recalled": state_recalled},
+            "plugin_stats": {name: getattr(stats, name) for name in stats.__dataclass_fields__},
+            "hooks": self.latency.summary(),
+        }
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"消息数: {report['messages']}  发送耗时: {report['send_seconds']:.2f}s  "
+          f"吞吐: {report['throughput_msgs_per_s']:.0f} msg/s  错误: {report['errors']}")
+    print(f"内存: 保留 {report['memory']['retained_bytes'] / 1024:.1f} KiB  峰值 {report['memory']['peak_bytes'] / 1024:.1f} KiB  "
+          f"状态: 待处理 {report['state']['pending']} 已撤回 {report['state']['recalled']}")
+    print(f"提供商调用: 开始 {report['provider_calls']['started']} 完成 {report['provider_calls']['completed']}  "
+          f"撤回取消 {report['plugin_stats']['generations_cancelled']}")
+    print(f"{'钩子':<26}{'次数':>9}{'mean':>11}{'p50':>11}{'p90':>11}{'p99':>11}{'max':>11}  (us)")
+    for hook, row in report["hooks"].items():
+        print(f"{hook:<26}{row['count']:>9}{row['mean_us']:>11.1f}{row['p50_us']:>11.1f}"
+              f"{row['p90_us']:>11.1f}{row['p99_us']:>11.1f}{row['max_us']:>11.1f}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 离线压测")
+    parser.add_argument("--rate", type=float, default=1000.0, help="每秒推送的消息数")
+    parser.add_argument("--duration", type=float, default=5.0, help="推送持续时间(秒)")
+    parser.add_argument("--groups", type=int, default=200, help="模拟的群数量")
+    parser.add_argument("--users", type=int, default=5000, help="模拟的用户数量")
+    parser.add_argument("--command-ratio", type=float, default=0.005, help="指令消息(状态/赞我)占比")
+    parser.add_argument("--llm-ratio", type=float, default=0.05, help="触发 LLM 请求的消息占比")
+    parser.add_argument("--recall-ratio", type=float, default=0.01, help="撤回通知占比")
+    parser.add_argument("--llm-latency", type=float, nargs=2, default=(0.2, 1.5), metavar=("MIN", "MAX"),
+                        help="模拟提供商生成耗时范围(秒)")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="模拟 NapCat API 往返延迟(秒)")
+    parser.add_argument("--grace-mode", default="adaptive", choices=("adaptive", "fixed", "off"))
+    parser.add_argument("--seed", type=int, default=20240701)
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(LoadTest(args).run())
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
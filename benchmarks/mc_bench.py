@@ -0,0 +1,195 @@
+"""Minecraft 服务器查询基准测试
+
+在本机启动假的 Minecraft 服务器 实现 Server List Ping 的握手、状态和 ping 包 每次响应前等待固定延迟
+检查 MinecraftPinger 的:
+1. 合并: 同一台服务器的大量并发查询只建立一次连接 TTL 内的重复查询不再连接
+2. 并行: 多台服务器同时查询 不超过并发上限时总耗时约等于单台的响应延迟 而不是之和
+3. 拒绝连接: 没有监听的端口很快返回错误 不影响同一批里的其他服务器
+4. 解析: 版本、在线人数、玩家列表和去掉格式符后的 MOTD 与假服务器返回的一致
+
+用法:
+    python benchmarks/mc_bench.py
+    python benchmarks/mc_bench.py --servers 10 --concurrent 50 --latency 0.2 --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import load_plugin_module  # noqa: E402
+
+STATUS = {
+    "version": {"name": "Paper 1.20.4", "protocol": 765},
+    "players": {"max": 100, "online": 3, "sample": [{"name": "Steve", "id": "0"}, {"name": "Alex", "id": "1"}]},
+    "description": {"text": "§aXYTU §r测试服", "extra": [{"text": " 欢迎"}]},
+}
+
+class StubMinecraftServer:
+    """假的 Minecraft 服务器 记录每个端口的连接数和同时处理中的连接数"""
+
+    def __init__(self, module: Any, latency: float):
+        self.module = module
+        self.latency = latency
+        self.connections: Dict[int, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._servers: List[asyncio.AbstractServer] = []
+
+    async def open(self, count: int) -> List[int]:
+        ports = []
+        for _ in range(count):
+            server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+            self._servers.append(server)
+            ports.append(server.sockets[0].getsockname()[1])
+        return ports
+
+    async def _read_packet(self, reader: asyncio.StreamReader) -> bytes:
+        length = await self.module._mc_read_varint(reader)
+        return await reader.readexactly(length)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        port = writer.get_extra_info("sockname")[1]
+        self.connections[port] = self.connections.get(port, 0) + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await self._read_packet(reader)  # 握手
+            await self._read_packet(reader)  # 状态请求
+            await asyncio.sleep(self.latency)
+            body = self.module._mc_pack_string(json.dumps(STATUS, ensure_ascii=False))
+            writer.write(self.module._mc_packet(0x00, body))
+            await writer.drain()
+            ping = await self._read_packet(reader)
+            writer.write(self.module._mc_packet(0x01, ping[1:9]))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.in_flight -= 1
+            writer.close()
+
+    def reset(self) -> None:
+        self.connections.clear()
+        self.max_in_flight = 0
+
+    async def close(self) -> None:
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+
+def closed_port() -> int:
+    """拿到一个当前没有监听的端口 连接会被立即拒绝"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+async def check_coalesce(module: Any, server: StubMinecraftServer, port: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """同一台服务器的并发查询合并为一次连接 TTL 内再查也不连接"""
+    pinger = module.MinecraftPinger(args.timeout, args.ttl, allow_private=True)
+    server.reset()
+    begin = time.perf_counter()
+    results = await asyncio.gather(*(pinger.query("127.0.0.1", port) for _ in range(args.concurrent)))
+    elapsed = time.perf_counter() - begin
+    burst = server.connections.get(port, 0)
+    await pinger.query("127.0.0.1", port)
+    cached = server.connections.get(port, 0)
+    return {
+        "concurrent_queries": args.concurrent,
+        "connections": burst,
+        "connections_after_cached_query": cached,
+        "seconds": elapsed,
+        "same_result": all(r is results[0] for r in results),
+        "passed": burst == 1 and cached == 1 and all(r is results[0] for r in results),
+    }
+
+async def check_parallel(module: Any, server: StubMinecraftServer, ports: List[int], args: argparse.Namespace) -> Dict[str, Any]:
+    """多台服务器同时查询 混入一个拒绝连接的端口"""
+    pinger = module.MinecraftPinger(args.timeout, 0, allow_private=True)
+    refused = closed_port()
+    targets = [("127.0.0.1", port) for port in ports] + [("127.0.0.1", refused)]
+    server.reset()
+    begin = time.perf_counter()
+    results = await pinger.query_many(targets)
+    elapsed = time.perf_counter() - begin
+    statuses = [r for r in results[:-1] if isinstance(r, module.MinecraftStatus)]
+    refused_result = results[-1]
+    first = statuses[0] if statuses else None
+    parsed_ok = first is not None and (
+        first.version == "Paper 1.20.4" and first.online == 3 and first.max_players == 100
+        and first.players == ["Steve", "Alex"] and first.motd == "XYTU 测试服 欢迎"
+    )
+    refused_ok = isinstance(refused_result, ConnectionRefusedError)
+    # 超过并发上限的服务器排到下一轮
+    waves = -(-len(ports) // module.MC_QUERY_CONCURRENCY)
+    return {
+        "servers": len(ports),
+        "succeeded": len(statuses),
+        "seconds": elapsed,
+        "server_latency": args.latency,
+        "expected_seconds": args.latency * waves,
+        "sequential_estimate": args.latency * len(ports),
+        "max_in_flight": server.max_in_flight,
+        "refused": type(refused_result).__name__,
+        "parsed": parsed_ok,
+        "passed": (len(statuses) == len(ports) and refused_ok and parsed_ok
+                   and server.max_in_flight == min(len(ports), module.MC_QUERY_CONCURRENCY)
+                   and elapsed < args.latency * (waves + 0.5) + 0.05),
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    server = StubMinecraftServer(module, args.latency)
+    try:
+        ports = await server.open(args.servers)
+        return {
+            "coalesce": await check_coalesce(module, server, ports[0], args),
+            "parallel": await check_parallel(module, server, ports, args),
+        }
+    finally:
+        await server.close()
+
+def print_report(report: Dict[str, Any]) -> None:
+    c = report["coalesce"]
+    print(f"合并: {c['concurrent_queries']} 个并发查询 建立连接 {c['connections']} 次 "
+          f"TTL 内再查后 {c['connections_after_cached_query']} 次 用时 {c['seconds'] * 1000:.0f}ms "
+          f"{'通过' if c['passed'] else '失败'}")
+    p = report["parallel"]
+    print(f"并行: {p['servers']} 台服务器 成功 {p['succeeded']} 用时 {p['seconds'] * 1000:.0f}ms "
+          f"(预期 {p['expected_seconds'] * 1000:.0f}ms 逐个约 {p['sequential_estimate'] * 1000:.0f}ms) "
+          f"同时连接最多 {p['max_in_flight']} | 未监听端口: {p['refused']} | 解析{'正确' if p['parsed'] else '错误'} "
+          f"{'通过' if p['passed'] else '失败'}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction Minecraft 服务器查询基准测试")
+    parser.add_argument("--servers", type=int, default=10, help="同时查询的假服务器数")
+    parser.add_argument("--concurrent", type=int, default=50, help="合并检查中同一台服务器的并发查询数")
+    parser.add_argument("--latency", type=float, default=0.2, help="假服务器的响应延迟(秒)")
+    parser.add_argument("--timeout", type=float, default=3.0, help="查询超时(秒)")
+    parser.add_argument("--ttl", type=float, default=30.0, help="合并检查使用的缓存 TTL(秒)")
+    parser.add_argument("--seed", type=int, default=20240701, help="保留参数 与其他压测脚本一致")
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report["coalesce"]["passed"] and report["parallel"]["passed"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""待处理请求记录内存基准测试
+
+用 tracemalloc 测量跟踪大量 LLM 请求时撤回状态存储常驻的内存
+对比两种实现:
+- old: 记录强引用整个事件(消息链、图片等)的旧实现 见 recall_state_bench.LegacyRecallStateManager
+- new: 当前插件的实现 __slots__ 记录 只保存事件的弱引用 会话字符串驻留
+流程: 生成带消息链和图片数据的事件 全部登记为待处理请求 然后丢掉事件本身的引用
+(模拟 LLM 调用失败、流水线结束但记录还没等到清理) 统计此时每条记录仍占用的字节数
+
+用法:
+    python benchmarks/pending_memory_bench.py
+    python benchmarks/pending_memory_bench.py --records 100000 --sessions 2000 --payload-bytes 4096 --json -
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import CHAT_TEXTS, StubMessageEvent, load_plugin_module  # noqa: E402
+from recall_state_bench import LegacyRecallStateManager  # noqa: E402
+
+def make_event(rng: random.Random, index: int, sessions: int, payload_bytes: int) -> StubMessageEvent:
+    group_id = 700000 + index % sessions
+    text = rng.choice(CHAT_TEXTS)
+    # 模拟消息里带的图片 真实消息链里通常是 base64 或下载后的字节
+    image = rng.randbytes(payload_bytes).hex()[:payload_bytes] if payload_bytes else ""
+    raw = {
+        "post_type": "message", "message_type": "group", "sub_type": "normal", "time": int(time.time()),
+        "self_id": 20000, "user_id": 10000 + index, "group_id": group_id, "message_id": 1_000_000 + index,
+        "message": [{"type": "text", "data": {"text": text}}, {"type": "image", "data": {"file": image}}],
+        "raw_message": text, "font": 0,
+        "sender": {"user_id": 10000 + index, "nickname": f"用户{index}", "card": "", "role": "member"},
+    }
+    # 每个事件各自拼出会话字符串 和 AstrBot 里每条消息独立构造一致
+    return StubMessageEvent(raw, "aiocqhttp:GroupMessage:" + str(group_id))
+
+async def measure(state: Any, args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    events = [make_event(rng, i, args.sessions, args.payload_bytes) for i in range(args.records)]
+    for event in events:
+        await state.add_pending_request(event.message_obj.message_id, event.unified_msg_origin,
+                                        event.get_sender_id(), event)
+    with_events = tracemalloc.get_traced_memory()[0] - before
+    # 流水线结束后事件只剩状态存储还可能引用
+    del events, event
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    pending, _ = await state.get_stats()
+    return {
+        "records": pending,
+        "bytes_with_events": with_events,
+        "bytes_retained": retained,
+        "bytes_per_message": retained / max(pending, 1),
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    report = {"old": await measure(LegacyRecallStateManager(), args)}
+    report["new"] = await measure(module.RecallStateManager(args.records), args)
+    report["reduction"] = report["old"]["bytes_per_message"] / max(report["new"]["bytes_per_message"], 1)
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    for name in ("old", "new"):
+        r = report[name]
+        print(f"{name}: {r['records']} 条记录 | 事件存活时 {r['bytes_with_events'] / 1024 / 1024:.1f} MiB | "
+              f"事件释放后 {r['bytes_retained'] / 1024 / 1024:.1f} MiB | 每条 {r['bytes_per_message']:.0f} 字节")
+    print(f"每条记录内存减少 {report['reduction']:.1f}x")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 待处理请求记录内存基准测试")
+    parser.add_argument("--records", type=int, default=100000, help="跟踪的待处理请求数")
+    parser.add_argument("--sessions", type=int, default=2000, help="会话数")
+    parser.add_argument("--payload-bytes", type=int, default=1024, help="每条消息附带的图片数据大小")
+    parser.add_argument("--seed", type=int, default=20240701)
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report["new"]["bytes_per_message"] < report["old"]["bytes_per_message"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
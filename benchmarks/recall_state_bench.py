@@ -0,0 +1,215 @@
+"""撤回状态存储吞吐量基准测试
+
+对比两种 RecallStateManager:
+- old: 分片之前的实现 所有读写都经过同一把 asyncio.Lock 每次调用拼接 f-string 键 过期清理全表扫描
+- new: 当前插件的实现 按 unified_msg_origin 分片 无锁 按写入顺序的队列做过期清理
+每个会话一个协程 模拟一次完整的 LLM 生命周期(登记请求 / 请求阶段检查 / 响应阶段检查 / 发送前检查 / 移除)
+按比例插入撤回 期间周期性执行过期清理 分两轮:
+- interleaved: 每个操作之间让出一次事件循环 模拟多群消息交错 吞吐量大部分花在事件循环调度上
+- tight: 操作之间不让出 吞吐量只反映状态存储本身的开销
+输出每秒操作数、单次操作耗时分位数和结束时的记录数
+
+用法:
+    python benchmarks/recall_state_bench.py
+    python benchmarks/recall_state_bench.py --sessions 20000 --rounds 5 --recall-ratio 0.05 --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import load_plugin_module  # noqa: E402
+
+# ==================== 分片之前的实现 ====================
+@dataclass
+class LegacyPendingRequest:
+    message_id: str
+    unified_msg_origin: str
+    sender_id: str
+    timestamp: float
+    event: Any = None
+
+@dataclass
+class LegacyRecalledMessage:
+    message_id: str
+    unified_msg_origin: str
+    operator_id: str
+    timestamp: float
+
+class LegacyRecallStateManager:
+    """分片之前的撤回状态管理器 全局锁 + 拼接字符串键"""
+
+    def __init__(self):
+        self._pending_requests: Dict[str, LegacyPendingRequest] = {}
+        self._recalled_messages: Dict[str, LegacyRecalledMessage] = {}
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _compose_key(unified_msg_origin: str, message_id: str) -> str:
+        return f"{unified_msg_origin}::{message_id}"
+
+    async def add_pending_request(self, message_id: str, unified_msg_origin: str, sender_id: str,
+                                  event: Any = None) -> None:
+        key = self._compose_key(unified_msg_origin, message_id)
+        async with self._lock:
+            self._pending_requests[key] = LegacyPendingRequest(message_id, unified_msg_origin, sender_id, time.time(), event)
+
+    async def remove_pending_request(self, message_id: str, unified_msg_origin: str) -> Optional[LegacyPendingRequest]:
+        key = self._compose_key(unified_msg_origin, message_id)
+        async with self._lock:
+            return self._pending_requests.pop(key, None)
+
+    async def get_pending_request(self, message_id: str, unified_msg_origin: str) -> Optional[LegacyPendingRequest]:
+        key = self._compose_key(unified_msg_origin, message_id)
+        async with self._lock:
+            return self._pending_requests.get(key)
+
+    async def add_recalled_message(self, message_id: str, unified_msg_origin: str, operator_id: str) -> None:
+        key = self._compose_key(unified_msg_origin, message_id)
+        async with self._lock:
+            self._recalled_messages[key] = LegacyRecalledMessage(message_id, unified_msg_origin, operator_id, time.time())
+
+    async def is_recalled(self, message_id: str, unified_msg_origin: str) -> bool:
+        key = self._compose_key(unified_msg_origin, message_id)
+        async with self._lock:
+            return key in self._recalled_messages
+
+    async def cleanup_expired(self, expire_seconds: float = 300) -> int:
+        now = time.time()
+        cleaned = 0
+        async with self._lock:
+            for table in (self._pending_requests, self._recalled_messages):
+                expired = [k for k, v in table.items() if now - v.timestamp > expire_seconds]
+                for k in expired:
+                    del table[k]
+                    cleaned += 1
+        return cleaned
+
+    async def get_stats(self) -> Tuple[int, int]:
+        async with self._lock:
+            return len(self._pending_requests), len(self._recalled_messages)
+
+# ==================== 压测驱动 ====================
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+class Workload:
+    def __init__(self, state: Any, args: argparse.Namespace, interleave: bool):
+        self.state = state
+        self.args = args
+        self.interleave = interleave
+        self.random = random.Random(args.seed)
+        self.ops = 0
+        self.latencies: List[float] = []
+        self.recalls = 0
+
+    async def _op(self, coro) -> Any:
+        started = time.perf_counter()
+        result = await coro
+        elapsed = time.perf_counter() - started
+        self.ops += 1
+        # 全部记录太占内存 按固定比例抽样
+        if self.ops % self.args.sample_every == 0:
+            self.latencies.append(elapsed)
+        if self.interleave:
+            await asyncio.sleep(0)
+        return result
+
+    async def session(self, index: int) -> None:
+        umo = f"aiocqhttp:GroupMessage:{700000 + index}"
+        for round_index in range(self.args.rounds):
+            message_id = str(1_000_000 + index * self.args.rounds + round_index)
+            await self._op(self.state.add_pending_request(message_id, umo, str(10000 + index)))
+            await self._op(self.state.is_recalled(message_id, umo))
+            if self.random.random() < self.args.recall_ratio:
+                self.recalls += 1
+                await self._op(self.state.add_recalled_message(message_id, umo, str(10000 + index)))
+            await self._op(self.state.get_pending_request(message_id, umo))
+            await self._op(self.state.is_recalled(message_id, umo))
+            await self._op(self.state.is_recalled(message_id, umo))
+            await self._op(self.state.remove_pending_request(message_id, umo))
+
+    async def cleaner(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            await asyncio.sleep(self.args.cleanup_every)
+            await self._op(self.state.cleanup_expired(self.args.expire_seconds))
+
+async def run_impl(state: Any, args: argparse.Namespace, interleave: bool) -> Dict[str, Any]:
+    workload = Workload(state, args, interleave)
+    stop = asyncio.Event()
+    cleaner = asyncio.ensure_future(workload.cleaner(stop))
+    begin = time.perf_counter()
+    await asyncio.gather(*(workload.session(i) for i in range(args.sessions)))
+    elapsed = time.perf_counter() - begin
+    stop.set()
+    await cleaner
+    pending, recalled = await state.get_stats()
+    return {
+        "sessions": args.sessions,
+        "operations": workload.ops,
+        "seconds": elapsed,
+        "ops_per_second": workload.ops / elapsed,
+        "op_p50_us": percentile(workload.latencies, 0.50) * 1e6,
+        "op_p99_us": percentile(workload.latencies, 0.99) * 1e6,
+        "op_max_us": max(workload.latencies) * 1e6 if workload.latencies else 0.0,
+        "recalls": workload.recalls,
+        "pending_left": pending,
+        "recalled_left": recalled,
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    max_records = args.sessions * args.rounds * 2
+    report: Dict[str, Any] = {}
+    for phase, interleave in (("interleaved", True), ("tight", False)):
+        old = await run_impl(LegacyRecallStateManager(), args, interleave)
+        new = await run_impl(module.RecallStateManager(max_records), args, interleave)
+        report[phase] = {"old": old, "new": new, "speedup": new["ops_per_second"] / old["ops_per_second"]}
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    for phase, result in report.items():
+        print(f"[{phase}]")
+        for name in ("old", "new"):
+            r = result[name]
+            print(f"  {name}: {r['sessions']} 个会话 {r['operations']} 次操作 用时 {r['seconds']:.2f}s "
+                  f"{r['ops_per_second']:.0f} 次/s | 单次 p50 {r['op_p50_us']:.2f}us p99 {r['op_p99_us']:.2f}us "
+                  f"max {r['op_max_us']:.0f}us | 剩余 待处理 {r['pending_left']} 已撤回 {r['recalled_left']}")
+        print(f"  吞吐量提升 {result['speedup']:.2f}x")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 撤回状态存储吞吐量基准测试")
+    parser.add_argument("--sessions", type=int, default=20000, help="同时活跃的会话数")
+    parser.add_argument("--rounds", type=int, default=3, help="每个会话的 LLM 请求数")
+    parser.add_argument("--recall-ratio", type=float, default=0.05, help="被撤回的请求比例")
+    parser.add_argument("--cleanup-every", type=float, default=0.2, help="过期清理间隔(秒)")
+    parser.add_argument("--expire-seconds", type=float, default=300.0, help="记录过期时间(秒)")
+    parser.add_argument("--sample-every", type=int, default=7, help="每隔多少次操作记录一次耗时")
+    parser.add_argument("--seed", type=int, default=20240701)
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    tight = report["tight"]
+    return 0 if tight["speedup"] >= 1.0 and tight["new"]["pending_left"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
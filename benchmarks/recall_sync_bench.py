@@ -0,0 +1,179 @@
+"""跨进程撤回同步基准测试
+
+启动一个发布进程和若干订阅进程 都以 sqlite 撤回后端加载插件
+发布进程按固定间隔处理撤回通知 订阅进程记录本进程感知到该撤回的时刻 统计传播延迟
+另外对比内存状态查询和直接查询 SQLite 的单次耗时 以及没有进行中请求时轮询的 CPU 占用
+
+用法:
+    python benchmarks/recall_sync_bench.py
+    python benchmarks/recall_sync_bench.py --subscribers 3 --recalls 500 --poll-ms 2 --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import StubMessageEvent, load_plugin_module  # noqa: E402
+
+UMO = "aiocqhttp:GroupMessage:1"
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+def make_config(path: str, poll_ms: float) -> Dict[str, Any]:
+    return {
+        "recall_prevention_enabled": True,
+        "recall_state_backend": "sqlite",
+        "recall_shared_path": path,
+        "recall_shared_poll_ms": poll_ms,
+        "recall_grace_mode": "off",
+    }
+
+def recall_notice(message_id: str) -> StubMessageEvent:
+    raw = {
+        "post_type": "notice", "notice_type": "group_recall", "message_id": message_id, "time": int(time.time()),
+        "group_id": 1, "user_id": 10001, "operator_id": 10001, "self_id": 20000,
+    }
+    return StubMessageEvent(raw, UMO)
+
+def subscriber(path: str, poll_ms: float, expected: int, ready, results, idle_seconds: float) -> None:
+    async def run() -> Dict[str, Any]:
+        module = load_plugin_module()
+        plugin = module.XYTUFunctionPlugin(None, make_config(path, poll_ms))
+        delays: List[float] = []
+        notify = plugin._grace.notify_recall
+
+        def timed_notify(message_id: str, umo: str, recalled_at: Optional[float] = None) -> None:
+            # 消息 ID 里带着发布时刻
+            delays.append(time.time() - float(message_id.split("_")[1]))
+            notify(message_id, umo, recalled_at)
+
+        plugin._grace.notify_recall = timed_notify
+        await asyncio.sleep(0.2)
+        cpu = time.process_time()
+        await asyncio.sleep(idle_seconds)
+        idle_cpu = time.process_time() - cpu
+        # 有进行中的 LLM 请求时才按 poll_ms 快速轮询
+        await plugin._state.add_pending_request("generating", UMO, "10001")
+        ready.set()
+        deadline = time.monotonic() + 60
+        while len(delays) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await plugin.terminate()
+        return {"delays": delays, "idle_cpu_s": idle_cpu}
+
+    logging.basicConfig(level=logging.WARNING)
+    results.put(asyncio.run(run()))
+
+async def publish(path: str, args: argparse.Namespace) -> None:
+    module = load_plugin_module()
+    plugin = module.XYTUFunctionPlugin(None, make_config(path, args.poll_ms))
+    for i in range(args.recalls):
+        await plugin.on_all_message(recall_notice(f"{i}_{time.time():.6f}"))
+        await asyncio.sleep(args.interval)
+    await plugin.terminate()
+
+async def bench_lookup(args: argparse.Namespace, path: str) -> Dict[str, float]:
+    """已有 records 条撤回记录时 单次查询一条不存在的消息的耗时"""
+    module = load_plugin_module()
+    state = module.RecallStateManager(args.records * 2)
+    for i in range(args.records):
+        await state.add_recalled_message(str(i), UMO, "1")
+    begin = time.perf_counter()
+    for i in range(args.lookups):
+        await state.is_recalled(str(-i), UMO)
+    memory = (time.perf_counter() - begin) / args.lookups
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS lookup (umo TEXT, message_id TEXT, PRIMARY KEY (umo, message_id)) WITHOUT ROWID")
+    conn.executemany("INSERT OR IGNORE INTO lookup VALUES (?, ?)", ((UMO, str(i)) for i in range(args.records)))
+    begin = time.perf_counter()
+    for i in range(args.lookups):
+        conn.execute("SELECT 1 FROM lookup WHERE umo = ? AND message_id = ?", (UMO, str(-i))).fetchone()
+    direct = (time.perf_counter() - begin) / args.lookups
+    begin = time.perf_counter()
+    for _ in range(args.lookups):
+        conn.execute("PRAGMA data_version").fetchone()
+    version = (time.perf_counter() - begin) / args.lookups
+    conn.close()
+    return {"memory_us": memory * 1e6, "sqlite_point_query_us": direct * 1e6, "data_version_poll_us": version * 1e6}
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="xytu_recall_") as tmp:
+        path = os.path.join(tmp, "recall.db")
+        report: Dict[str, Any] = {"lookup": asyncio.run(bench_lookup(args, os.path.join(tmp, "lookup.db")))}
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        events = [ctx.Event() for _ in range(args.subscribers)]
+        processes = [
+            ctx.Process(target=subscriber, args=(path, args.poll_ms, args.recalls, ready, results, args.idle))
+            for ready in events
+        ]
+        for process in processes:
+            process.start()
+        for ready in events:
+            ready.wait(60)
+        asyncio.run(publish(path, args))
+        outputs = [results.get(timeout=120) for _ in processes]
+        for process in processes:
+            process.join()
+    delays = [d for output in outputs for d in output["delays"]]
+    report["propagation"] = {
+        "subscribers": args.subscribers,
+        "recalls": args.recalls,
+        "received": len(delays),
+        "poll_ms": args.poll_ms,
+        "p50_ms": percentile(delays, 0.50) * 1000,
+        "p99_ms": percentile(delays, 0.99) * 1000,
+        "max_ms": max(delays) * 1000 if delays else 0.0,
+    }
+    idle = [output["idle_cpu_s"] for output in outputs]
+    report["idle_cpu_percent"] = sum(idle) / len(idle) / args.idle * 100 if idle else 0.0
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    lookup = report["lookup"]
+    print(f"单次查询: 内存 {lookup['memory_us']:.2f}us | SQLite 主键查询 {lookup['sqlite_point_query_us']:.2f}us | "
+          f"data_version 轮询 {lookup['data_version_poll_us']:.2f}us")
+    p = report["propagation"]
+    print(f"传播延迟 ({p['subscribers']} 个订阅进程 轮询 {p['poll_ms']}ms 收到 {p['received']}/{p['recalls'] * p['subscribers']}): "
+          f"p50 {p['p50_ms']:.2f}ms | p99 {p['p99_ms']:.2f}ms | max {p['max_ms']:.2f}ms")
+    print(f"空闲轮询 CPU: {report['idle_cpu_percent']:.2f}%")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 跨进程撤回同步基准测试")
+    parser.add_argument("--subscribers", type=int, default=2, help="订阅进程数")
+    parser.add_argument("--recalls", type=int, default=200, help="发布的撤回数")
+    parser.add_argument("--interval", type=float, default=0.01, help="撤回发布间隔(秒)")
+    parser.add_argument("--poll-ms", type=float, default=5.0, help="recall_shared_poll_ms")
+    parser.add_argument("--idle", type=float, default=3.0, help="空闲 CPU 测量时长(秒)")
+    parser.add_argument("--records", type=int, default=10000, help="查询测试时已有的撤回记录数")
+    parser.add_argument("--lookups", type=int, default=100000, help="查询测试次数")
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = run(args)
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report["propagation"]["received"] == args.recalls * args.subscribers else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
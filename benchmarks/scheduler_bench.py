@@ -0,0 +1,177 @@
+"""定时任务调度器基准测试
+
+在临时 SQLite 里预置大量定时任务 模拟插件重启后由 JobScheduler 接管
+测量启动载入耗时、内存中的任务数、空闲期间的 CPU 占用 以及积压任务的派发速率
+同时给出每个任务一个 asyncio.sleep 协程的做法作为对照
+
+用法:
+    python benchmarks/scheduler_bench.py --jobs 100000 --idle 10
+    python benchmarks/scheduler_bench.py --jobs 100000 --burst 5000 --max-per-tick 500 --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import load_plugin_module  # noqa: E402
+
+def populate(path: str, jobs: int, start: float, spread: float, seed: int) -> float:
+    """直接写数据库 相当于上次运行时创建好的任务"""
+    rng = random.Random(seed)
+    begin = time.perf_counter()
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, next_run REAL NOT NULL, interval REAL NOT NULL, "
+        "umo TEXT NOT NULL, creator TEXT NOT NULL, content TEXT NOT NULL)"
+    )
+    rows = (
+        (start + rng.random() * spread, rng.choice((0.0, 0.0, 3600.0, 86400.0)),
+         f"aiocqhttp:GroupMessage:{rng.randrange(2000)}", str(rng.randrange(100000)), "群提醒")
+        for _ in range(jobs)
+    )
+    conn.executemany("INSERT INTO jobs (next_run, interval, umo, creator, content) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_next_run ON jobs (next_run)")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_umo ON jobs (umo)")
+    conn.commit()
+    conn.close()
+    return time.perf_counter() - begin
+
+async def measure_idle(seconds: float) -> Dict[str, float]:
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    await asyncio.sleep(seconds)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    return {"wall_s": wall, "cpu_s": cpu, "cpu_percent": cpu / wall * 100}
+
+async def bench_scheduler(module: Any, args: argparse.Namespace, path: str) -> Dict[str, Any]:
+    dispatched: List[float] = []
+
+    async def handler(job) -> None:
+        dispatched.append(time.time())
+
+    report: Dict[str, Any] = {}
+    # 空闲窗口结束前没有任务到期
+    first_due = time.time() + args.idle + 60
+    report["populate_s"] = populate(path, args.jobs, first_due, args.spread, args.seed)
+
+    tracemalloc.start()
+    scheduler = module.JobScheduler(path, handler, args.max_per_tick, module.DEFAULT_SCHEDULE_CATCH_UP)
+    begin = time.perf_counter()
+    scheduler.start()
+    while scheduler._loaded_until == 0:
+        await asyncio.sleep(0.001)
+    report["startup_s"] = time.perf_counter() - begin
+    report["loaded_jobs"] = scheduler.loaded
+    report["memory_bytes"] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    report["idle"] = await measure_idle(args.idle)
+
+    begin = time.perf_counter()
+    for i in range(args.add):
+        await scheduler.add(time.time() + 86400 + i, 0.0, "aiocqhttp:GroupMessage:1", "1", "新任务")
+    elapsed = time.perf_counter() - begin
+    report["add"] = {"count": args.add, "seconds": elapsed, "per_s": args.add / elapsed if elapsed else 0.0}
+
+    # 积压: 一批同时到期的任务 检查单轮上限和派发速率
+    now = time.time()
+    for _ in range(args.burst):
+        await scheduler.add(now, 0.0, "aiocqhttp:GroupMessage:1", "1", "积压任务")
+    begin = time.perf_counter()
+    while len(dispatched) < args.burst and time.perf_counter() - begin < args.burst / args.max_per_tick * 2 + 5:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - begin
+    per_second: Dict[int, int] = {}
+    for ts in dispatched:
+        per_second[int(ts - now)] = per_second.get(int(ts - now), 0) + 1
+    report["burst"] = {
+        "jobs": args.burst,
+        "dispatched": len(dispatched),
+        "seconds": elapsed,
+        "max_per_second": max(per_second.values()) if per_second else 0,
+    }
+    await scheduler.stop()
+    return report
+
+async def bench_sleep_tasks(args: argparse.Namespace) -> Dict[str, Any]:
+    """对照组 每个任务一个 asyncio.sleep 协程"""
+    rng = random.Random(args.seed)
+
+    async def job(delay: float) -> None:
+        await asyncio.sleep(delay)
+
+    tracemalloc.start()
+    begin = time.perf_counter()
+    tasks = [asyncio.ensure_future(job(args.idle + 60 + rng.random() * args.spread)) for _ in range(args.jobs)]
+    await asyncio.sleep(0)
+    startup = time.perf_counter() - begin
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    idle = await measure_idle(args.idle)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {"startup_s": startup, "memory_bytes": memory, "idle": idle}
+
+def print_report(report: Dict[str, Any]) -> None:
+    s = report["scheduler"]
+    print(f"预置任务 {report['jobs']} 个 写库 {s['populate_s']:.2f}s")
+    print(f"JobScheduler: 启动 {s['startup_s'] * 1000:.1f}ms  载入内存 {s['loaded_jobs']} 个  "
+          f"内存 {s['memory_bytes'] / 1024:.1f} KiB")
+    print(f"  空闲 {s['idle']['wall_s']:.1f}s CPU {s['idle']['cpu_s'] * 1000:.1f}ms ({s['idle']['cpu_percent']:.3f}%)")
+    print(f"  新增 {s['add']['count']} 个 {s['add']['per_s']:.0f} 个/s")
+    b = s["burst"]
+    print(f"  积压 {b['jobs']} 个 派发 {b['dispatched']} 个 耗时 {b['seconds']:.2f}s 单秒最多 {b['max_per_second']} 个")
+    if "sleep_tasks" in report:
+        t = report["sleep_tasks"]
+        print(f"每任务一个 sleep 协程: 启动 {t['startup_s'] * 1000:.1f}ms  内存 {t['memory_bytes'] / 1024:.1f} KiB  "
+              f"空闲 CPU {t['idle']['cpu_s'] * 1000:.1f}ms ({t['idle']['cpu_percent']:.3f}%)")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 定时任务调度器基准测试")
+    parser.add_argument("--jobs", type=int, default=100000, help="预置的定时任务数")
+    parser.add_argument("--spread", type=float, default=7 * 86400, help="预置任务到期时间的分布范围(秒)")
+    parser.add_argument("--idle", type=float, default=5.0, help="空闲 CPU 测量时长(秒)")
+    parser.add_argument("--add", type=int, default=2000, help="通过 add() 新增的任务数")
+    parser.add_argument("--burst", type=int, default=2000, help="同时到期的积压任务数")
+    parser.add_argument("--max-per-tick", type=int, default=500, help="每轮最多派发的任务数")
+    parser.add_argument("--no-baseline", action="store_true", help="跳过 sleep 协程对照组")
+    parser.add_argument("--seed", type=int, default=20240701)
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    report: Dict[str, Any] = {"jobs": args.jobs}
+    with tempfile.TemporaryDirectory(prefix="xytu_sched_") as tmp:
+        report["scheduler"] = await bench_scheduler(module, args, os.path.join(tmp, "schedule.db"))
+    if not args.no_baseline:
+        report["sleep_tasks"] = await bench_sleep_tasks(args)
+    return report
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report["scheduler"]["burst"]["dispatched"] == args.burst else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""回复分段基准测试
+
+用假的流式提供商按固定速率逐 token 产出回复 对比
+不分段(等完整回复后一次发送)和分段发送的首条消息耗时
+并模拟生成途中原消息被撤回 检查剩余分段是否停止发送
+
+用法:
+    python benchmarks/segment_bench.py
+    python benchmarks/segment_bench.py --tokens-per-second 30 --min-chars 20 --interval 0.5 --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import StubMessageEvent, load_plugin_module  # noqa: E402
+
+REPLY = (
+    "好的，我来简单说明一下。首先，插件会在收到回复时按句子切分。"
+    "每凑够最小字数就立刻发送一段，不需要等待整段回复生成完毕！\n\n"
+    "其次，相邻两段之间会保持最短间隔，避免短时间内刷屏。"
+    "如果原消息在生成途中被撤回，剩下的分段就不会再发送了。"
+    "最后，代码块内部不会被切开，例如 `print(1)` 这样的内容会保持完整。"
+)
+
+class StubResult:
+    def __init__(self, stream: AsyncIterator[Any]):
+        self.async_stream = stream
+        self.chain: List[Any] = []
+
+class SegmentEvent(StubMessageEvent):
+    """记录每条发出消息的时间"""
+
+    def __init__(self, raw: Dict[str, Any], umo: str):
+        super().__init__(raw, umo)
+        self.started = time.perf_counter()
+        self.sent: List[float] = []
+        self.texts: List[str] = []
+        self._result: Optional[StubResult] = None
+
+    def set_result(self, result: StubResult) -> None:
+        self._result = result
+
+    def get_result(self) -> Optional[StubResult]:
+        return self._result
+
+    async def send(self, chain: Any) -> None:
+        self.sent.append(time.perf_counter() - self.started)
+        self.texts.append("".join(getattr(chain, "chain", [chain])))
+
+async def fake_provider(module: Any, text: str, tokens_per_second: float, chars_per_token: int = 2):
+    """假的流式提供商 每个 token 两个字"""
+    for i in range(0, len(text), chars_per_token):
+        await asyncio.sleep(1 / tokens_per_second)
+        yield module.MessageChain().message(text[i:i + chars_per_token])
+
+def make_event(message_id: int) -> SegmentEvent:
+    raw = {
+        "post_type": "message", "message_type": "group", "message_id": message_id, "time": int(time.time()),
+        "group_id": 1, "user_id": 10001, "self_id": 20000, "raw_message": "你好", "message": [],
+    }
+    return SegmentEvent(raw, "aiocqhttp:GroupMessage:1")
+
+async def drain(event: SegmentEvent) -> None:
+    """模拟发送阶段 把结果流中剩下的内容发出去"""
+    result = event.get_result()
+    async for item in result.async_stream:
+        await event.send(item)
+
+async def run_case(module: Any, plugin: Any, args: argparse.Namespace, segmented: bool, recall_after: Optional[float],
+                   message_id: int) -> Dict[str, Any]:
+    event = make_event(message_id)
+    stream = fake_provider(module, REPLY, args.tokens_per_second)
+    if not segmented:
+        # 不分段时 原流程收完全部内容才发送
+        text = "".join(["".join(chain.chain) async for chain in stream])
+        await event.send(text)
+        return {"first_s": event.sent[0], "total_s": event.sent[-1], "messages": 1}
+    event.set_result(StubResult(stream))
+    await plugin.on_decorating_result(event)
+    recall_task = None
+    if recall_after is not None:
+        recall_task = asyncio.ensure_future(recall(plugin, message_id, recall_after))
+    await drain(event)
+    if recall_task:
+        await recall_task
+    return {
+        "first_s": event.sent[0] if event.sent else None,
+        "total_s": event.sent[-1] if event.sent else None,
+        "messages": len(event.sent),
+        "stopped": event.is_stopped(),
+    }
+
+async def recall(plugin: Any, message_id: int, delay: float) -> None:
+    await asyncio.sleep(delay)
+    notice = {
+        "post_type": "notice", "notice_type": "group_recall", "message_id": message_id, "time": int(time.time()),
+        "group_id": 1, "user_id": 10001, "operator_id": 10001, "self_id": 20000,
+    }
+    await plugin.on_all_message(StubMessageEvent(notice, "aiocqhttp:GroupMessage:1"))
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    config = {
+        "recall_prevention_enabled": True,
+        "recall_grace_mode": "off",
+        "segment_enabled": True,
+        "segment_min_chars": args.min_chars,
+        "segment_max_chars": args.max_chars,
+        "segment_interval": args.interval,
+    }
+    plugin = module.XYTUFunctionPlugin(None, config)
+    report = {
+        "reply_chars": len(REPLY),
+        "tokens_per_second": args.tokens_per_second,
+        "unsegmented": await run_case(module, plugin, args, False, None, 1),
+        "segmented": await run_case(module, plugin, args, True, None, 2),
+        "recalled": await run_case(module, plugin, args, True, args.recall_after, 3),
+    }
+    await plugin.terminate()
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"回复 {report['reply_chars']} 字  生成速度 {report['tokens_per_second']:.0f} token/s")
+    for name, label in (("unsegmented", "不分段"), ("segmented", "分段"), ("recalled", "分段+中途撤回")):
+        row = report[name]
+        first = f"{row['first_s']:.2f}s" if row["first_s"] is not None else "-"
+        total = f"{row['total_s']:.2f}s" if row["total_s"] is not None else "-"
+        print(f"{label:<10} 首条 {first:>7}  末条 {total:>7}  消息数 {row['messages']}")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 回复分段基准测试")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="假提供商的生成速度")
+    parser.add_argument("--min-chars", type=int, default=20)
+    parser.add_argument("--max-chars", type=int, default=300)
+    parser.add_argument("--interval", type=float, default=0.5, help="分段发送间隔(秒)")
+    parser.add_argument("--recall-after", type=float, default=1.5, help="撤回场景下开始生成后多久撤回(秒)")
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
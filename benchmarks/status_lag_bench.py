@@ -0,0 +1,159 @@
+"""状态指令事件循环卡顿基准测试
+
+在持续的群消息负载下定期发送状态指令 用独立的探针协程测量事件循环卡顿(实际唤醒时间 - 预期唤醒时间)
+对比两种实现:
+- old: 改为后台采样之前的写法 在事件循环里同步调用 psutil.cpu_percent(interval=0.5)、读取 CPU 型号、内存和磁盘
+- new: 当前插件的状态指令 只读取后台采样器的最新样本
+输出卡顿的 p50/p99/max、状态回复耗时和普通消息处理耗时
+
+用法:
+    python benchmarks/status_lag_bench.py
+    python benchmarks/status_lag_bench.py --rate 500 --duration 10 --status-every 1 --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import CHAT_TEXTS, StubBot, StubMessageEvent, load_plugin_module  # noqa: E402
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+def group_message(message_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    return {
+        "post_type": "message", "message_type": "group", "sub_type": "normal", "time": int(time.time()),
+        "self_id": 20000, "user_id": user_id, "group_id": 700001, "message_id": message_id,
+        "message": [{"type": "text", "data": {"text": text}}], "raw_message": text, "font": 0,
+        "sender": {"user_id": user_id, "nickname": f"用户{user_id}", "card": "", "role": "member"},
+    }
+
+def legacy_status(plugin: Any) -> str:
+    """后台采样之前状态指令在事件循环里做的同步调用"""
+    cpu_model = plugin._get_cpu_model()
+    cpu_percent = psutil.cpu_percent(interval=0.5)
+    memory = psutil.virtual_memory()
+    uptime = time.time() - psutil.boot_time()
+    disks = []
+    for partition in psutil.disk_partitions(all=False):
+        try:
+            disks.append(psutil.disk_usage(partition.mountpoint).percent)
+        except OSError:
+            pass
+    return (f"{platform.system()} {platform.release()} | {cpu_model} | {cpu_percent:.1f}% | "
+            f"{memory.percent:.1f}% | {uptime:.0f}s | {disks}")
+
+async def lag_probe(interval: float, samples: List[float], stop: asyncio.Event) -> None:
+    """每 interval 秒醒来一次 记录比预期晚了多久"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(loop.time() - expected, 0.0))
+
+async def run_mode(module: Any, mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    config = {
+        "awake_words": ["XYTU"],
+        "status_enabled": True,
+        "status_trigger_words": ["状态", "status"],
+        "status_sample_interval": args.sample_interval,
+    }
+    plugin = module.XYTUFunctionPlugin(None, config)
+    bot = StubBot(0.0)
+    rng = random.Random(args.seed)
+    # 等后台采样器和硬件信息就绪 只测稳定状态
+    await asyncio.sleep(args.warmup)
+    lags: List[float] = []
+    message_latency: List[float] = []
+    status_latency: List[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.ensure_future(lag_probe(args.probe_ms / 1000, lags, stop))
+    message_id = 0
+    begin = time.perf_counter()
+    next_status = begin
+    total = int(args.rate * args.duration)
+    for sent in range(total):
+        message_id += 1
+        now = time.perf_counter()
+        if now >= next_status:
+            started = time.perf_counter()
+            if mode == "old":
+                legacy_status(plugin)
+            else:
+                event = StubMessageEvent(group_message(message_id, 10001, "XYTU 状态"), "aiocqhttp:GroupMessage:700001", bot)
+                async for _ in plugin.on_message_command(event):
+                    pass
+            status_latency.append(time.perf_counter() - started)
+            # 旧实现单次可能超过间隔 从回复完成时重新计时 避免连续触发
+            next_status = time.perf_counter() + args.status_every
+        event = StubMessageEvent(group_message(message_id, 10000 + rng.randrange(args.users), rng.choice(CHAT_TEXTS)),
+                                 "aiocqhttp:GroupMessage:700001", bot)
+        started = time.perf_counter()
+        async for _ in plugin.on_message_command(event):
+            pass
+        message_latency.append(time.perf_counter() - started)
+        delay = begin + (sent + 1) / args.rate - time.perf_counter()
+        await asyncio.sleep(max(delay, 0))
+    stop.set()
+    await probe
+    await plugin.terminate()
+    return {
+        "status_commands": len(status_latency),
+        "status_p50_ms": percentile(status_latency, 0.5) * 1000,
+        "messages": total,
+        "message_p99_us": percentile(message_latency, 0.99) * 1e6,
+        "lag_samples": len(lags),
+        "lag_p50_ms": percentile(lags, 0.5) * 1000,
+        "lag_p99_ms": percentile(lags, 0.99) * 1000,
+        "lag_max_ms": max(lags) * 1000 if lags else 0.0,
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    return {mode: await run_mode(module, mode, args) for mode in ("old", "new")}
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{'实现':<6}{'状态次数':>8}{'状态p50':>12}{'消息p99':>12}{'卡顿p50':>12}{'卡顿p99':>12}{'卡顿max':>12}")
+    for mode, r in report.items():
+        print(f"{mode:<6}{r['status_commands']:>10}{r['status_p50_ms']:>12.2f}ms{r['message_p99_us']:>10.1f}us"
+              f"{r['lag_p50_ms']:>10.2f}ms{r['lag_p99_ms']:>10.2f}ms{r['lag_max_ms']:>10.2f}ms")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 状态指令事件循环卡顿基准测试")
+    parser.add_argument("--rate", type=float, default=200.0, help="每秒普通消息数")
+    parser.add_argument("--duration", type=float, default=6.0, help="每种实现的持续时间(秒)")
+    parser.add_argument("--status-every", type=float, default=1.0, help="每隔多少秒发送一次状态指令")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--probe-ms", type=float, default=5.0, help="卡顿探针的唤醒间隔(毫秒)")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="后台采样间隔(秒)")
+    parser.add_argument("--warmup", type=float, default=1.5, help="开始测量前等待后台采样就绪的时间(秒)")
+    parser.add_argument("--seed", type=int, default=20240701)
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    # 新实现的最大卡顿应远小于旧实现固定阻塞的 0.5 秒
+    return 0 if report["new"]["lag_max_ms"] < 100 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""表情包仓库基准测试
+
+在临时目录生成本地图片样本: 若干张互不相同的原图 每张再导出几种重新编码/缩放的副本
+1. 把全部样本交给 StickerStore 统计新增、精确重复、近似重复 以及误合并和漏合并的数量
+2. 通过本地 HTTP 服务走一遍 StickerCollector 的下载队列
+3. 对比多索引哈希表和线性扫描查找近似哈希的耗时
+4. 用很小的容量上限检查按最近使用淘汰后磁盘占用不超过上限
+
+需要 Pillow
+
+用法:
+    python benchmarks/sticker_bench.py
+    python benchmarks/sticker_bench.py --bases 300 --index-size 200000 --json -
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import load_plugin_module  # noqa: E402
+
+def make_base(rng: random.Random, size: int = 240) -> Image.Image:
+    """随机色块加几个图形 模拟一张表情包"""
+    grid = Image.new("RGB", (12, 12))
+    grid.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(144)])
+    image = grid.resize((size, size), Image.Resampling.BICUBIC)
+    draw = ImageDraw.Draw(image)
+    for _ in range(3):
+        x, y = rng.randrange(size), rng.randrange(size)
+        r = rng.randrange(10, 60)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    return image
+
+def encode(image: Image.Image, fmt: str, **kwargs) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, fmt, **kwargs)
+    return buf.getvalue()
+
+def variants(image: Image.Image) -> List[Tuple[str, bytes]]:
+    """同一张图常见的几种传播形态"""
+    w, h = image.size
+    return [
+        ("png", encode(image, "PNG")),
+        ("jpg95", encode(image, "JPEG", quality=95)),
+        ("jpg60", encode(image, "JPEG", quality=60)),
+        ("small", encode(image.resize((w * 3 // 4, h * 3 // 4)), "JPEG", quality=85)),
+        ("large", encode(image.resize((w * 5 // 4, h * 5 // 4)), "PNG")),
+        ("webp", encode(image, "WEBP", quality=80)),
+        ("gif", encode(image.convert("P", palette=Image.Palette.ADAPTIVE), "GIF")),
+    ]
+
+def make_fixtures(root: str, bases: int, seed: int) -> List[Tuple[int, str, str]]:
+    """写入本地样本文件 返回 (原图编号, 变体名, 路径)"""
+    rng = random.Random(seed)
+    fixtures = []
+    for index in range(bases):
+        image = make_base(rng)
+        for name, data in variants(image):
+            path = os.path.join(root, f"{index}_{name}")
+            with open(path, "wb") as f:
+                f.write(data)
+            fixtures.append((index, name, path))
+    # 原样再出现一次的图片
+    for index in range(0, bases, 4):
+        fixtures.append((index, "again", os.path.join(root, f"{index}_png")))
+    rng.shuffle(fixtures)
+    return fixtures
+
+async def bench_dedup(module: Any, fixtures: List[Tuple[int, str, str]], root: str, args: argparse.Namespace) -> Dict[str, Any]:
+    store = module.StickerStore(root, 1 << 40, args.distance, args.workers)
+    owner: Dict[str, int] = {}
+    false_merges = 0
+    begin = time.perf_counter()
+    for index, _, path in fixtures:
+        with open(path, "rb") as f:
+            data = f.read()
+        sha, status = await store.add(data, "bench")
+        if status == module.STICKER_ADDED:
+            owner[sha] = index
+        elif sha in owner and owner[sha] != index:
+            false_merges += 1
+    elapsed = time.perf_counter() - begin
+    kept_per_base: Dict[int, int] = {}
+    for index in owner.values():
+        kept_per_base[index] = kept_per_base.get(index, 0) + 1
+    report = {
+        "images": len(fixtures),
+        "bases": args.bases,
+        "seconds": elapsed,
+        "images_per_second": len(fixtures) / elapsed,
+        "counts": dict(store.counts),
+        "stored": store.count,
+        "stored_mib": store.total_bytes / 1024 / 1024,
+        "input_mib": sum(os.path.getsize(path) for _, _, path in fixtures) / 1024 / 1024,
+        "false_merges": false_merges,
+        "missed_merges": sum(count - 1 for count in kept_per_base.values()),
+    }
+    store.close()
+    return report
+
+async def bench_collector(module: Any, fixtures: List[Tuple[int, str, str]], root: str,
+                          args: argparse.Namespace) -> Dict[str, Any]:
+    """本地 HTTP 服务提供样本 走一遍下载队列"""
+    paths = {os.path.basename(path): path for _, _, path in fixtures}
+
+    async def serve(request: web.Request) -> web.StreamResponse:
+        await asyncio.sleep(args.download_latency)
+        return web.FileResponse(paths[request.match_info["name"]])
+
+    app = web.Application()
+    app.router.add_get("/{name}", serve)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    store = module.StickerStore(root, 1 << 40, args.distance, args.workers)
+    collector = module.StickerCollector(store, args.workers)
+    collector.start()
+    begin = time.perf_counter()
+    submitted = 0
+    for _, _, path in fixtures:
+        name = os.path.basename(path)
+        while not collector.submit(name, f"http://127.0.0.1:{port}/{name}", "bench"):
+            if not collector._queue.full():
+                break
+            # 队列满时这里等一等 插件里则是直接丢弃
+            await asyncio.sleep(0.005)
+        else:
+            submitted += 1
+    await collector._queue.join()
+    elapsed = time.perf_counter() - begin
+    report = {
+        "submitted": submitted,
+        "skipped": len(fixtures) - submitted,
+        "dropped": collector.dropped,
+        "failed": collector.failed,
+        "seconds": elapsed,
+        "stored": store.count,
+        "workers": collector.workers,
+    }
+    await collector.stop()
+    store.close()
+    await runner.cleanup()
+    return report
+
+def bench_index(module: Any, args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    hashes = [rng.getrandbits(64) for _ in range(args.index_size)]
+    index = module.MultiIndexHash()
+    begin = time.perf_counter()
+    for i, value in enumerate(hashes):
+        index.add(value, str(i))
+    build = time.perf_counter() - begin
+    # 一半查询是已有哈希翻转几位 一半是随机哈希
+    queries = []
+    for _ in range(args.queries // 2):
+        value = rng.choice(hashes)
+        for bit in rng.sample(range(64), 3):
+            value ^= 1 << bit
+        queries.append(value)
+    queries += [rng.getrandbits(64) for _ in range(args.queries - len(queries))]
+    begin = time.perf_counter()
+    found_index = sum(bool(index.search(q, args.distance)) for q in queries)
+    index_s = (time.perf_counter() - begin) / len(queries)
+    sample = queries[:max(len(queries) // 10, 1)]
+    begin = time.perf_counter()
+    found_linear = sum(any((q ^ h).bit_count() <= args.distance for h in hashes) for q in sample)
+    linear_s = (time.perf_counter() - begin) / len(sample)
+    # 抽样核对 索引查到的结果应与线性扫描完全一致
+    mismatches = sum(
+        {key for _, key in index.search(q, args.distance)} != {str(i) for i, h in enumerate(hashes) if (q ^ h).bit_count() <= args.distance}
+        for q in queries[:20] + queries[-20:]
+    )
+    return {
+        "size": args.index_size,
+        "radius": args.distance,
+        "build_s": build,
+        "index_us": index_s * 1e6,
+        "linear_us": linear_s * 1e6,
+        "found_index": found_index,
+        "found_linear_sample": found_linear,
+        "sample": len(sample),
+        "mismatches": mismatches,
+    }
+
+async def bench_eviction(module: Any, fixtures: List[Tuple[int, str, str]], root: str,
+                         args: argparse.Namespace) -> Dict[str, Any]:
+    cap = args.cap_kib * 1024
+    store = module.StickerStore(root, 0, args.distance, args.workers)
+    store.max_bytes = cap
+    for _, name, path in fixtures:
+        if name != "png":
+            continue
+        with open(path, "rb") as f:
+            await store.add(f.read(), "bench")
+    on_disk = 0
+    files = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name.startswith("stickers.db"):
+                continue
+            on_disk += os.path.getsize(os.path.join(directory, name))
+            files += 1
+    report = {"cap_kib": args.cap_kib, "tracked_kib": store.total_bytes / 1024, "disk_kib": on_disk / 1024,
+              "files": files, "stored": store.count, "evicted": store.evicted}
+    store.close()
+    # 重新打开后从 SQLite 载入的状态应与磁盘一致
+    reopened = module.StickerStore(root, cap, args.distance, args.workers)
+    await reopened.load()
+    report["reloaded"] = reopened.count
+    reopened.close()
+    return report
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    with tempfile.TemporaryDirectory(prefix="xytu_sticker_") as tmp:
+        fixture_dir = os.path.join(tmp, "fixtures")
+        os.makedirs(fixture_dir)
+        fixtures = make_fixtures(fixture_dir, args.bases, args.seed)
+        report = {"dedup": await bench_dedup(module, fixtures, os.path.join(tmp, "store"), args)}
+        report["collector"] = await bench_collector(module, fixtures, os.path.join(tmp, "collector"), args)
+        report["eviction"] = await bench_eviction(module, fixtures, os.path.join(tmp, "evict"), args)
+    report["index"] = bench_index(module, args)
+    return report
+
+def print_report(report: Dict[str, Any]) -> None:
+    d = report["dedup"]
+    c = d["counts"]
+    print(f"去重: {d['images']} 张样本({d['bases']} 张原图) {d['images_per_second']:.0f} 张/s | "
+          f"新增 {c['added']} 精确重复 {c['duplicate']} 近似重复 {c['similar']} 拒绝 {c['rejected']}")
+    print(f"  保存 {d['stored']} 张 {d['stored_mib']:.1f} MiB (输入 {d['input_mib']:.1f} MiB) | "
+          f"误合并 {d['false_merges']} 漏合并 {d['missed_merges']}")
+    col = report["collector"]
+    print(f"下载队列: 提交 {col['submitted']} 跳过 {col['skipped']} 队列满 {col['dropped']} 次 失败 {col['failed']} | "
+          f"{col['workers']} 个下载协程 用时 {col['seconds']:.2f}s 保存 {col['stored']} 张")
+    e = report["eviction"]
+    print(f"淘汰: 上限 {e['cap_kib']} KiB 记录 {e['tracked_kib']:.0f} KiB 磁盘 {e['disk_kib']:.0f} KiB | "
+          f"文件 {e['files']} 保存 {e['stored']} 淘汰 {e['evicted']} 重新载入 {e['reloaded']}")
+    t = report["index"]
+    print(f"近似查找({t['size']} 个哈希 半径 {t['radius']}): 多索引哈希 {t['index_us']:.1f}us | "
+          f"线性扫描 {t['linear_us']:.1f}us | 建索引 {t['build_s']:.2f}s | "
+          f"与线性扫描不一致 {t['mismatches']} 次")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction 表情包仓库基准测试")
+    parser.add_argument("--bases", type=int, default=120, help="原图数量")
+    parser.add_argument("--distance", type=int, default=6, help="sticker_hash_distance")
+    parser.add_argument("--workers", type=int, default=2, help="sticker_workers")
+    parser.add_argument("--download-latency", type=float, default=0.01, help="本地下载服务的附加延迟(秒)")
+    parser.add_argument("--cap-kib", type=int, default=2048, help="淘汰测试的容量上限(KiB)")
+    parser.add_argument("--index-size", type=int, default=100000, help="索引中的哈希数")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=20240701)
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    dedup = report["dedup"]
+    return 0 if dedup["false_merges"] == 0 and report["index"]["mismatches"] == 0 and report["eviction"]["disk_kib"] <= report["eviction"]["cap_kib"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""tcping 并发探测基准测试
+
+在本机启动一批监听端口 用插件的 tcping 探测它们 对比并发探测和逐个探测的总耗时
+- fast: 全部是正常监听的端口 握手立即完成
+- slow: 混入若干"黑洞"端口(监听队列已满 SYN 被丢弃) 这些探测要等到超时
+  并发探测的总耗时应约等于最慢的一次探测(即超时时间) 而不是所有慢目标耗时之和
+另外用默认配置走一遍 tcping 指令 检查 50 个目标全部被探测 没有被截断
+
+用法:
+    python benchmarks/tcping_bench.py
+    python benchmarks/tcping_bench.py --targets 50 --black-holes 5 --timeout 0.5 --json -
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadtest import StubMessageEvent, load_plugin_module  # noqa: E402
+
+class LocalListeners:
+    """本机监听端口 正常端口接受连接后立即关闭 黑洞端口的监听队列被占满"""
+
+    def __init__(self):
+        self._servers: List[asyncio.AbstractServer] = []
+        self._sockets: List[socket.socket] = []
+
+    async def open_fast(self, count: int) -> List[int]:
+        ports = []
+        for _ in range(count):
+            server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+            self._servers.append(server)
+            ports.append(server.sockets[0].getsockname()[1])
+        return ports
+
+    @staticmethod
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.close()
+
+    def open_black_holes(self, count: int) -> List[int]:
+        ports = []
+        for _ in range(count):
+            listener = socket.socket()
+            listener.bind(("127.0.0.1", 0))
+            listener.listen(0)
+            port = listener.getsockname()[1]
+            self._sockets.append(listener)
+            # 从不 accept 用几个连接占满监听队列 之后的 SYN 都会被内核丢弃
+            for _ in range(3):
+                filler = socket.socket()
+                filler.setblocking(False)
+                try:
+                    filler.connect(("127.0.0.1", port))
+                except BlockingIOError:
+                    pass
+                self._sockets.append(filler)
+            ports.append(port)
+        return ports
+
+    async def close(self) -> None:
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for sock in self._sockets:
+            sock.close()
+
+def to_targets(ports: List[int]) -> List[Tuple[str, str, int]]:
+    return [(f"127.0.0.1:{port}", "127.0.0.1", port) for port in ports]
+
+async def measure(pinger: Any, targets: List[Tuple[str, str, int]]) -> Dict[str, Any]:
+    """并发探测全部目标 再逐个目标探测一遍作对比"""
+    begin = time.perf_counter()
+    results = await pinger.ping(targets)
+    concurrent = time.perf_counter() - begin
+    singles = []
+    for target in targets:
+        started = time.perf_counter()
+        await pinger.ping([target])
+        singles.append(time.perf_counter() - started)
+    samples = [s for r in results for s in r.samples]
+    return {
+        "targets": len(targets),
+        "probes": len(targets) * pinger.count,
+        "answered": len(samples),
+        "concurrent_seconds": concurrent,
+        "sequential_seconds": sum(singles),
+        "slowest_single_seconds": max(singles),
+        "slowest_probe_seconds": max(samples) if samples else 0.0,
+    }
+
+def group_message(text: str) -> Dict[str, Any]:
+    return {
+        "post_type": "message", "message_type": "group", "sub_type": "normal", "time": int(time.time()),
+        "self_id": 20000, "user_id": 10001, "group_id": 700001, "message_id": 1,
+        "message": [{"type": "text", "data": {"text": text}}], "raw_message": text, "font": 0,
+        "sender": {"user_id": 10001, "nickname": "管理员", "card": "", "role": "owner"},
+    }
+
+async def check_command(module: Any, ports: List[int]) -> Dict[str, Any]:
+    """默认配置下的 tcping 指令 只打开内网探测 目标数不应被并发上限截断"""
+    plugin = module.XYTUFunctionPlugin(None, {"tcping_enabled": True, "net_tools_allow_private": True})
+    args = " ".join(f"127.0.0.1:{port}" for port in ports)
+    event = StubMessageEvent(group_message(f"tcping {args}"), "aiocqhttp:GroupMessage:700001")
+    replies = [reply async for reply in plugin._handle_tcping(event, args)]
+    await plugin.terminate()
+    text = replies[-1][1] if replies else ""
+    return {
+        "targets": len(ports),
+        "reported": sum(f"127.0.0.1:{port}:" in text for port in ports),
+        "truncated": "其余已忽略" in text,
+    }
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    module = load_plugin_module()
+    listeners = LocalListeners()
+    try:
+        fast_ports = await listeners.open_fast(args.targets)
+        black_holes = listeners.open_black_holes(args.black_holes)
+        pinger = module.TcpPinger(args.count, args.timeout, args.concurrency, allow_private=True)
+        fast = await measure(pinger, to_targets(fast_ports))
+        slow_ports = fast_ports[:args.targets - args.black_holes] + black_holes
+        slow = await measure(pinger, to_targets(slow_ports))
+        slow["timeout"] = pinger.timeout
+        command = await check_command(module, fast_ports)
+        return {"fast": fast, "slow": slow, "command": command, "concurrency": pinger.concurrency}
+    finally:
+        await listeners.close()
+
+def print_report(report: Dict[str, Any]) -> None:
+    for name in ("fast", "slow"):
+        r = report[name]
+        print(f"[{name}] {r['targets']} 个目标 {r['probes']} 次探测 成功 {r['answered']} | "
+              f"并发 {r['concurrent_seconds'] * 1000:.1f}ms 逐个 {r['sequential_seconds'] * 1000:.1f}ms "
+              f"最慢单个目标 {r['slowest_single_seconds'] * 1000:.1f}ms 最慢一次握手 {r['slowest_probe_seconds'] * 1000:.1f}ms")
+    c = report["command"]
+    print(f"[command] {c['targets']} 个目标 回复中 {c['reported']} 个 {'被截断' if c['truncated'] else '未截断'} "
+          f"(并发上限 {report['concurrency']})")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="XYTUFunction tcping 并发探测基准测试")
+    parser.add_argument("--targets", type=int, default=50, help="探测的目标数")
+    parser.add_argument("--black-holes", type=int, default=5, help="slow 轮中会超时的目标数")
+    parser.add_argument("--count", type=int, default=4, help="每个目标的探测次数")
+    parser.add_argument("--timeout", type=float, default=0.5, help="单次探测超时(秒)")
+    parser.add_argument("--concurrency", type=int, default=200, help="全局并发上限")
+    parser.add_argument("--margin", type=float, default=0.2, help="并发耗时相对最慢单个目标允许多出的时间(秒)")
+    parser.add_argument("--seed", type=int, default=20240701, help="保留参数 与其他压测脚本一致")
+    parser.add_argument("--json", help="把结果写入 JSON 文件 使用 - 输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    fast, slow, command = report["fast"], report["slow"], report["command"]
+    ok = (fast["answered"] == fast["probes"]
+          and fast["concurrent_seconds"] <= fast["slowest_single_seconds"] + args.margin
+          and slow["concurrent_seconds"] <= slow["slowest_single_seconds"] + args.margin
+          and command["reported"] == command["targets"] and not command["truncated"])
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
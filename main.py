@@ -1,8 +1,9 @@
-from astrbot.api.event import filter, AstrMessageEvent
+from astrbot.api.event import filter, AstrMessageEvent, MessageChain
 from astrbot.api.star import Context, Star, register
 from astrbot.api import logger
 from astrbot.api import AstrBotConfig
 from astrbot.api.provider import LLMResponse, ProviderRequest
+from astrbot.api.message_components import Plain
 import platform
 import psutil
 import datetime
@@ -11,7 +12,31 @@ import time
 import re
 import subprocess
 import asyncio
-from typing import List, Optional, Dict, Any, Tuple
+import weakref
+import struct
+import mmap
+import socket
+import sqlite3
+import bisect
+import heapq
+import sys
+import select
+import fnmatch
+import concurrent.futures
+import threading
+import traceback
+import sysconfig
+import json
+import io
+import random
+import hashlib
+import uuid
+import contextvars
+import ipaddress
+import aiohttp
+from urllib.parse import urlsplit
+from collections import deque, OrderedDict
+from typing import List, Optional, Dict, Any, Tuple, Deque, Callable, Awaitable, Hashable
 from dataclasses import dataclass
 
 # ==================== 撤回防回复相关常量 ====================
@@ -19,16 +44,214 @@ NOTICE_GROUP_RECALL = "group_recall"
 NOTICE_FRIEND_RECALL = "friend_recall"
 RECORD_EXPIRE_SECONDS = 300  # 5分钟
 CLEANUP_INTERVAL = 60
+DEFAULT_MAX_RECORDS = 10000  # 待处理/已撤回记录各自的上限
+GRACE_MODE_ADAPTIVE = "adaptive"
+GRACE_MODE_FIXED = "fixed"
+GRACE_MODE_OFF = "off"
+DEFAULT_GRACE_SECONDS = 0.02
+DEFAULT_GRACE_MAX_SECONDS = 0.3
+DEFAULT_RECALL_WINDOW_SECONDS = 120  # QQ 普通成员只能撤回两分钟内的消息
+GRACE_LATENCY_BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0)
+GRACE_QUANTILE = 0.95
+GRACE_MIN_SAMPLES = 20  # 样本不足时沿用固定时长
+
+# ==================== 跨进程撤回同步相关常量 ====================
+RECALL_BACKEND_MEMORY = "memory"
+RECALL_BACKEND_SQLITE = "sqlite"
+RECALL_SHARED_FILE = "xytu_recall_state.db"
+DEFAULT_RECALL_SHARED_POLL_MS = 5.0
+# 本进程没有进行中的 LLM 请求时 晚一点感知撤回没有影响 放慢轮询
+RECALL_SHARED_IDLE_POLL = 0.1
+
+# ==================== 状态采样相关常量 ====================
+DEFAULT_SAMPLE_INTERVAL = 5.0
+DEFAULT_SAMPLE_RETENTION = 120
+MIN_SAMPLE_INTERVAL = 1.0
+HARDWARE_CACHE_FILE = "hardware_cache.json"
+
+# ==================== 磁盘探测相关常量 ====================
+DEFAULT_DISK_PROBE_TIMEOUT = 2.0
+DISK_PROBE_WORKERS = 8
+DISK_PARTITION_TTL = 300  # 无法监听挂载变化的平台上分区列表的缓存时间
+MOUNTINFO_PATH = "/proc/self/mountinfo"
+DEFAULT_STATUS_CACHE_TTL = 3.0
+
+# ==================== 状态历史相关常量 ====================
+HISTORY_FILE = "status_history.rrd"
+HISTORY_MAGIC = b"XYTURRD1"
+HISTORY_VERSION = 1
+# (每格秒数, 格数) 分别覆盖 1 小时 / 1 天 / 30 天
+HISTORY_RESOLUTIONS = ((10, 360), (60, 1440), (900, 2880))
+HISTORY_MAX_DISKS = 8
+HISTORY_NAME_SIZE = 64
+HISTORY_DISK_INTERVAL = 60.0
+HISTORY_MAX_POINTS = 240  # 查询时选用格数不超过该值的最细分辨率
+HISTORY_DISPLAY_BUCKETS = 12
+HISTORY_DEFAULT_RANGE = 3600.0
+HISTORY_SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+# ==================== 点赞相关常量 ====================
+LIKE_TIMES = 10
+LIKE_STATUS_LIKED = "liked"
+LIKE_STATUS_CAPPED = "capped"
+LIKE_RESULT_FAILED = "failed"
+LIKE_RESULT_SKIPPED = "skipped"
+DEFAULT_LIKE_RATE = 2.0
+DEFAULT_LIKE_BURST = 5
+DEFAULT_BULK_LIKE_MAX_TARGETS = 50
+ACTIVE_USERS_PER_GROUP = 500  # 每个群记录的当日活跃用户上限
+CQ_AT_PATTERN = re.compile(r"\[CQ:at,qq=(\d+)[^\]]*\]")
+LIKE_LEDGER_FILE = "like_ledger.db"
+DEFAULT_LIKE_CONCURRENCY = 2
+
+# ==================== 刷屏检测相关常量 ====================
+FLOOD_ACTION_WARN = "warn"
+FLOOD_ACTION_MUTE = "mute"
+FLOOD_ACTION_RECALL = "recall"
+DEFAULT_FLOOD_WINDOW = 10.0
+DEFAULT_FLOOD_MAX_MESSAGES = 8
+DEFAULT_FLOOD_MAX_DUPLICATES = 3
+DEFAULT_FLOOD_GROUP_MAX_DUPLICATES = 0
+DEFAULT_FLOOD_MUTE_SECONDS = 600
+DEFAULT_FLOOD_COOLDOWN = 60.0  # 处罚后这段时间内不再重复警告和禁言 但仍会撤回
+DEFAULT_FLOOD_WARN_TEXT = "请不要刷屏哦"
+FLOOD_TRACKED_USERS = 20000
+FLOOD_TRACKED_GROUPS = 2000
+FLOOD_GROUP_FINGERPRINTS = 64
+FLOOD_BATCH_INTERVAL = 0.5
+FLOOD_PENDING_LIMIT = 1000
+FLOOD_ACTION_RATE = 10.0
+FLOOD_ACTION_BURST = 20.0
+FLOOD_ACTION_CONCURRENCY = 4
+
+# ==================== 表情包相关常量 ====================
+STICKER_DIR = "stickers"
+STICKER_DB_FILE = "stickers.db"
+DEFAULT_STICKER_MAX_MB = 512
+DEFAULT_STICKER_DISTANCE = 6  # 64 位 dHash 的汉明距离 重新编码/缩放的副本一般在 4 以内
+DEFAULT_STICKER_WORKERS = 2
+STICKER_MAX_DOWNLOAD = 5 * 1024 * 1024
+STICKER_DOWNLOAD_TIMEOUT = 15.0
+STICKER_QUEUE_LIMIT = 200
+STICKER_RECENT_FILES = 4096  # 最近见过的图片文件名 同一张图反复出现时不再下载
+STICKER_HASH_SIZE = 8
+STICKER_ADDED = "added"
+STICKER_DUPLICATE = "duplicate"
+STICKER_SIMILAR = "similar"
+STICKER_REJECTED = "rejected"
+
+# ==================== tcping 相关常量 ====================
+DEFAULT_TCPING_COUNT = 4
+DEFAULT_TCPING_TIMEOUT = 2.0
+DEFAULT_TCPING_CONCURRENCY = 200
+DEFAULT_TCPING_MAX_TARGETS = 50
+DEFAULT_TCPING_PORT = 80
+
+# ==================== Minecraft 查询相关常量 ====================
+DEFAULT_MC_PORT = 25565
+DEFAULT_MC_TIMEOUT = 3.0
+DEFAULT_MC_CACHE_TTL = 30.0
+MC_QUERY_CONCURRENCY = 16
+MC_MAX_TARGETS = 10
+MC_PROTOCOL_VERSION = -1  # 查询状态时约定使用 -1 表示未知版本
+MC_MAX_PACKET = 2 * 1024 * 1024  # 带 favicon 的状态响应通常只有几十 KB
+MC_FORMAT_PATTERN = re.compile(r"§.")
+
+# ==================== API 余额查询相关常量 ====================
+DEFAULT_BALANCE_TIMEOUT = 8.0
+DEFAULT_BALANCE_CACHE_TTL = 60.0
+BALANCE_POOL_SIZE = 32
+BALANCE_POOL_PER_HOST = 8
+BALANCE_KEEPALIVE = 30.0
+DEFAULT_OPENAI_API_BASE = "https://api.openai.com/v1"
+
+# ==================== 定时任务相关常量 ====================
+SCHEDULE_DB_FILE = "schedule.db"
+SCHEDULE_LOAD_HORIZON = 3600.0  # 只把一小时内到期的任务载入内存
+SCHEDULE_TICK = 1.0  # 单轮派发达到上限后 剩余任务顺延的间隔
+DEFAULT_SCHEDULE_MAX_PER_TICK = 20
+DEFAULT_SCHEDULE_CATCH_UP = 3600.0
+DEFAULT_SCHEDULE_MAX_JOBS_PER_USER = 20
+SCHEDULE_MIN_INTERVAL = 60.0
+SCHEDULE_DURATION_PATTERN = re.compile(r"(\d+)\s*(天|小时|分钟|分|秒|d|h|m|s)", re.IGNORECASE)
+SCHEDULE_DURATION_FULL = re.compile(r"^(?:\d+\s*(?:天|小时|分钟|分|秒|d|h|m|s))+$", re.IGNORECASE)
+SCHEDULE_CLOCK_PATTERN = re.compile(r"^(\d{1,2})[:：](\d{2})$")
+SCHEDULE_UNITS = {"天": 86400, "d": 86400, "小时": 3600, "h": 3600, "分钟": 60, "分": 60, "m": 60, "秒": 1, "s": 1}
+
+# ==================== 回复分段相关常量 ====================
+DEFAULT_SEGMENT_MIN_CHARS = 20
+DEFAULT_SEGMENT_MAX_CHARS = 300
+DEFAULT_SEGMENT_INTERVAL = 0.8
+# 段落 / 句末标点(含后面的引号括号) / 英文句点后跟空白 / 单个换行
+SEGMENT_BOUNDARY_PATTERN = re.compile(r"\n\s*\n|[。！？!?…~～]+[”’\"'』」）)]*|\.(?=\s)|\n")
+SEGMENT_SOFT_BREAK_PATTERN = re.compile(r"[，,、；;：:\s]")
+
+# ==================== 指标导出相关常量 ====================
+METRICS_PREFIX = "xytu"
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_INTERVAL = 0.5
+EXPORT_MODE_OFF = "off"
+EXPORT_MODE_FILE = "file"
+EXPORT_MODE_HTTP = "http"
+DEFAULT_EXPORT_INTERVAL = 15.0
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_METRICS_PORT = 9464
+METRICS_FILE = "metrics.prom"
+
+# ==================== 卡顿监测相关常量 ====================
+DEFAULT_LAG_THRESHOLD_MS = 100.0
+MIN_LAG_THRESHOLD_MS = 10.0
+LAG_STALL_RETENTION = 20
+LAG_OFFENDER_LIMIT = 50
+LAG_STACK_DEPTH = 12
+# 标准库和第三方库里的帧不作为卡顿的责任帧
+LAG_LIBRARY_PATHS = tuple(
+    os.path.normcase(os.path.abspath(path)) + os.sep
+    for path in {sysconfig.get_paths().get(key) for key in ("stdlib", "platstdlib", "purelib", "platlib")} if path
+)
+
+# ==================== 插件数据目录 ====================
+PLUGIN_NAME = "astrbot_plugin_XYTUFunction"
+
+def get_plugin_data_dir() -> str:
+    """获取插件持久化数据目录 旧版 AstrBot 没有 StarTools 时退回 data/plugin_data"""
+    try:
+        from astrbot.api.star import StarTools
+        path = str(StarTools.get_data_dir(PLUGIN_NAME))
+    except Exception:
+        path = os.path.join("data", "plugin_data", PLUGIN_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
 
 # ==================== 撤回防回复数据结构 ====================
 @dataclass(slots=True)
 class PendingRequest:
-    """正在处理的 LLM 请求记录"""
+    """正在处理的 LLM 请求记录
+    
+    只保存事件的弱引用 记录存活期间不会让整条消息链/图片/请求体常驻内存
+    """
     message_id: str
     unified_msg_origin: str
     sender_id: str
     timestamp: float
-    event: Optional[AstrMessageEvent] = None
+    event_ref: Optional["weakref.ReferenceType[AstrMessageEvent]"] = None
+    generating: bool = False  # 已发出 LLM 请求 尚未收到响应
+    recalled: bool = False  # 原消息已撤回 之后的提供商调用直接跳过
+    cancelled: bool = False  # 进行中的提供商调用已被取消
+    provider_task: Optional["asyncio.Future[Any]"] = None  # 正在执行提供商调用的子任务 调用结束后置空
+    
+    @property
+    def event(self) -> Optional[AstrMessageEvent]:
+        return self.event_ref() if self.event_ref is not None else None
+
+def _weak(obj: Any) -> Optional[weakref.ReferenceType]:
+    if obj is None:
+        return None
+    try:
+        return weakref.ref(obj)
+    except TypeError:
+        return None
 
 @dataclass(slots=True)
 class RecalledMessage:
@@ -42,103 +265,3007 @@ class RecalledMessage:
 class PluginStats:
     """插件统计信息（仅内部记录）"""
     recalls_detected: int = 0
+    recalls_from_peers: int = 0
     llm_requests_blocked: int = 0
     llm_responses_blocked: int = 0
     send_blocked: int = 0
+    grace_waits: int = 0
+    grace_skipped: int = 0
+    generations_cancelled: int = 0
+    generations_discarded: int = 0
+    tokens_discarded: int = 0
+    tokens_saved_estimate: int = 0
+    llm_generations_measured: int = 0
+    llm_generation_seconds: float = 0.0
+    llm_tokens_measured: int = 0
+    llm_completion_tokens: int = 0
+    
+    def record_generation(self, seconds: float, completion_tokens: Optional[int]) -> None:
+        """记录一次完整生成的耗时和输出 token 数 用于估算拦截请求节省的 token"""
+        self.llm_generations_measured += 1
+        self.llm_generation_seconds += seconds
+        if completion_tokens is not None:
+            self.llm_tokens_measured += 1
+            self.llm_completion_tokens += completion_tokens
+    
+    def record_blocked(self) -> None:
+        """请求发给提供商之前就被拦截 按历史平均输出 token 数估算节省量"""
+        self.llm_requests_blocked += 1
+        if self.llm_tokens_measured:
+            self.tokens_saved_estimate += self.llm_completion_tokens // self.llm_tokens_measured
+    
+    def record_discarded(self, completion_tokens: Optional[int]) -> None:
+        """生成途中原消息被撤回但提供商调用没能取消 响应到达后丢弃 记录白白消耗的 token"""
+        self.generations_discarded += 1
+        if completion_tokens is not None:
+            self.tokens_discarded += completion_tokens
+
+# ==================== 事件解析 ====================
+@dataclass(slots=True)
+class ParsedMessage:
+    """单个事件的解析结果 同一事件只解析一次 供所有钩子和指令共用"""
+    message_id: Optional[str]
+    notice_type: Optional[str]
+    operator_id: Optional[str]
+    raw_text: str
+    session: str
+    timestamp: Optional[float] = None
+    
+    @property
+    def is_recall(self) -> bool:
+        return self.notice_type in (NOTICE_GROUP_RECALL, NOTICE_FRIEND_RECALL) and self.message_id is not None
+
+# 以事件对象为弱引用键 事件被回收后缓存条目随之消失
+_parsed_cache: "weakref.WeakKeyDictionary[AstrMessageEvent, ParsedMessage]" = weakref.WeakKeyDictionary()
+
+def _raw_field(raw: Any, name: str) -> Any:
+    """直接按结构读取原始消息字段 aiocqhttp 的 Event 是 dict 子类"""
+    if isinstance(raw, dict):
+        return raw.get(name)
+    return getattr(raw, name, None)
+
+def _parse_event(event: AstrMessageEvent) -> ParsedMessage:
+    message_obj = getattr(event, 'message_obj', None)
+    raw = getattr(message_obj, 'raw_message', None)
+    message_id = None
+    notice_type = None
+    operator_id = None
+    raw_text = None
+    timestamp = None
+    if isinstance(raw, str):
+        raw_text = raw
+    elif raw:
+        msg_id = _raw_field(raw, 'message_id')
+        if msg_id:
+            message_id = str(msg_id)
+        notice_type = _raw_field(raw, 'notice_type')
+        operator = _raw_field(raw, 'operator_id') or _raw_field(raw, 'user_id')
+        if operator:
+            operator_id = str(operator)
+        text = _raw_field(raw, 'raw_message')
+        if isinstance(text, str):
+            raw_text = text
+        msg_time = _raw_field(raw, 'time')
+        if isinstance(msg_time, (int, float)) and msg_time > 0:
+            timestamp = float(msg_time)
+    if message_id is None:
+        msg_id = getattr(message_obj, 'message_id', None)
+        if msg_id:
+            msg_id_str = str(msg_id)
+            compact = msg_id_str.replace("-", "")
+            # 平台未提供真实消息 ID 时 AstrBot 会填入 uuid 这种 ID 无法与撤回通知对应
+            if not (len(compact) == 32 and compact.isalnum()):
+                message_id = msg_id_str
+    if not raw_text:
+        raw_text = getattr(event, 'message_str', "") or ""
+    if timestamp is None:
+        msg_time = getattr(message_obj, 'timestamp', None)
+        if isinstance(msg_time, (int, float)) and msg_time > 0:
+            timestamp = float(msg_time)
+    return ParsedMessage(
+        message_id=message_id,
+        notice_type=notice_type,
+        operator_id=operator_id,
+        raw_text=raw_text,
+        session=event.unified_msg_origin,
+        timestamp=timestamp
+    )
+
+def get_parsed_message(event: AstrMessageEvent) -> ParsedMessage:
+    """获取事件的解析结果 首次访问时解析并缓存"""
+    try:
+        parsed = _parsed_cache.get(event)
+    except TypeError:
+        # 事件对象不可哈希或不支持弱引用时退化为每次解析
+        return _parse_event(event)
+    if parsed is None:
+        parsed = _parse_event(event)
+        try:
+            _parsed_cache[event] = parsed
+        except TypeError:
+            pass
+    return parsed
 
 # ==================== 撤回状态管理器 ====================
 class RecallStateManager:
-    """撤回状态管理器"""
+    """撤回状态管理器
     
-    def __init__(self):
-        self._pending_requests: Dict[str, PendingRequest] = {}
-        self._recalled_messages: Dict[str, RecalledMessage] = {}
-        self._lock = asyncio.Lock()
+    记录按 unified_msg_origin 分片存放 每个会话一个以消息 ID 为键的小字典
+    所有操作都是纯同步的字典读写 中途不会让出事件循环 因此不需要加锁
+    另外按写入顺序把 (时间戳, 会话, 消息ID) 放进队列 过期清理只从队头弹出真正到期的条目
+    超过 max_records 时淘汰最旧的记录 记录被移除或覆盖后队列里会留下失效条目
+    队列长度超过 2×max_records 时重建一次 只保留仍然有效的条目 队列和字典一样受上限约束
+    """
+    
+    def __init__(self, max_records: int = DEFAULT_MAX_RECORDS):
+        self.max_records = max(int(max_records), 1)
+        self._pending_requests: Dict[str, Dict[str, PendingRequest]] = {}
+        self._recalled_messages: Dict[str, Dict[str, RecalledMessage]] = {}
+        self._pending_order: Deque[Tuple[float, str, str]] = deque()
+        self._recalled_order: Deque[Tuple[float, str, str]] = deque()
+        self._pending_count = 0
+        self._recalled_count = 0
+        self.pending_evicted = 0
+        self.recalled_evicted = 0
+    
+    @staticmethod
+    def _shard(table: Dict[str, Dict[str, Any]], unified_msg_origin: str) -> Dict[str, Any]:
+        shard = table.get(unified_msg_origin)
+        if shard is None:
+            shard = table[unified_msg_origin] = {}
+        return shard
     
     @staticmethod
-    def _compose_key(unified_msg_origin: str, message_id: str) -> str:
-        return f"{unified_msg_origin}::{message_id}"
+    def _live(table: Dict[str, Dict[str, Any]], entry: Tuple[float, str, str]) -> bool:
+        """队列条目对应的记录是否还在 记录已被移除或被新记录覆盖时返回 False"""
+        timestamp, unified_msg_origin, message_id = entry
+        shard = table.get(unified_msg_origin)
+        record = shard.get(message_id) if shard else None
+        return record is not None and record.timestamp == timestamp
+    
+    @classmethod
+    def _drop(cls, table: Dict[str, Dict[str, Any]], entry: Tuple[float, str, str]) -> bool:
+        """删除队列条目对应的记录 条目已失效时返回 False"""
+        if not cls._live(table, entry):
+            return False
+        _, unified_msg_origin, message_id = entry
+        shard = table[unified_msg_origin]
+        del shard[message_id]
+        if not shard:
+            del table[unified_msg_origin]
+        return True
+    
+    def _compact(self, table: Dict[str, Dict[str, Any]], order: Deque[Tuple[float, str, str]]) -> None:
+        """失效条目过多时重建队列 每次重建后队列不超过有效记录数 均摊到每次写入是 O(1)"""
+        if len(order) <= self.max_records * 2:
+            return
+        # dict.fromkeys 保持顺序并去掉同一时间戳重复写入的条目
+        live = [entry for entry in dict.fromkeys(order) if self._live(table, entry)]
+        order.clear()
+        order.extend(live)
+    
+    @classmethod
+    def _evict_oldest(cls, table: Dict[str, Dict[str, Any]], order: Deque[Tuple[float, str, str]], excess: int) -> int:
+        evicted = 0
+        while evicted < excess and order:
+            if cls._drop(table, order.popleft()):
+                evicted += 1
+        return evicted
     
     async def add_pending_request(
         self, message_id: str, unified_msg_origin: str, sender_id: str,
-        event: Optional[AstrMessageEvent] = None
-    ) -> None:
-        key = self._compose_key(unified_msg_origin, message_id)
-        async with self._lock:
-            self._pending_requests[key] = PendingRequest(
-                message_id=message_id,
-                unified_msg_origin=unified_msg_origin,
-                sender_id=sender_id,
-                timestamp=time.time(),
-                event=event
-            )
+        event: Optional[AstrMessageEvent] = None, generating: bool = False
+    ) -> PendingRequest:
+        # 同一会话的所有记录共用一份会话字符串
+        unified_msg_origin = sys.intern(unified_msg_origin)
+        shard = self._shard(self._pending_requests, unified_msg_origin)
+        if message_id not in shard:
+            self._pending_count += 1
+        record = shard[message_id] = PendingRequest(
+            message_id=message_id,
+            unified_msg_origin=unified_msg_origin,
+            sender_id=sender_id,
+            timestamp=time.time(),
+            event_ref=_weak(event),
+            generating=generating
+        )
+        self._pending_order.append((record.timestamp, unified_msg_origin, message_id))
+        if self._pending_count > self.max_records:
+            evicted = self._evict_oldest(self._pending_requests, self._pending_order, self._pending_count - self.max_records)
+            self._pending_count -= evicted
+            self.pending_evicted += evicted
+        self._compact(self._pending_requests, self._pending_order)
+        return record
     
     async def remove_pending_request(self, message_id: str, unified_msg_origin: str) -> Optional[PendingRequest]:
-        key = self._compose_key(unified_msg_origin, message_id)
-        async with self._lock:
-            return self._pending_requests.pop(key, None)
+        shard = self._pending_requests.get(unified_msg_origin)
+        if not shard:
+            return None
+        pending = shard.pop(message_id, None)
+        if pending is not None:
+            self._pending_count -= 1
+            if not shard:
+                del self._pending_requests[unified_msg_origin]
+        return pending
     
     async def get_pending_request(self, message_id: str, unified_msg_origin: str) -> Optional[PendingRequest]:
-        key = self._compose_key(unified_msg_origin, message_id)
-        async with self._lock:
-            return self._pending_requests.get(key)
+        shard = self._pending_requests.get(unified_msg_origin)
+        return shard.get(message_id) if shard else None
     
     async def add_recalled_message(self, message_id: str, unified_msg_origin: str, operator_id: str) -> None:
-        key = self._compose_key(unified_msg_origin, message_id)
-        async with self._lock:
-            self._recalled_messages[key] = RecalledMessage(
-                message_id=message_id,
-                unified_msg_origin=unified_msg_origin,
-                operator_id=operator_id,
-                timestamp=time.time()
-            )
+        unified_msg_origin = sys.intern(unified_msg_origin)
+        shard = self._shard(self._recalled_messages, unified_msg_origin)
+        if message_id not in shard:
+            self._recalled_count += 1
+        record = shard[message_id] = RecalledMessage(
+            message_id=message_id,
+            unified_msg_origin=unified_msg_origin,
+            operator_id=operator_id,
+            timestamp=time.time()
+        )
+        self._recalled_order.append((record.timestamp, unified_msg_origin, message_id))
+        if self._recalled_count > self.max_records:
+            evicted = self._evict_oldest(self._recalled_messages, self._recalled_order, self._recalled_count - self.max_records)
+            self._recalled_count -= evicted
+            self.recalled_evicted += evicted
+        self._compact(self._recalled_messages, self._recalled_order)
     
     async def is_recalled(self, message_id: str, unified_msg_origin: str) -> bool:
-        key = self._compose_key(unified_msg_origin, message_id)
-        async with self._lock:
-            return key in self._recalled_messages
+        shard = self._recalled_messages.get(unified_msg_origin)
+        return bool(shard) and message_id in shard
     
     async def get_recalled_message(self, message_id: str, unified_msg_origin: str) -> Optional[RecalledMessage]:
-        key = self._compose_key(unified_msg_origin, message_id)
-        async with self._lock:
-            return self._recalled_messages.get(key)
+        shard = self._recalled_messages.get(unified_msg_origin)
+        return shard.get(message_id) if shard else None
     
-    async def cleanup_expired(self, expire_seconds: float = RECORD_EXPIRE_SECONDS) -> int:
-        now = time.time()
+    @classmethod
+    def _expire(cls, table: Dict[str, Dict[str, Any]], order: Deque[Tuple[float, str, str]], deadline: float) -> int:
         cleaned = 0
-        async with self._lock:
-            expired_pending = [k for k, v in self._pending_requests.items() if now - v.timestamp > expire_seconds]
-            for k in expired_pending:
-                del self._pending_requests[k]
-                cleaned += 1
-            expired_recalled = [k for k, v in self._recalled_messages.items() if now - v.timestamp > expire_seconds]
-            for k in expired_recalled:
-                del self._recalled_messages[k]
+        while order and order[0][0] < deadline:
+            if cls._drop(table, order.popleft()):
                 cleaned += 1
         return cleaned
     
+    async def cleanup_expired(self, expire_seconds: float = RECORD_EXPIRE_SECONDS) -> int:
+        deadline = time.time() - expire_seconds
+        cleaned_pending = self._expire(self._pending_requests, self._pending_order, deadline)
+        cleaned_recalled = self._expire(self._recalled_messages, self._recalled_order, deadline)
+        self._pending_count -= cleaned_pending
+        self._recalled_count -= cleaned_recalled
+        return cleaned_pending + cleaned_recalled
+    
     async def get_stats(self) -> Tuple[int, int]:
-        async with self._lock:
-            return len(self._pending_requests), len(self._recalled_messages)
+        return self._pending_count, self._recalled_count
+    
+    def get_eviction_stats(self) -> Tuple[int, int]:
+        """因超出上限被淘汰的待处理/已撤回记录数"""
+        return self.pending_evicted, self.recalled_evicted
 
-# ==================== 主插件类 ====================
-@register("astrbot_plugin_XYTUFunction", "Tangzixy , Slime , SLserver , XYTUworkshop", "Astrbot基础功能插件？ 一个就够了！", "v0.4.1", "https://github.com/XYTUworkshop/astrbot_plugin_XYTUFunction")
-class XYTUFunctionPlugin(Star):
-    def __init__(self, context: Context, config: AstrBotConfig):
-        super().__init__(context)
-        self.config = config
-        self.awake_words = config.get("awake_words", ["XYTU", "XYTUFT"])
-        logger.info(f"XYTUFunction 插件 v0.4.0 初始化，唤醒词: {self.awake_words}")
+# ==================== 提供商调用取消 ====================
+# 当前流水线任务正在处理的待处理请求 由 on_llm_request 设置 提供商调用时读取
+_current_pending: "contextvars.ContextVar[Optional[PendingRequest]]" = contextvars.ContextVar(
+    "xytu_current_pending", default=None
+)
+_STREAM_END = object()
+
+def _outer_cancelling() -> bool:
+    """当前任务自身是否正在被取消 用来区分撤回取消子任务和流水线整体被取消"""
+    task = asyncio.current_task()
+    cancelling = getattr(task, "cancelling", None)
+    return bool(cancelling()) if cancelling else False
+
+class ProviderCallGuard:
+    """把提供商的 text_chat / text_chat_stream 放进可以单独取消的子任务
+    
+    AstrBot 没有暴露进行中的提供商调用 on_llm_request 钩子只能拿到事件和请求体
+    因此在提供商实例上替换这两个方法: 调用和 on_llm_request 在同一个流水线任务里执行
+    通过 ContextVar 找到本次登记的 PendingRequest 真正的请求放进子任务 句柄挂在记录上
+    撤回时只取消这个子任务 流水线拿到一个空响应后照常走完其他插件的钩子和自身的收尾
+    找不到记录时(钩子不在同一任务里执行、插件未跟踪该消息)原样调用 行为与不安装时一致
+    """
+    
+    METHODS = ("text_chat", "text_chat_stream")
+    
+    def __init__(self):
+        self._installed: Dict[int, Any] = {}
+    
+    @staticmethod
+    def bind(record: PendingRequest) -> None:
+        _current_pending.set(record)
+    
+    def install(self, provider: Any) -> None:
+        if provider is None or id(provider) in self._installed:
+            return
+        # 持有提供商的引用 id 不会被复用 接管失败也不再重试
+        self._installed[id(provider)] = provider
+        try:
+            for name in self.METHODS:
+                original = getattr(provider, name, None)
+                if original is None:
+                    continue
+                wrapper = self._wrap_stream(original) if name == "text_chat_stream" else self._wrap_call(original)
+                setattr(provider, name, wrapper)
+        except Exception as e:
+            logger.warning(f"[XYTUFunction] 无法接管提供商调用 撤回时只能在响应后丢弃: {e}")
+    
+    def uninstall(self) -> None:
+        """恢复提供商原有的方法 实例上的替换删掉后会重新落到类上定义的方法"""
+        for provider in self._installed.values():
+            for name in self.METHODS:
+                try:
+                    if name in vars(provider):
+                        delattr(provider, name)
+                except Exception:
+                    pass
+        self._installed.clear()
+    
+    @staticmethod
+    def cancelled_response() -> LLMResponse:
+        return LLMResponse(role="assistant", completion_text="")
+    
+    @classmethod
+    def _wrap_call(cls, original: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        async def text_chat(*args, **kwargs):
+            record = _current_pending.get()
+            if record is None:
+                return await original(*args, **kwargs)
+            if record.recalled:
+                return cls.cancelled_response()
+            task = asyncio.ensure_future(original(*args, **kwargs))
+            record.provider_task = task
+            try:
+                return await task
+            except asyncio.CancelledError:
+                if not (task.cancelled() and record.cancelled) or _outer_cancelling():
+                    raise
+                return cls.cancelled_response()
+            finally:
+                record.provider_task = None
+        return text_chat
+    
+    @classmethod
+    def _wrap_stream(cls, original: Callable[..., Any]) -> Callable[..., Any]:
+        async def text_chat_stream(*args, **kwargs):
+            record = _current_pending.get()
+            if record is None:
+                async for chunk in original(*args, **kwargs):
+                    yield chunk
+                return
+            if record.recalled:
+                return
+            # 整个流在同一个子任务里消费 提供商 SDK 的取消作用域不会跨任务
+            queue: asyncio.Queue = asyncio.Queue()
+            
+            async def pump():
+                try:
+                    async for chunk in original(*args, **kwargs):
+                        queue.put_nowait(chunk)
+                finally:
+                    queue.put_nowait(_STREAM_END)
+            
+            task = asyncio.ensure_future(pump())
+            record.provider_task = task
+            try:
+                while True:
+                    chunk = await queue.get()
+                    if chunk is _STREAM_END:
+                        break
+                    yield chunk
+                if task.cancelled() and record.cancelled:
+                    return
+                task.result()
+            finally:
+                record.provider_task = None
+                if not task.done():
+                    task.cancel()
+        return text_chat_stream
+
+# ==================== 跨进程撤回同步 ====================
+class SharedRecallLog:
+    """同一台机器上多个 AstrBot 进程共享撤回记录
+    
+    每个进程仍以内存中的 RecallStateManager 为准 查询不经过数据库
+    本进程收到的撤回追加写入 SQLite (WAL) 日志 其他进程轮询 PRAGMA data_version
+    发现有新提交时再按自增序号读取新增记录 没有变化时每次轮询只是一次很轻的 PRAGMA
+    读写都在单独线程执行 数据库被锁或磁盘变慢时不会卡住事件循环
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        # 区分本进程写入的记录 避免重复处理自己发出的撤回
+        self.origin = uuid.uuid4().hex
+        self._reader = self._connect()
+        self._reader.execute(
+            "CREATE TABLE IF NOT EXISTS recalls ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, umo TEXT NOT NULL, "
+            "message_id TEXT NOT NULL, operator_id TEXT NOT NULL, timestamp REAL NOT NULL)"
+        )
+        self._reader.execute("CREATE INDEX IF NOT EXISTS recalls_timestamp ON recalls (timestamp)")
+        self._reader.commit()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="XYTURecallLog")
+        self._data_version = -1
+        self._last_seq = 0
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=1.0, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def _write(self, umo: str, message_id: str, operator_id: str, timestamp: float) -> None:
+        if self._writer is None:
+            self._writer = self._connect()
+        self._writer.execute(
+            "INSERT INTO recalls (origin, umo, message_id, operator_id, timestamp) VALUES (?, ?, ?, ?, ?)",
+            (self.origin, umo, message_id, operator_id, timestamp)
+        )
+    
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    async def publish(self, message_id: str, unified_msg_origin: str, operator_id: str) -> None:
+        try:
+            await self._run(self._write, unified_msg_origin, message_id, operator_id, time.time())
+        except sqlite3.Error as e:
+            logger.warning(f"[XYTUFunction] 写入共享撤回记录失败: {e}")
+    
+    async def load_recent(self, since: float) -> List[Tuple[str, str, str]]:
+        """启动时读取 since 之后其他进程记录的撤回 之后只读取新增记录"""
+        return await self._run(self._load_recent, since)
+    
+    async def poll(self) -> List[Tuple[str, str, str]]:
+        """返回上次轮询之后其他进程写入的 (会话, 消息ID, 操作者)"""
+        return await self._run(self._poll)
+    
+    def _load_recent(self, since: float) -> List[Tuple[str, str, str]]:
+        self._last_seq = self._reader.execute("SELECT COALESCE(MAX(seq), 0) FROM recalls").fetchone()[0]
+        rows = self._reader.execute(
+            "SELECT umo, message_id, operator_id FROM recalls WHERE timestamp >= ? AND origin != ?",
+            (since, self.origin)
+        ).fetchall()
+        return rows
+    
+    def _poll(self) -> List[Tuple[str, str, str]]:
+        version = self._reader.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return []
+        self._data_version = version
+        rows = self._reader.execute(
+            "SELECT seq, origin, umo, message_id, operator_id FROM recalls WHERE seq > ? ORDER BY seq",
+            (self._last_seq,)
+        ).fetchall()
+        if rows:
+            self._last_seq = rows[-1][0]
+        return [(umo, message_id, operator_id) for _, origin, umo, message_id, operator_id in rows if origin != self.origin]
+    
+    async def cleanup(self, expire_seconds: float = RECORD_EXPIRE_SECONDS) -> None:
+        def _delete(deadline: float) -> None:
+            if self._writer is None:
+                self._writer = self._connect()
+            self._writer.execute("DELETE FROM recalls WHERE timestamp < ?", (deadline,))
+        try:
+            await self._run(_delete, time.time() - expire_seconds)
+        except sqlite3.Error as e:
+            logger.warning(f"[XYTUFunction] 清理共享撤回记录失败: {e}")
+    
+    def close(self) -> None:
+        def _close():
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._reader.close()
+        self._executor.submit(_close)
+        self._executor.shutdown(wait=True)
+
+# ==================== 撤回宽限窗口 ====================
+class RecallGraceWindow:
+    """发送前等待撤回通知的宽限窗口
+    
+    回复发送前按消息登记一个撤回信号 撤回通知到达时立即唤醒 不再固定 sleep
+    adaptive 模式只统计与回复发生竞争的撤回: 宽限期内到达的 以及通知时间确定早于回复发出、但通知晚到的
+    用户看到回复之后才撤回的不计入 样本足够后取 95 分位作为等待时长
+    原消息已超过可撤回时限时直接跳过等待
+    """
+    
+    def __init__(self, mode: str = GRACE_MODE_ADAPTIVE, fixed_seconds: float = DEFAULT_GRACE_SECONDS,
+                 max_seconds: float = DEFAULT_GRACE_MAX_SECONDS,
+                 recall_window_seconds: float = DEFAULT_RECALL_WINDOW_SECONDS):
+        if mode not in (GRACE_MODE_ADAPTIVE, GRACE_MODE_FIXED, GRACE_MODE_OFF):
+            logger.warning(f"[XYTUFunction] 未知的撤回宽限模式: {mode}，使用 {GRACE_MODE_ADAPTIVE}")
+            mode = GRACE_MODE_ADAPTIVE
+        self.mode = mode
+        self.fixed_seconds = max(float(fixed_seconds), 0.0)
+        self.max_seconds = max(float(max_seconds), self.fixed_seconds)
+        self.recall_window_seconds = float(recall_window_seconds)
+        self._waiters: Dict[Tuple[str, str], asyncio.Event] = {}
+        # (宽限开始时刻, 回复发出的墙上时间) 等待中的回复发出时间为 None
+        self._grace_started: Dict[Tuple[str, str], Tuple[float, Optional[float]]] = {}
+        self._buckets = [0] * (len(GRACE_LATENCY_BUCKETS) + 1)
+        self._samples = 0
+        self._window = self.fixed_seconds
+    
+    def should_wait(self, message_time: Optional[float]) -> bool:
+        if self.mode == GRACE_MODE_OFF:
+            return False
+        if message_time is not None and self.recall_window_seconds > 0:
+            if time.time() - message_time > self.recall_window_seconds:
+                return False
+        return True
+    
+    def window(self) -> float:
+        if self.mode == GRACE_MODE_ADAPTIVE:
+            return self._window
+        return self.fixed_seconds
+    
+    def record_latency(self, latency: float) -> None:
+        if latency < 0 or latency > 2 * self.max_seconds:
+            return
+        for i, bound in enumerate(GRACE_LATENCY_BUCKETS):
+            if latency <= bound:
+                self._buckets[i] += 1
+                break
+        else:
+            self._buckets[-1] += 1
+        self._samples += 1
+        if self._samples >= GRACE_MIN_SAMPLES:
+            self._window = self._quantile(GRACE_QUANTILE)
+    
+    def _quantile(self, q: float) -> float:
+        target = q * self._samples
+        seen = 0
+        for i, count in enumerate(self._buckets):
+            seen += count
+            if seen >= target:
+                bound = GRACE_LATENCY_BUCKETS[i] if i < len(GRACE_LATENCY_BUCKETS) else self.max_seconds
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+    
+    def get_histogram(self) -> List[Tuple[float, int]]:
+        bounds = list(GRACE_LATENCY_BUCKETS) + [float("inf")]
+        return list(zip(bounds, self._buckets))
+    
+    async def wait(self, message_id: str, unified_msg_origin: str) -> bool:
+        """等待撤回信号 在窗口内收到撤回返回 True"""
+        timeout = self.window()
+        if timeout <= 0:
+            return False
+        key = (unified_msg_origin, message_id)
+        signal = self._waiters.get(key)
+        if signal is None:
+            signal = self._waiters[key] = asyncio.Event()
+        started = time.monotonic()
+        self._grace_started[key] = (started, None)
+        try:
+            await asyncio.wait_for(signal.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.pop(key, None)
+            if key in self._grace_started:
+                self._grace_started[key] = (started, time.time())
+            if len(self._grace_started) > 4096:
+                self._prune_started()
+    
+    def _prune_started(self) -> None:
+        horizon = time.monotonic() - 2 * self.max_seconds
+        for key in [k for k, (t, _) in self._grace_started.items() if t < horizon]:
+            del self._grace_started[key]
+    
+    def notify_recall(self, message_id: str, unified_msg_origin: str, recalled_at: Optional[float] = None) -> None:
+        """收到撤回通知 recalled_at 为通知里的撤回时间(秒级精度)"""
+        key = (unified_msg_origin, message_id)
+        entry = self._grace_started.pop(key, None)
+        if entry is not None:
+            started, sent_at = entry
+            # 宽限期内到达的一定是竞争 回复发出后才到达的 只有撤回时间确定早于发出才算通知晚到
+            # 通知时间只精确到秒 无法判断先后的一律不计入 避免看到回复后才撤回的把窗口拉长
+            if sent_at is None or (recalled_at is not None and recalled_at + 1 <= sent_at):
+                self.record_latency(time.monotonic() - started)
+        signal = self._waiters.get(key)
+        if signal is not None:
+            signal.set()
+
+# ==================== 系统指标采样器 ====================
+@dataclass(slots=True)
+class MetricsSample:
+    """一次系统指标采样"""
+    timestamp: float
+    cpu_percent: float
+    memory_used: int
+    memory_total: int
+    memory_percent: float
+    uptime_seconds: float
+
+@dataclass(slots=True)
+class HardwareInfo:
+    """进程运行期间不会变化的硬件/系统指纹"""
+    cpu_model: str
+    system_name: str
+
+def get_boot_id() -> str:
+    """本次开机的唯一标识 用于判断硬件指纹缓存是否仍然有效"""
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r", encoding='utf-8') as f:
+            boot_id = f.read().strip()
+            if boot_id:
+                return boot_id
+    except OSError:
+        pass
+    return str(int(psutil.boot_time()))
+
+class MetricsSampler:
+    """后台系统指标采样器
+    
+    定时把 CPU/内存/运行时间写入环形缓冲 状态指令直接读取最新一条 不再阻塞事件循环
+    """
+    
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL, retention: int = DEFAULT_SAMPLE_RETENTION):
+        self.interval = max(float(interval), MIN_SAMPLE_INTERVAL)
+        self._samples: Deque[MetricsSample] = deque(maxlen=max(int(retention), 1))
+        self._listeners: List[Callable[[MetricsSample], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        # 非阻塞模式下 cpu_percent 返回距上次调用的占用率 先调用一次作为基准
+        psutil.cpu_percent(interval=None)
+    
+    def sample_now(self) -> MetricsSample:
+        now = time.time()
+        memory = psutil.virtual_memory()
+        sample = MetricsSample(
+            timestamp=now,
+            cpu_percent=psutil.cpu_percent(interval=None),
+            memory_used=memory.used,
+            memory_total=memory.total,
+            memory_percent=memory.percent,
+            uptime_seconds=now - psutil.boot_time()
+        )
+        self._samples.append(sample)
+        for listener in self._listeners:
+            try:
+                listener(sample)
+            except Exception as e:
+                logger.error(f"[XYTUFunction] 处理指标采样出错: {e}")
+        return sample
+    
+    def add_listener(self, listener: Callable[[MetricsSample], None]) -> None:
+        """每次采样后回调 listener"""
+        self._listeners.append(listener)
+    
+    def latest(self) -> MetricsSample:
+        """返回最新采样 缓冲为空时立即采样一次"""
+        if self._samples:
+            return self._samples[-1]
+        return self.sample_now()
+    
+    def samples(self) -> List[MetricsSample]:
+        return list(self._samples)
+    
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sample_loop())
+            logger.debug(f"[XYTUFunction] 指标采样任务已启动 | 间隔 {self.interval}s | 保留 {self._samples.maxlen} 条")
+    
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _sample_loop(self) -> None:
+        while True:
+            try:
+                self.sample_now()
+                await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[XYTUFunction] 指标采样出错: {e}")
+                await asyncio.sleep(self.interval)
+
+# ==================== 磁盘探测器 ====================
+class DiskProber:
+    """并发 带超时的磁盘探测器
+    
+    每个挂载点的 disk_usage 在线程池里执行 超时的挂载点（例如失联的 NFS/CIFS）标记为不可达
+    分区列表会被缓存 Linux 下通过 poll /proc/self/mountinfo 感知挂载变化后才重新读取
+    """
+    
+    def __init__(self, timeout: float = DEFAULT_DISK_PROBE_TIMEOUT,
+                 include: Optional[List[str]] = None, exclude: Optional[List[str]] = None):
+        self.timeout = max(float(timeout), 0.1)
+        self._include = [p for p in (include or []) if p]
+        self._exclude = [p for p in (exclude or []) if p]
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=DISK_PROBE_WORKERS, thread_name_prefix="XYTUDiskProbe"
+        )
+        self._partitions: Optional[list] = None
+        self._partitions_time = 0.0
+        # 仍卡在内核里的探测 同一挂载点不会重复占用线程
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        self._mountinfo = None
+        self._poller = None
+        self._open_mount_watch()
+    
+    def _open_mount_watch(self) -> None:
+        if not hasattr(select, "poll"):
+            return
+        try:
+            self._mountinfo = open(MOUNTINFO_PATH, "r")
+            self._poller = select.poll()
+            self._poller.register(self._mountinfo.fileno(), select.POLLERR | select.POLLPRI)
+            # 首次 poll 同步内核的挂载事件计数
+            self._poller.poll(0)
+        except OSError:
+            self.close_mount_watch()
+    
+    def close_mount_watch(self) -> None:
+        if self._mountinfo is not None:
+            try:
+                self._mountinfo.close()
+            except OSError:
+                pass
+        self._mountinfo = None
+        self._poller = None
+    
+    def _mounts_changed(self) -> bool:
+        if self._poller is None:
+            return time.monotonic() - self._partitions_time > DISK_PARTITION_TTL
+        try:
+            return bool(self._poller.poll(0))
+        except OSError:
+            self.close_mount_watch()
+            return True
+    
+    def _is_wanted(self, partition) -> bool:
+        if 'cdrom' in partition.opts or partition.fstype == '':
+            return False
+        names = (partition.mountpoint, partition.device)
+        if self._include and not any(fnmatch.fnmatch(n, p) for n in names for p in self._include):
+            return False
+        if any(fnmatch.fnmatch(n, p) for n in names for p in self._exclude):
+            return False
+        return True
+    
+    def _list_partitions(self) -> list:
+        partitions = []
+        seen_devices = set()
+        for partition in psutil.disk_partitions(all=False):
+            # bind mount 会让同一设备出现多次 只保留第一个挂载点
+            if partition.device in seen_devices or not self._is_wanted(partition):
+                continue
+            seen_devices.add(partition.device)
+            partitions.append(partition)
+        return partitions
+    
+    async def _get_partitions(self) -> list:
+        if self._partitions is None or self._mounts_changed():
+            loop = asyncio.get_running_loop()
+            self._partitions = await loop.run_in_executor(self._executor, self._list_partitions)
+            self._partitions_time = time.monotonic()
+        return self._partitions
+    
+    def _submit_usage(self, mountpoint: str) -> concurrent.futures.Future:
+        future = self._inflight.get(mountpoint)
+        if future is None or future.done():
+            future = self._executor.submit(psutil.disk_usage, mountpoint)
+            self._inflight[mountpoint] = future
+        return future
+    
+    @staticmethod
+    def _format_device(device: str) -> str:
+        if platform.system() == "Linux":
+            return os.path.basename(device)
+        return device
+    
+    async def probe_usage(self) -> List[Tuple[Any, Optional[Any]]]:
+        """返回 (分区, 使用情况) 超时的分区使用情况为 None 读取失败的分区直接跳过"""
+        partitions = await self._get_partitions()
+        if not partitions:
+            return []
+        futures = [asyncio.wrap_future(self._submit_usage(p.mountpoint)) for p in partitions]
+        await asyncio.wait(futures, timeout=self.timeout)
+        results = []
+        for partition, future in zip(partitions, futures):
+            if not future.done():
+                logger.warning(f"[XYTUFunction] 分区 {partition.mountpoint} 探测超时，标记为不可达")
+                results.append((partition, None))
+                continue
+            try:
+                results.append((partition, future.result()))
+            except Exception as e:
+                logger.warning(f"获取分区 {partition.mountpoint} 信息失败: {e}")
+        return results
+    
+    async def probe(self) -> List[str]:
+        disk_info = []
+        try:
+            for partition, usage in await self.probe_usage():
+                device = self._format_device(partition.device)
+                if usage is None:
+                    disk_info.append(f"   {device}: 不可达")
+                    continue
+                total_gb = usage.total / (1024 ** 3)
+                used_gb = usage.used / (1024 ** 3)
+                disk_info.append(f"   {device}: {used_gb:.1f}G/{total_gb:.1f}G | {usage.percent:.1f}%")
+        except Exception as e:
+            logger.error(f"获取硬盘信息失败: {e}")
+            disk_info.append("   无法获取硬盘信息")
+        return disk_info
+    
+    def shutdown(self) -> None:
+        self.close_mount_watch()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# ==================== 状态历史 ====================
+class StatusHistory:
+    """RRD 风格的状态历史 数据放在 mmap 映射的定长文件里
+    
+    每种分辨率是一个定长环形数组 每格记录该时间段内各指标的 min/max/sum/count
+    每次采样直接更新所有分辨率的当前格 不保存原始采样 文件和内存大小都不随运行时间增长
+    指标固定为 cpu / mem 和最多 HISTORY_MAX_DISKS 个挂载点的磁盘占用
+    """
+    
+    HEADER = struct.Struct("<8sIII4x")
+    VALUE = struct.Struct("<fffI")
+    TIMESTAMP = struct.Struct("<q")
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.series_count = 2 + HISTORY_MAX_DISKS
+        self.slot_size = self.TIMESTAMP.size + self.series_count * self.VALUE.size
+        offset = self.HEADER.size + self.series_count * HISTORY_NAME_SIZE
+        self._rings: List[Tuple[int, int, int]] = []
+        for step, slots in HISTORY_RESOLUTIONS:
+            self._rings.append((step, slots, offset))
+            offset += slots * self.slot_size
+        self.size = offset
+        self._empty_slot = bytes(self.slot_size)
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._names: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._open()
+    
+    def _open(self) -> None:
+        fresh = not os.path.exists(self.path) or os.path.getsize(self.path) != self.size
+        self._file = open(self.path, "r+b" if not fresh else "w+b")
+        if fresh:
+            self._file.truncate(self.size)
+        self._mmap = mmap.mmap(self._file.fileno(), self.size)
+        header = self.HEADER.unpack_from(self._mmap, 0)
+        if header != (HISTORY_MAGIC, HISTORY_VERSION, self.series_count, len(HISTORY_RESOLUTIONS)):
+            if not fresh:
+                logger.warning("[XYTUFunction] 状态历史文件格式不匹配，重新初始化")
+            self._mmap[:] = bytes(self.size)
+            self.HEADER.pack_into(self._mmap, 0, HISTORY_MAGIC, HISTORY_VERSION, self.series_count, len(HISTORY_RESOLUTIONS))
+            self._write_name(0, "cpu")
+            self._write_name(1, "mem")
+        for i in range(self.series_count):
+            start = self.HEADER.size + i * HISTORY_NAME_SIZE
+            name = self._mmap[start:start + HISTORY_NAME_SIZE].rstrip(b"\0").decode('utf-8', 'ignore')
+            self._names.append(name)
+            if name:
+                self._index[name] = i
+    
+    def _write_name(self, index: int, name: str) -> None:
+        data = name.encode('utf-8')[:HISTORY_NAME_SIZE]
+        start = self.HEADER.size + index * HISTORY_NAME_SIZE
+        self._mmap[start:start + HISTORY_NAME_SIZE] = data.ljust(HISTORY_NAME_SIZE, b"\0")
+        if index < len(self._names):
+            self._names[index] = name
+        self._index[name] = index
+    
+    def _series(self, name: str) -> Optional[int]:
+        """返回指标所在列 新出现的磁盘占用一个空列 列已满时忽略"""
+        index = self._index.get(name)
+        if index is None and name.startswith("disk:"):
+            for i in range(2, self.series_count):
+                if not self._names[i]:
+                    self._write_name(i, name)
+                    return i
+        return index
+    
+    def record(self, timestamp: float, values: Dict[str, float]) -> None:
+        if self._mmap is None:
+            return
+        columns = [(index, value) for index, value in
+                   ((self._series(name), value) for name, value in values.items()) if index is not None]
+        ts = int(timestamp)
+        for step, slots, base in self._rings:
+            aligned = ts - ts % step
+            offset = base + (aligned // step % slots) * self.slot_size
+            if self.TIMESTAMP.unpack_from(self._mmap, offset)[0] != aligned:
+                # 这一格上一次写入的是一圈之前的数据 清空后复用
+                self._mmap[offset:offset + self.slot_size] = self._empty_slot
+                self.TIMESTAMP.pack_into(self._mmap, offset, aligned)
+            for index, value in columns:
+                position = offset + self.TIMESTAMP.size + index * self.VALUE.size
+                low, high, total, count = self.VALUE.unpack_from(self._mmap, position)
+                if count:
+                    self.VALUE.pack_into(self._mmap, position, min(low, value), max(high, value), total + value, count + 1)
+                else:
+                    self.VALUE.pack_into(self._mmap, position, value, value, value, 1)
+    
+    def query(self, seconds: float, buckets: int = HISTORY_DISPLAY_BUCKETS,
+              now: Optional[float] = None) -> Tuple[int, Dict[str, List[Optional[Tuple[float, float, float]]]]]:
+        """读取最近 seconds 秒的汇总
+        
+        选用格数不超过 HISTORY_MAX_POINTS 的最细分辨率 再合并成 buckets 段
+        返回 (使用的分辨率秒数, {指标: [(min, avg, max) 或 None, ...]})
+        """
+        now = int(now if now is not None else time.time())
+        step, slots, base = self._rings[-1]
+        for ring in self._rings:
+            if seconds <= ring[0] * ring[1] and seconds / ring[0] <= HISTORY_MAX_POINTS:
+                step, slots, base = ring
+                break
+        points = max(min(int(seconds // step), slots), 1)
+        buckets = max(min(buckets, points), 1)
+        last = now - now % step
+        merged = [[[float("inf"), float("-inf"), 0.0, 0] for _ in range(buckets)] for _ in range(self.series_count)]
+        for i in range(points):
+            aligned = last - (points - 1 - i) * step
+            offset = base + (aligned // step % slots) * self.slot_size
+            if self.TIMESTAMP.unpack_from(self._mmap, offset)[0] != aligned:
+                continue
+            bucket = i * buckets // points
+            for index in range(self.series_count):
+                low, high, total, count = self.VALUE.unpack_from(
+                    self._mmap, offset + self.TIMESTAMP.size + index * self.VALUE.size
+                )
+                if count:
+                    cell = merged[index][bucket]
+                    cell[0] = min(cell[0], low)
+                    cell[1] = max(cell[1], high)
+                    cell[2] += total
+                    cell[3] += count
+        result: Dict[str, List[Optional[Tuple[float, float, float]]]] = {}
+        for index, name in enumerate(self._names):
+            if not name:
+                continue
+            series = [(c[0], c[2] / c[3], c[1]) if c[3] else None for c in merged[index]]
+            if any(series):
+                result[name] = series
+        return step, result
+    
+    def flush(self) -> None:
+        if self._mmap is not None:
+            self._mmap.flush()
+    
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# ==================== 运行指标 ====================
+class LatencyHistogram:
+    """固定分桶的延迟直方图 与 Prometheus histogram 的语义一致"""
+    
+    __slots__ = ("buckets", "counts", "count", "total", "max")
+    
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+    
+    def quantile(self, q: float) -> float:
+        """按桶上界估算分位数"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+    
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+class MetricsRegistry:
+    """插件运行指标 各热路径把耗时写入对应直方图 另有心跳任务测量事件循环卡顿"""
+    
+    HOOK_DESCRIPTIONS = {
+        "dispatch": "指令分发",
+        "status_collect": "状态采集",
+        "like_api": "点赞API",
+        "decorating_wait": "发送前撤回等待",
+        "segment_first": "分段回复首段",
+        "flood_check": "刷屏检测",
+        "loop_lag": "事件循环卡顿",
+    }
+    
+    def __init__(self, lag_interval: float = LOOP_LAG_INTERVAL):
+        self.histograms: Dict[str, LatencyHistogram] = {name: LatencyHistogram() for name in self.HOOK_DESCRIPTIONS}
+        self.lag_interval = lag_interval
+        self.last_lag = 0.0
+        self.watchdog: Optional["LoopWatchdog"] = None
+        self._lag_task: Optional[asyncio.Task] = None
+    
+    def observe(self, name: str, seconds: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.observe(seconds)
+    
+    def start(self) -> None:
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.create_task(self._lag_loop())
+        if self.watchdog:
+            self.watchdog.start()
+    
+    async def stop(self) -> None:
+        if self._lag_task:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+        if self.watchdog:
+            self.watchdog.stop()
+    
+    async def _lag_loop(self) -> None:
+        while True:
+            try:
+                expected = time.perf_counter() + self.lag_interval
+                if self.watchdog:
+                    self.watchdog.expect(expected)
+                await asyncio.sleep(self.lag_interval)
+                self.last_lag = max(time.perf_counter() - expected, 0.0)
+                self.observe("loop_lag", self.last_lag)
+                if self.watchdog:
+                    self.watchdog.beat(self.last_lag)
+            except asyncio.CancelledError:
+                break
+
+@dataclass(slots=True)
+class LoopStall:
+    """一次事件循环卡顿 调用栈由看门狗线程在卡顿期间抓取"""
+    timestamp: float
+    blame: str
+    stack: List[str]
+    lag: float = 0.0
+
+class LoopWatchdog:
+    """事件循环看门狗
+    
+    心跳任务每次休眠前登记最迟唤醒时刻 看门狗线程发现超过阈值仍未唤醒时
+    抓取事件循环线程当前的调用栈 心跳恢复后补上实际卡顿时长
+    """
+    
+    def __init__(self, threshold: float, retention: int = LAG_STALL_RETENTION):
+        self.threshold = threshold
+        self.stalls: Deque[LoopStall] = deque(maxlen=retention)
+        # 责任帧 -> [次数, 累计秒数, 最长秒数] 按最近出现排序
+        self.offenders: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.over_threshold = 0
+        self.captured = 0
+        self._lock = threading.Lock()
+        self._deadline = 0.0
+        self._pending: Optional[LoopStall] = None
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self) -> None:
+        """在事件循环线程中调用"""
+        self._loop_thread = threading.get_ident()
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="xytu-loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.debug(f"[XYTUFunction] 事件循环看门狗已启动 | 阈值 {self.threshold * 1000:.0f}ms")
+    
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+    
+    def expect(self, due: float) -> None:
+        with self._lock:
+            self._deadline = due + self.threshold
+    
+    def beat(self, lag: float) -> None:
+        with self._lock:
+            self._deadline = 0.0
+            stall, self._pending = self._pending, None
+        if lag < self.threshold:
+            return
+        self.over_threshold += 1
+        if stall is None:
+            # 卡顿在看门狗下一次检查前就结束了 只计数
+            return
+        stall.lag = lag
+        self.captured += 1
+        self.stalls.append(stall)
+        entry = self.offenders.pop(stall.blame, None) or [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += lag
+        entry[2] = max(entry[2], lag)
+        self.offenders[stall.blame] = entry
+        if len(self.offenders) > LAG_OFFENDER_LIMIT:
+            self.offenders.popitem(last=False)
+        logger.warning(f"[XYTUFunction] 事件循环卡顿 {lag * 1000:.0f}ms | {stall.blame}")
+        logger.debug("[XYTUFunction] 卡顿时的调用栈:\n" + "\n".join(stall.stack))
+    
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            with self._lock:
+                if self._deadline and self._pending is None and time.perf_counter() > self._deadline:
+                    self._pending = self._capture()
+    
+    def _capture(self) -> Optional[LoopStall]:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return None
+        summary = traceback.extract_stack(frame, limit=LAG_STACK_DEPTH)
+        stack = [f"{self._short_path(f.filename)}:{f.lineno} {f.name}" for f in summary]
+        blame = stack[-1] if stack else "未知"
+        for f, line in zip(reversed(summary), reversed(stack)):
+            if not os.path.normcase(os.path.abspath(f.filename)).startswith(LAG_LIBRARY_PATHS):
+                blame = line
+                break
+        return LoopStall(timestamp=time.time(), blame=blame, stack=stack)
+    
+    @staticmethod
+    def _short_path(path: str) -> str:
+        """只保留最后两级路径 足够区分是哪个插件的哪个文件"""
+        parts = path.replace("\\", "/").rsplit("/", 2)
+        return "/".join(parts[-2:])
+
+def render_prometheus(histograms: Dict[str, LatencyHistogram], gauges: Dict[str, float],
+                      counters: Dict[str, float]) -> str:
+    """渲染 Prometheus 文本格式"""
+    lines = [
+        f"# HELP {METRICS_PREFIX}_latency_seconds XYTUFunction hot path latency",
+        f"# TYPE {METRICS_PREFIX}_latency_seconds histogram",
+    ]
+    for name, histogram in histograms.items():
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{METRICS_PREFIX}_latency_seconds_bucket{{hook="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRICS_PREFIX}_latency_seconds_bucket{{hook="{name}",le="+Inf"}} {histogram.count}')
+        lines.append(f'{METRICS_PREFIX}_latency_seconds_sum{{hook="{name}"}} {histogram.total:.9f}')
+        lines.append(f'{METRICS_PREFIX}_latency_seconds_count{{hook="{name}"}} {histogram.count}')
+    for name, value in gauges.items():
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} gauge")
+        lines.append(f"{METRICS_PREFIX}_{name} {value}")
+    for name, value in counters.items():
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+        lines.append(f"{METRICS_PREFIX}_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+class MetricsExporter:
+    """把指标以 Prometheus 文本格式写入文件 或通过本地 HTTP 端口提供"""
+    
+    def __init__(self, render: Callable[[], Awaitable[str]], mode: str, path: str,
+                 host: str = DEFAULT_METRICS_HOST, port: int = DEFAULT_METRICS_PORT,
+                 interval: float = DEFAULT_EXPORT_INTERVAL):
+        self._render = render
+        self.mode = mode
+        self.path = path
+        self.host = host
+        self.port = int(port)
+        self.interval = max(float(interval), 1.0)
+        self._task: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._started = False
+    
+    async def start(self) -> None:
+        # 插件初始化和 on_loaded 可能先后调用 在第一次 await 之前置位 保证只监听一次
+        if self._started:
+            return
+        self._started = True
+        if self.mode == EXPORT_MODE_FILE:
+            self._task = asyncio.create_task(self._file_loop())
+            logger.info(f"[XYTUFunction] 指标将定期写入 {self.path}")
+        elif self.mode == EXPORT_MODE_HTTP:
+            try:
+                self._server = await asyncio.start_server(self._handle_http, self.host, self.port)
+                logger.info(f"[XYTUFunction] 指标 HTTP 监听于 http://{self.host}:{self.port}/metrics")
+            except OSError as e:
+                self._started = False
+                logger.error(f"[XYTUFunction] 指标 HTTP 监听失败: {e}")
+    
+    async def stop(self) -> None:
+        self._started = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+    
+    async def _write_file(self) -> None:
+        text = await self._render()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+    
+    async def _file_loop(self) -> None:
+        while True:
+            try:
+                await self._write_file()
+                await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[XYTUFunction] 写入指标文件失败: {e}")
+                await asyncio.sleep(self.interval)
+    
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+                status = "200 OK"
+                body = (await self._render()).encode('utf-8')
+            else:
+                status = "404 Not Found"
+                body = b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.debug(f"[XYTUFunction] 指标请求处理失败: {e}")
+        finally:
+            writer.close()
+
+# ==================== 点赞台账 ====================
+class LikeLedger:
+    """按天记录每个用户的点赞结果
+    
+    当天已经点过或已达上限的用户直接在本地回复 不再调用 send_like
+    数据持久化到 SQLite 内存中只缓存当天的记录 跨天时自动清空并删除旧记录
+    所有数据库操作都在单独的线程里执行
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._day: Optional[str] = None
+        self._today: Dict[str, str] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="XYTULikeLedger")
+    
+    @staticmethod
+    def _current_day() -> str:
+        return datetime.date.today().isoformat()
+    
+    def _open_and_load(self, day: str) -> Dict[str, str]:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS likes ("
+                "day TEXT NOT NULL, user_id TEXT NOT NULL, status TEXT NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (day, user_id))"
+            )
+        self._conn.execute("DELETE FROM likes WHERE day < ?", (day,))
+        self._conn.commit()
+        rows = self._conn.execute("SELECT user_id, status FROM likes WHERE day = ?", (day,)).fetchall()
+        return dict(rows)
+    
+    def _write(self, day: str, user_id: str, status: str) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO likes (day, user_id, status, updated) VALUES (?, ?, ?, ?)",
+            (day, user_id, status, time.time())
+        )
+        self._conn.commit()
+    
+    async def _run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    async def _ensure_day(self) -> str:
+        day = self._current_day()
+        if day != self._day:
+            self._today = await self._run(self._open_and_load, day)
+            self._day = day
+        return day
+    
+    async def get_status(self, user_id: str) -> Optional[str]:
+        await self._ensure_day()
+        return self._today.get(user_id)
+    
+    async def record(self, user_id: str, status: str) -> None:
+        day = await self._ensure_day()
+        self._today[user_id] = status
+        try:
+            await self._run(self._write, day, user_id, status)
+        except sqlite3.Error as e:
+            logger.warning(f"[XYTUFunction] 写入点赞记录失败: {e}")
+    
+    def close(self) -> None:
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close)
+        self._executor.shutdown(wait=False)
+
+# ==================== 令牌桶限速 ====================
+class TokenBucket:
+    """异步令牌桶 rate 为每秒补充的令牌数 capacity 为允许的突发量"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(float(rate), 0.01)
+        self.capacity = max(float(capacity), 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+# ==================== 群活跃用户 ====================
+class ActiveUserTracker:
+    """记录每个群当天发过言的用户
+    
+    每个群按最近发言顺序最多保留 per_group 个用户 跨天后整体清空
+    """
+    
+    def __init__(self, per_group: int = ACTIVE_USERS_PER_GROUP):
+        self.per_group = per_group
+        self._groups: Dict[str, Dict[str, None]] = {}
+        self._reset_at = self._next_midnight()
+    
+    @staticmethod
+    def _next_midnight() -> float:
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        return datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
+    
+    def touch(self, group_id: str, user_id: str) -> None:
+        if time.time() >= self._reset_at:
+            self._groups.clear()
+            self._reset_at = self._next_midnight()
+        users = self._groups.get(group_id)
+        if users is None:
+            users = self._groups[sys.intern(group_id)] = {}
+        else:
+            users.pop(user_id, None)
+        users[user_id] = None
+        if len(users) > self.per_group:
+            del users[next(iter(users))]
+    
+    def get(self, group_id: str) -> List[str]:
+        if time.time() >= self._reset_at:
+            return []
+        return list(self._groups.get(group_id, ()))
+
+# ==================== 刷屏检测 ====================
+class FloodCounter:
+    """一个用户(或一种群内消息内容)的滑动窗口计数 以及上一条消息的指纹"""
+    
+    __slots__ = ("window", "previous", "current", "fingerprint", "repeats", "repeat_at", "punished_until")
+    
+    def __init__(self):
+        self.window = 0
+        self.previous = 0
+        self.current = 0
+        self.fingerprint = 0
+        self.repeats = 0
+        self.repeat_at = 0.0
+        self.punished_until = 0.0
+
+class FloodDetector:
+    """群刷屏检测
+    
+    每个用户一个固定大小的计数器 用前后两个固定窗口加权近似滑动窗口计数 并记录上一条消息的指纹
+    用户和群都放在有上限的 LRU 里 不说话的用户会被挤出 内存只取决于上限 每条消息的开销是常数
+    """
+    
+    def __init__(self, window: float, max_messages: int, max_duplicates: int, group_max_duplicates: int,
+                 cooldown: float, max_users: int = FLOOD_TRACKED_USERS, max_groups: int = FLOOD_TRACKED_GROUPS):
+        self.window = max(float(window), 1.0)
+        self.max_messages = max(int(max_messages), 0)
+        self.max_duplicates = max(int(max_duplicates), 0)
+        self.group_max_duplicates = max(int(group_max_duplicates), 0)
+        self.cooldown = max(float(cooldown), 0.0)
+        self.max_users = max_users
+        self.max_groups = max_groups
+        self._users: "OrderedDict[Tuple[str, str], FloodCounter]" = OrderedDict()
+        self._groups: "OrderedDict[str, OrderedDict[int, FloodCounter]]" = OrderedDict()
+    
+    def _count(self, counter: FloodCounter, now: float) -> float:
+        """计数加一 返回滑动窗口内的估计条数"""
+        position = now / self.window
+        index = int(position)
+        if index != counter.window:
+            counter.previous = counter.current if index == counter.window + 1 else 0
+            counter.current = 0
+            counter.window = index
+        counter.current += 1
+        return counter.previous * (1 - (position - index)) + counter.current
+    
+    def _group_count(self, group_id: str, fingerprint: int, now: float) -> float:
+        """群内同一内容在窗口内出现的次数 每个群只保留最近的若干种内容"""
+        fingerprints = self._groups.get(group_id)
+        if fingerprints is None:
+            fingerprints = self._groups[group_id] = OrderedDict()
+            if len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+        else:
+            self._groups.move_to_end(group_id)
+        counter = fingerprints.get(fingerprint)
+        if counter is None:
+            counter = fingerprints[fingerprint] = FloodCounter()
+            if len(fingerprints) > FLOOD_GROUP_FINGERPRINTS:
+                fingerprints.popitem(last=False)
+        else:
+            fingerprints.move_to_end(fingerprint)
+        return self._count(counter, now)
+    
+    def check(self, group_id: str, user_id: str, text: str, now: float) -> Optional[Tuple[str, bool]]:
+        """记录一条群消息 触发规则时返回 (原因, 是否需要警告/禁言) 否则返回 None"""
+        key = (group_id, user_id)
+        counter = self._users.get(key)
+        if counter is None:
+            counter = self._users[key] = FloodCounter()
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+        reason = None
+        if self._count(counter, now) > self.max_messages > 0:
+            reason = "刷屏"
+        text = text.strip()
+        if text:
+            fingerprint = hash(text)
+            if fingerprint == counter.fingerprint and now - counter.repeat_at <= self.window:
+                counter.repeats += 1
+            else:
+                counter.fingerprint = fingerprint
+                counter.repeats = 1
+            counter.repeat_at = now
+            if reason is None and counter.repeats > self.max_duplicates > 0:
+                reason = "重复发送相同内容"
+            if self.group_max_duplicates and self._group_count(group_id, fingerprint, now) > self.group_max_duplicates:
+                reason = reason or "复读"
+        if reason is None:
+            return None
+        fresh = now >= counter.punished_until
+        if fresh:
+            counter.punished_until = now + self.cooldown
+        return reason, fresh
+    
+    @property
+    def tracked(self) -> Tuple[int, int]:
+        return len(self._users), len(self._groups)
+
+class ModerationQueue:
+    """群管理动作的批量执行队列
+    
+    一个批次内合并重复的动作: 同一条消息只撤回一次 同一用户只禁言一次(取最长时长)
+    同一个群的警告合并成一条艾特所有人的消息 然后按令牌桶限速调用 OneBot 接口
+    """
+    
+    def __init__(self, warn_text: str = DEFAULT_FLOOD_WARN_TEXT, interval: float = FLOOD_BATCH_INTERVAL,
+                 rate: float = FLOOD_ACTION_RATE, burst: float = FLOOD_ACTION_BURST,
+                 concurrency: int = FLOOD_ACTION_CONCURRENCY):
+        self.warn_text = warn_text
+        self.interval = interval
+        self._bucket = TokenBucket(rate, burst)
+        self._semaphore = asyncio.Semaphore(max(int(concurrency), 1))
+        self._recalls: Dict[str, Any] = {}
+        self._mutes: Dict[Tuple[str, str], Tuple[Any, int]] = {}
+        self._warns: Dict[str, Tuple[Any, Dict[str, str]]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.calls = 0
+        self.failures = 0
+        self.dropped = 0
+    
+    def _queued(self) -> int:
+        return len(self._recalls) + len(self._mutes) + len(self._warns)
+    
+    def _accept(self) -> bool:
+        if self._queued() >= FLOOD_PENDING_LIMIT:
+            self.dropped += 1
+            return False
+        self._wakeup.set()
+        return True
+    
+    def recall(self, client: Any, message_id: str) -> None:
+        if message_id not in self._recalls and self._accept():
+            self._recalls[message_id] = client
+    
+    def mute(self, client: Any, group_id: str, user_id: str, seconds: int) -> None:
+        key = (group_id, user_id)
+        queued = self._mutes.get(key)
+        if queued is not None:
+            self._mutes[key] = (client, max(queued[1], seconds))
+        elif self._accept():
+            self._mutes[key] = (client, seconds)
+    
+    def warn(self, client: Any, group_id: str, user_id: str, reason: str) -> None:
+        queued = self._warns.get(group_id)
+        if queued is not None:
+            queued[1][user_id] = reason
+        elif self._accept():
+            self._warns[group_id] = (client, {user_id: reason})
+    
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+    
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self._wakeup.wait()
+                # 等一小段时间 让同一波刷屏产生的动作合并到一个批次
+                await asyncio.sleep(self.interval)
+                self._wakeup.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[XYTUFunction] 执行群管理动作出错: {e}")
+    
+    async def flush(self) -> None:
+        recalls, self._recalls = self._recalls, {}
+        mutes, self._mutes = self._mutes, {}
+        warns, self._warns = self._warns, {}
+        # 先禁言止住刷屏 再撤回 最后发警告
+        calls = [
+            (client, "set_group_ban", {"group_id": self._onebot_id(group_id), "user_id": self._onebot_id(user_id), "duration": seconds})
+            for (group_id, user_id), (client, seconds) in mutes.items()
+        ]
+        calls += [(client, "delete_msg", {"message_id": self._onebot_id(message_id)}) for message_id, client in recalls.items()]
+        for group_id, (client, users) in warns.items():
+            message = []
+            for user_id in users:
+                message.append({"type": "at", "data": {"qq": user_id}})
+            reasons = "、".join(dict.fromkeys(users.values()))
+            message.append({"type": "text", "data": {"text": f" {self.warn_text}({reasons})"}})
+            calls.append((client, "send_group_msg", {"group_id": self._onebot_id(group_id), "message": message}))
+        if calls:
+            await asyncio.gather(*(self._call(client, action, params) for client, action, params in calls))
+            logger.info(f"[XYTUFunction] 群管理批次: 禁言 {len(mutes)} | 撤回 {len(recalls)} | 警告 {len(warns)} 个群")
+    
+    @staticmethod
+    def _onebot_id(value: str) -> Any:
+        """OneBot 接口的 ID 参数是整数 非数字的 ID 原样传递"""
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    
+    async def _call(self, client: Any, action: str, params: Dict[str, Any]) -> None:
+        await self._bucket.acquire()
+        async with self._semaphore:
+            self.calls += 1
+            try:
+                ret = await client.api.call_action(action, **params)
+                if isinstance(ret, dict) and ret.get('status') not in (None, 'ok') and ret.get('retcode') != 0:
+                    self.failures += 1
+                    logger.warning(f"[XYTUFunction] {action} 失败: {ret}")
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"[XYTUFunction] {action} 调用出错: {e}")
+
+# ==================== tcping ====================
+@dataclass(slots=True)
+class TcpingResult:
+    """单个目标的 tcping 结果 耗时单位为秒"""
+    target: str
+    sent: int
+    samples: List[float]
+    error: Optional[str] = None
+    
+    @property
+    def loss(self) -> float:
+        return 1 - len(self.samples) / self.sent if self.sent else 1.0
+    
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+def parse_host_port(text: str, default_port: int) -> Optional[Tuple[str, int]]:
+    """解析 host:port / [v6]:port / host 不带端口时使用 default_port"""
+    text = text.strip()
+    if not text:
+        return None
+    if text.startswith("["):
+        host, _, rest = text[1:].partition("]")
+        port_text = rest[1:] if rest.startswith(":") else ""
+    elif text.count(":") == 1:
+        host, port_text = text.split(":")
+    else:
+        host, port_text = text, ""
+    try:
+        port = int(port_text) if port_text else default_port
+    except ValueError:
+        return None
+    if not host or not 0 < port < 65536:
+        return None
+    return host, port
+
+def is_public_address(address: str) -> bool:
+    """解析后的地址是否为公网地址 内网/回环/链路本地/保留/组播地址返回 False"""
+    try:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+    except ValueError:
+        return False
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+async def resolve_target(host: str, port: int, allow_private: bool) -> Tuple[int, Tuple]:
+    """解析目标 返回 (地址族, 地址) 之后直接连接该地址 避免解析和连接之间被换成内网地址"""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    family, _, _, _, address = infos[0]
+    if not allow_private and not is_public_address(address[0]):
+        raise PermissionError("不允许访问内网地址")
+    return family, address
+
+class TcpPinger:
+    """并发 TCP 连接探测
+    
+    所有目标的所有探测同时发起 总耗时约等于最慢的一次探测
+    并发上限是所有 tcping 指令共享的连接数上限 默认值能让单条指令满额目标的探测一次全部发出
+    多条指令同时进行、总连接数超过上限时 超出部分排队等待
+    域名先解析一次 计时只包含 TCP 握手 默认拒绝内网和回环地址
+    """
+    
+    def __init__(self, count: int = DEFAULT_TCPING_COUNT, timeout: float = DEFAULT_TCPING_TIMEOUT,
+                 concurrency: int = DEFAULT_TCPING_CONCURRENCY, allow_private: bool = False):
+        self.count = max(int(count), 1)
+        self.timeout = max(float(timeout), 0.1)
+        self.concurrency = max(int(concurrency), 1)
+        self.allow_private = allow_private
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+    
+    async def _probe(self, family: int, address: Tuple) -> Optional[float]:
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(address[0], address[1], family=family), self.timeout
+                )
+            except (OSError, asyncio.TimeoutError):
+                return None
+            elapsed = time.perf_counter() - started
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+            return elapsed
+    
+    async def _ping_target(self, target: str, host: str, port: int) -> TcpingResult:
+        try:
+            family, address = await asyncio.wait_for(resolve_target(host, port, self.allow_private), self.timeout)
+        except PermissionError as e:
+            return TcpingResult(target, self.count, [], str(e))
+        except asyncio.TimeoutError:
+            return TcpingResult(target, self.count, [], "解析失败: 超时")
+        except OSError as e:
+            return TcpingResult(target, self.count, [], f"解析失败: {str(e) or type(e).__name__}")
+        results = await asyncio.gather(*(self._probe(family, address) for _ in range(self.count)))
+        return TcpingResult(target, self.count, [r for r in results if r is not None])
+    
+    async def ping(self, targets: List[Tuple[str, str, int]]) -> List[TcpingResult]:
+        """targets 为 (原始文本, 主机, 端口) 列表"""
+        return list(await asyncio.gather(*(self._ping_target(t, h, p) for t, h, p in targets)))
+
+# ==================== 单飞缓存 ====================
+class SingleFlightCache:
+    """带 TTL 的单飞缓存
+    
+    同一个 key 并发请求时只执行一次 factory 其余请求等待同一个结果
+    结果在 ttl 秒内直接复用
+    """
+    
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = max(float(ttl), 0.0)
+        self.max_entries = max_entries
+        self._values: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+    
+    async def get(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._values.get(key)
+        if entry is not None and time.monotonic() < entry[0]:
+            return entry[1]
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(key, factory))
+            self._inflight[key] = future
+        # shield 保证某个等待者被取消时不会连带取消共享的采集任务
+        return await asyncio.shield(future)
+    
+    async def _run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await factory()
+            if self.ttl > 0:
+                if len(self._values) >= self.max_entries:
+                    self._evict()
+                self._values[key] = (time.monotonic() + self.ttl, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+    
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._values.items() if expires <= now]:
+            del self._values[key]
+        while len(self._values) >= self.max_entries:
+            del self._values[next(iter(self._values))]
+    
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        if key is None:
+            self._values.clear()
+        else:
+            self._values.pop(key, None)
+
+# ==================== Minecraft 服务器查询 ====================
+@dataclass(slots=True)
+class MinecraftStatus:
+    """Server List Ping 的查询结果"""
+    host: str
+    port: int
+    version: str
+    protocol: int
+    online: int
+    max_players: int
+    players: List[str]
+    motd: str
+    latency: float
+
+def _mc_pack_varint(value: int) -> bytes:
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _mc_pack_string(text: str) -> bytes:
+    data = text.encode('utf-8')
+    return _mc_pack_varint(len(data)) + data
+
+def _mc_packet(packet_id: int, payload: bytes = b"") -> bytes:
+    body = _mc_pack_varint(packet_id) + payload
+    return _mc_pack_varint(len(body)) + body
+
+async def _mc_read_varint(reader: asyncio.StreamReader) -> int:
+    result = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result - (1 << 32) if result & (1 << 31) else result
+    raise ValueError("VarInt 过长")
+
+def _mc_unpack_varint(data: bytes, offset: int = 0) -> Tuple[int, int]:
+    result = 0
+    for shift in range(0, 35, 7):
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, offset
+    raise ValueError("VarInt 过长")
+
+def _mc_chat_to_text(component: Any) -> str:
+    """把聊天组件(字符串/字典/列表)展开为纯文本 并去掉 § 格式符"""
+    if isinstance(component, str):
+        return MC_FORMAT_PATTERN.sub("", component)
+    if isinstance(component, list):
+        return "".join(_mc_chat_to_text(c) for c in component)
+    if isinstance(component, dict):
+        text = _mc_chat_to_text(component.get("text", ""))
+        return text + "".join(_mc_chat_to_text(c) for c in component.get("extra", []))
+    return ""
+
+class MinecraftPinger:
+    """异步 Server List Ping 客户端
+    
+    按服务器缓存结果 TTL 内的重复查询和同时到达的相同查询只产生一次网络往返
+    多个服务器并发查询 由信号量限制同时打开的连接数
+    默认拒绝内网和回环地址 trusted 中的服务器(管理员配置的默认服务器)不受限制
+    """
+    
+    def __init__(self, timeout: float = DEFAULT_MC_TIMEOUT, cache_ttl: float = DEFAULT_MC_CACHE_TTL,
+                 allow_private: bool = False, trusted: Optional[List[Tuple[str, int]]] = None):
+        self.timeout = max(float(timeout), 0.5)
+        self.allow_private = allow_private
+        self.trusted = {(host.lower(), port) for host, port in trusted or []}
+        self._cache = SingleFlightCache(cache_ttl, max_entries=256)
+        self._semaphore = asyncio.Semaphore(MC_QUERY_CONCURRENCY)
+    
+    async def query(self, host: str, port: int = DEFAULT_MC_PORT) -> MinecraftStatus:
+        return await self._cache.get((host.lower(), port), lambda: self._query(host, port))
+    
+    async def query_many(self, targets: List[Tuple[str, int]]) -> List[Any]:
+        """并发查询 失败的目标在结果中对应为异常对象"""
+        return list(await asyncio.gather(*(self.query(h, p) for h, p in targets), return_exceptions=True))
+    
+    async def _query(self, host: str, port: int) -> MinecraftStatus:
+        async with self._semaphore:
+            return await asyncio.wait_for(self._status(host, port), self.timeout)
+    
+    async def _status(self, host: str, port: int) -> MinecraftStatus:
+        allow_private = self.allow_private or (host.lower(), port) in self.trusted
+        family, address = await resolve_target(host, port, allow_private)
+        reader, writer = await asyncio.open_connection(address[0], address[1], family=family)
+        try:
+            handshake = (_mc_pack_varint(MC_PROTOCOL_VERSION) + _mc_pack_string(host)
+                         + struct.pack(">H", port) + _mc_pack_varint(1))
+            started = time.perf_counter()
+            writer.write(_mc_packet(0x00, handshake) + _mc_packet(0x00))
+            await writer.drain()
+            length = await _mc_read_varint(reader)
+            if not 0 < length <= MC_MAX_PACKET:
+                raise ValueError(f"响应长度异常: {length}")
+            packet = await reader.readexactly(length)
+            latency = time.perf_counter() - started
+            packet_id, offset = _mc_unpack_varint(packet)
+            if packet_id != 0x00:
+                raise ValueError(f"意外的数据包: {packet_id}")
+            text_length, offset = _mc_unpack_varint(packet, offset)
+            status = json.loads(packet[offset:offset + text_length].decode('utf-8'))
+            # 再发一次 ping 测延迟 部分服务器不响应 ping 时沿用状态请求的往返时间
+            try:
+                payload = int(time.time() * 1000)
+                started = time.perf_counter()
+                writer.write(_mc_packet(0x01, struct.pack(">q", payload)))
+                await writer.drain()
+                length = await asyncio.wait_for(_mc_read_varint(reader), self.timeout / 2)
+                pong = await reader.readexactly(length)
+                if pong[:1] == b"\x01":
+                    latency = time.perf_counter() - started
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        version = status.get("version") or {}
+        players = status.get("players") or {}
+        return MinecraftStatus(
+            host=host,
+            port=port,
+            version=_mc_chat_to_text(version.get("name", "未知")),
+            protocol=int(version.get("protocol", -1)),
+            online=int(players.get("online", 0)),
+            max_players=int(players.get("max", 0)),
+            players=[_mc_chat_to_text(p.get("name", "")) for p in players.get("sample") or [] if isinstance(p, dict)],
+            motd=" ".join(_mc_chat_to_text(status.get("description", "")).split()),
+            latency=latency
+        )
+
+# ==================== API 余额查询 ====================
+@dataclass(slots=True)
+class BalanceTarget:
+    """一个需要查询余额的 API Key"""
+    name: str
+    api_base: str
+    key: str
+    
+    @property
+    def key_hint(self) -> str:
+        return f"{self.key[:3]}...{self.key[-4:]}" if len(self.key) > 10 else "***"
+
+def _format_amount(value: Any, currency: str) -> str:
+    try:
+        return f"{float(value):.2f} {currency}"
+    except (TypeError, ValueError):
+        return f"{value} {currency}"
+
+class BalanceQuerier:
+    """OpenAI 兼容接口的余额查询
+    
+    所有请求共用一个保持连接的 aiohttp 会话 同一个 Key 的结果在 cache_ttl 内复用
+    按 api_base 的域名选择对应厂商的余额接口 其余按 one-api/new-api 的 dashboard/billing 接口查询
+    同一主机的请求先在信号量上排队 拿到连接名额后才开始计时 排队时间不算进单个请求的超时
+    """
+    
+    def __init__(self, timeout: float = DEFAULT_BALANCE_TIMEOUT, cache_ttl: float = DEFAULT_BALANCE_CACHE_TTL):
+        self.timeout = max(float(timeout), 1.0)
+        self._cache = SingleFlightCache(cache_ttl, max_entries=256)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=BALANCE_POOL_SIZE,
+                limit_per_host=BALANCE_POOL_PER_HOST,
+                keepalive_timeout=BALANCE_KEEPALIVE,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+    
+    async def query_many(self, targets: List[BalanceTarget]) -> List[Tuple[BalanceTarget, bool, str]]:
+        """并发查询 返回 (目标, 是否成功, 余额或错误说明) 单个目标失败不影响其他目标"""
+        async def run(target: BalanceTarget) -> Tuple[BalanceTarget, bool, str]:
+            try:
+                # 超时由会话的 ClientTimeout 控制 不在外层 wait_for 以免取消共享的查询
+                balance = await self._cache.get((target.api_base, target.key), lambda: self._fetch(target))
+                return target, True, balance
+            except asyncio.TimeoutError:
+                return target, False, "查询超时"
+            except aiohttp.ClientResponseError as e:
+                return target, False, f"HTTP {e.status}"
+            except Exception as e:
+                return target, False, f"查询失败 {type(e).__name__}"
+        return list(await asyncio.gather(*(run(t) for t in targets)))
+    
+    async def _get_json(self, url: str, key: str) -> Dict[str, Any]:
+        headers = {"Authorization": f"Bearer {key}"}
+        netloc = urlsplit(url).netloc
+        slot = self._host_slots.get(netloc)
+        if slot is None:
+            slot = self._host_slots[netloc] = asyncio.Semaphore(BALANCE_POOL_PER_HOST)
+        async with slot:
+            async with self._get_session().get(url, headers=headers) as resp:
+                resp.raise_for_status()
+                return await resp.json(content_type=None)
+    
+    async def _fetch(self, target: BalanceTarget) -> str:
+        parts = urlsplit(target.api_base)
+        root = f"{parts.scheme}://{parts.netloc}"
+        host = parts.hostname or ""
+        if "deepseek" in host:
+            data = await self._get_json(f"{root}/user/balance", target.key)
+            infos = data.get("balance_infos") or []
+            return "、".join(_format_amount(i.get("total_balance"), i.get("currency", "")) for i in infos) or "无余额信息"
+        if "siliconflow" in host:
+            data = (await self._get_json(f"{root}/v1/user/info", target.key)).get("data") or {}
+            return _format_amount(data.get("totalBalance", data.get("balance")), "CNY")
+        if "moonshot" in host:
+            data = (await self._get_json(f"{root}/v1/users/me/balance", target.key)).get("data") or {}
+            return _format_amount(data.get("available_balance"), "CNY")
+        if "openrouter" in host:
+            data = (await self._get_json(f"{root}/api/v1/credits", target.key)).get("data") or {}
+            return _format_amount(float(data.get("total_credits", 0)) - float(data.get("total_usage", 0)), "USD")
+        # one-api/new-api 等中转 总额度减去已用额度(单位为美分)
+        today = datetime.date.today()
+        start = (today - datetime.timedelta(days=99)).isoformat()
+        end = (today + datetime.timedelta(days=1)).isoformat()
+        subscription, usage = await asyncio.gather(
+            self._get_json(f"{root}/v1/dashboard/billing/subscription", target.key),
+            self._get_json(f"{root}/v1/dashboard/billing/usage?start_date={start}&end_date={end}", target.key)
+        )
+        total = float(subscription.get("hard_limit_usd", 0))
+        used = float(usage.get("total_usage", 0)) / 100
+        return f"{total - used:.2f} USD (已用 {used:.2f} / 总额 {total:.2f})"
+    
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+# ==================== 定时任务调度 ====================
+@dataclass(slots=True)
+class ScheduledJob:
+    """一个定时任务 interval 为 0 表示只执行一次"""
+    job_id: int
+    next_run: float
+    interval: float
+    umo: str
+    creator: str
+    content: str
+
+class JobScheduler:
+    """单任务驱动的持久化定时器
+    
+    内存里只保留 SCHEDULE_LOAD_HORIZON 内到期的任务 按到期时间放在最小堆里
+    调度任务睡到堆顶到期或被新任务唤醒 空闲时不会轮询 更远的任务留在 SQLite 里按时间窗口分批载入
+    每轮最多派发 max_per_tick 个任务 积压的任务顺延到下一轮
+    重启后错过的任务在 catch_up 秒内的补发一次 超过的跳过 周期任务错过多次也只补发一次
+    """
+    
+    def __init__(self, path: str, handler: Callable[[ScheduledJob], Awaitable[Any]],
+                 max_per_tick: int = DEFAULT_SCHEDULE_MAX_PER_TICK, catch_up: float = DEFAULT_SCHEDULE_CATCH_UP):
+        self.path = path
+        self.handler = handler
+        self.max_per_tick = max(int(max_per_tick), 1)
+        self.catch_up = max(float(catch_up), 0.0)
+        self._jobs: Dict[int, ScheduledJob] = {}
+        self._heap: List[Tuple[float, int]] = []
+        # 数据库中 next_run 小于该时间的任务都已载入内存
+        self._loaded_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="XYTUScheduler")
+        self.dispatched = 0
+        self.skipped = 0
+        self.failed = 0
+    
+    # ---------- 数据库操作 均在单独线程执行 ----------
+    def _db_open(self) -> None:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, next_run REAL NOT NULL, interval REAL NOT NULL, "
+                "umo TEXT NOT NULL, creator TEXT NOT NULL, content TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_next_run ON jobs (next_run)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_umo ON jobs (umo)")
+            self._conn.commit()
+    
+    def _db_load(self, start: float, end: float) -> List[ScheduledJob]:
+        self._db_open()
+        rows = self._conn.execute(
+            "SELECT id, next_run, interval, umo, creator, content FROM jobs "
+            "WHERE next_run >= ? AND next_run < ? ORDER BY next_run",
+            (start, end)
+        ).fetchall()
+        return [ScheduledJob(*row) for row in rows]
+    
+    def _db_insert(self, job: ScheduledJob) -> int:
+        self._db_open()
+        cursor = self._conn.execute(
+            "INSERT INTO jobs (next_run, interval, umo, creator, content) VALUES (?, ?, ?, ?, ?)",
+            (job.next_run, job.interval, job.umo, job.creator, job.content)
+        )
+        self._conn.commit()
+        return cursor.lastrowid
+    
+    def _db_apply(self, updates: List[Tuple[float, int]], deletes: List[Tuple[int]]) -> None:
+        if updates:
+            self._conn.executemany("UPDATE jobs SET next_run = ? WHERE id = ?", updates)
+        if deletes:
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", deletes)
+        self._conn.commit()
+    
+    def _db_delete(self, job_id: int, creator: Optional[str]) -> bool:
+        self._db_open()
+        if creator is None:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        else:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE id = ? AND creator = ?", (job_id, creator))
+        self._conn.commit()
+        return cursor.rowcount > 0
+    
+    def _db_query(self, sql: str, params: Tuple) -> List[Tuple]:
+        self._db_open()
+        return self._conn.execute(sql, params).fetchall()
+    
+    async def _run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    # ---------- 调度 ----------
+    def _push(self, job: ScheduledJob) -> None:
+        """任务在已载入窗口内则放进堆 否则只留在数据库"""
+        if job.next_run < self._loaded_until:
+            existing = self._jobs.get(job.job_id)
+            # 新增任务和窗口载入同时发生时可能被推入两次
+            if existing is not None and existing.next_run == job.next_run:
+                return
+            self._jobs[job.job_id] = job
+            if not self._heap or job.next_run < self._heap[0][0]:
+                self._wakeup.set()
+            heapq.heappush(self._heap, (job.next_run, job.job_id))
+        else:
+            self._jobs.pop(job.job_id, None)
+    
+    async def _refill(self, now: float) -> None:
+        end = now + SCHEDULE_LOAD_HORIZON
+        # 首次载入从 0 开始 把停机期间错过的任务一起取出
+        jobs = await self._run(self._db_load, self._loaded_until, end)
+        self._loaded_until = end
+        for job in jobs:
+            self._push(job)
+        if jobs:
+            logger.debug(f"[XYTUFunction] 定时任务载入 {len(jobs)} 个 内存中共 {len(self._jobs)} 个")
+    
+    def _pop_due(self, now: float) -> List[ScheduledJob]:
+        """取出到期任务 只有需要执行的任务计入单轮上限 超过补发时限直接跳过的不计入"""
+        due = []
+        runnable = 0
+        while self._heap and self._heap[0][0] <= now and runnable < self.max_per_tick:
+            next_run, job_id = heapq.heappop(self._heap)
+            job = self._jobs.get(job_id)
+            # 已删除或已改期的任务在堆里留下的旧条目直接丢弃
+            if job is not None and job.next_run == next_run:
+                due.append(job)
+                if now - next_run <= self.catch_up:
+                    runnable += 1
+        return due
+    
+    async def _dispatch(self, due: List[ScheduledJob], now: float) -> None:
+        run_jobs = []
+        updates: List[Tuple[float, int]] = []
+        deletes: List[Tuple[int]] = []
+        for job in due:
+            self._jobs.pop(job.job_id, None)
+            if now - job.next_run <= self.catch_up:
+                run_jobs.append(job)
+            else:
+                self.skipped += 1
+            if job.interval > 0:
+                # 错过多个周期时直接跳到下一个未来的时间点
+                missed = int((now - job.next_run) // job.interval) + 1
+                job.next_run += missed * job.interval
+                updates.append((job.next_run, job.job_id))
+                self._push(job)
+            else:
+                deletes.append((job.job_id,))
+        try:
+            await self._run(self._db_apply, updates, deletes)
+        except sqlite3.Error as e:
+            logger.warning(f"[XYTUFunction] 保存定时任务失败: {e}")
+        results = await asyncio.gather(*(self.handler(job) for job in run_jobs), return_exceptions=True)
+        for job, result in zip(run_jobs, results):
+            if isinstance(result, BaseException):
+                self.failed += 1
+                logger.warning(f"[XYTUFunction] 定时任务 {job.job_id} 执行失败: {result}")
+            else:
+                self.dispatched += 1
+    
+    async def _loop(self) -> None:
+        while True:
+            try:
+                now = time.time()
+                if now >= self._loaded_until:
+                    await self._refill(now)
+                due = self._pop_due(now)
+                if due:
+                    await self._dispatch(due, now)
+                    if self._heap and self._heap[0][0] <= time.time():
+                        await asyncio.sleep(SCHEDULE_TICK)
+                    continue
+                deadline = min(self._heap[0][0], self._loaded_until) if self._heap else self._loaded_until
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(deadline - time.time(), 0))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[XYTUFunction] 定时任务调度出错: {e}")
+                await asyncio.sleep(SCHEDULE_TICK)
+    
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+    
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close)
+        self._executor.shutdown(wait=False)
+    
+    # ---------- 对外接口 ----------
+    async def add(self, next_run: float, interval: float, umo: str, creator: str, content: str) -> ScheduledJob:
+        job = ScheduledJob(0, next_run, interval, umo, creator, content)
+        job.job_id = await self._run(self._db_insert, job)
+        self._push(job)
+        return job
+    
+    async def remove(self, job_id: int, creator: Optional[str] = None) -> bool:
+        """删除任务 creator 不为空时只删除该用户创建的任务"""
+        removed = await self._run(self._db_delete, job_id, creator)
+        if removed:
+            self._jobs.pop(job_id, None)
+        return removed
+    
+    async def list_jobs(self, umo: str) -> List[ScheduledJob]:
+        rows = await self._run(
+            self._db_query,
+            "SELECT id, next_run, interval, umo, creator, content FROM jobs WHERE umo = ? ORDER BY next_run",
+            (umo,)
+        )
+        return [ScheduledJob(*row) for row in rows]
+    
+    async def count_by_creator(self, creator: str) -> int:
+        rows = await self._run(self._db_query, "SELECT COUNT(*) FROM jobs WHERE creator = ?", (creator,))
+        return rows[0][0]
+    
+    @property
+    def loaded(self) -> int:
+        return len(self._jobs)
+
+def parse_schedule_duration(text: str) -> Optional[float]:
+    """解析 1h30m / 10分钟 / 2天 这类时长 返回秒数"""
+    if not SCHEDULE_DURATION_FULL.match(text):
+        return None
+    return float(sum(int(n) * SCHEDULE_UNITS[u.lower()] for n, u in SCHEDULE_DURATION_PATTERN.findall(text)))
+
+def next_clock_time(text: str, now: Optional[float] = None) -> Optional[float]:
+    """解析 HH:MM 返回下一次到达该时刻的时间戳"""
+    match = SCHEDULE_CLOCK_PATTERN.match(text)
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    current = datetime.datetime.fromtimestamp(now if now is not None else time.time())
+    target = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= current:
+        target += datetime.timedelta(days=1)
+    return target.timestamp()
+
+# ==================== 回复分段 ====================
+class StreamSegmenter:
+    """把增量到达的文本按段落和句子边界切分
+    
+    缓冲区达到 min_chars 后在第一个边界处切出一段 代码块内部不切
+    超过 max_chars 仍没有边界时在最后一个逗号或空白处强制切分
+    """
+    
+    def __init__(self, min_chars: int = DEFAULT_SEGMENT_MIN_CHARS, max_chars: int = DEFAULT_SEGMENT_MAX_CHARS):
+        self.min_chars = max(int(min_chars), 1)
+        self.max_chars = max(int(max_chars), self.min_chars)
+        self._buffer = ""
+        self._scan_from = 0
+    
+    def _find_cut(self) -> Optional[int]:
+        buffer = self._buffer
+        for match in SEGMENT_BOUNDARY_PATTERN.finditer(buffer, self._scan_from):
+            end = match.end()
+            # 边界在缓冲区末尾时后面可能还有引号或句点后的空白没到 等下一块再判断
+            if end == len(buffer) and match.group()[-1] not in "\n。！？…":
+                break
+            if end >= self.min_chars and buffer.count("```", 0, end) % 2 == 0:
+                return end
+        if len(buffer) >= self.max_chars and buffer.count("```") % 2 == 0:
+            soft = [m.end() for m in SEGMENT_SOFT_BREAK_PATTERN.finditer(buffer, self.min_chars, self.max_chars)]
+            return soft[-1] if soft else self.max_chars
+        # 之前扫描过的部分不会再出现新的可切分边界 下次从末尾附近继续
+        self._scan_from = max(len(buffer) - 2, 0)
+        return None
+    
+    def feed(self, text: str) -> List[str]:
+        """追加文本 返回已经完整的分段"""
+        self._buffer += text
+        segments = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                return segments
+            segment = self._buffer[:cut].strip()
+            self._buffer = self._buffer[cut:].lstrip()
+            self._scan_from = 0
+            if segment:
+                segments.append(segment)
+    
+    def flush(self) -> Optional[str]:
+        """取出剩余内容"""
+        segment = self._buffer.strip()
+        self._buffer = ""
+        self._scan_from = 0
+        return segment or None
+
+def _chain_text(item: Any) -> Optional[str]:
+    """提取消息链中的纯文本 含有非文本组件时返回 None"""
+    if isinstance(item, str):
+        return item
+    parts = []
+    for component in getattr(item, "chain", item) or []:
+        text = component if isinstance(component, str) else getattr(component, "text", None)
+        if not isinstance(text, str):
+            return None
+        parts.append(text)
+    return "".join(parts)
+
+class SegmentedReply:
+    """按最短间隔依次发送分段 每段发送前调用 should_stop 判断是否中止"""
+    
+    def __init__(self, send: Callable[[Any], Awaitable[Any]], should_stop: Callable[[], Awaitable[bool]],
+                 interval: float, on_first: Optional[Callable[[float], None]] = None):
+        self._send = send
+        self._should_stop = should_stop
+        self.interval = interval
+        self._on_first = on_first
+        self.started = time.perf_counter()
+        self.sent = 0
+        self.stopped = False
+        self._last: Optional[float] = None
+    
+    async def ready(self) -> bool:
+        """等到可以发送下一段 已中止时返回 False"""
+        if self.stopped:
+            return False
+        if self._last is not None:
+            wait = self._last + self.interval - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        if await self._should_stop():
+            self.stopped = True
+        return not self.stopped
+    
+    def mark_sent(self) -> None:
+        now = time.perf_counter()
+        if self.sent == 0 and self._on_first:
+            self._on_first(now - self.started)
+        self.sent += 1
+        self._last = now
+    
+    async def send(self, item: Any) -> bool:
+        if not await self.ready():
+            return False
+        await self._send(item)
+        self.mark_sent()
+        return True
+
+# ==================== 表情包仓库 ====================
+def sniff_image_ext(data: bytes) -> Optional[str]:
+    """按文件头判断图片格式 不是图片时返回 None"""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def compute_dhash(data: bytes, size: int = STICKER_HASH_SIZE) -> int:
+    """差值感知哈希 缩成 (size+1)*size 的灰度图后比较相邻像素 得到 size*size 位整数"""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image.seek(0)
+        # JPEG 直接按缩小的尺寸解码 大图也很快
+        image.draft("RGB", (size * 8, size * 8))
+        image.thumbnail((size * 8, size * 8))
+        if image.mode in ("RGBA", "LA", "P"):
+            # 透明区域按白底处理 否则同一张图在不同编码下透明处的颜色不一致
+            image = image.convert("RGBA")
+            background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+            background.alpha_composite(image)
+            image = background
+        pixels = list(image.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+class MultiIndexHash:
+    """64 位感知哈希的多索引哈希表
+    
+    把哈希切成 chunks 段 每段一张 段值 -> 键集合 的表 按鸽巢原理 距离不超过 r 的两个哈希
+    至少有一段的距离不超过 r // chunks 查询时只枚举每段的邻近段值 再逐个核对候选的完整距离
+    随机分布的 64 位哈希上 BK 树在半径 6 时几乎要走遍所有节点 这里只需几十次查表
+    """
+    
+    def __init__(self, bits: int = STICKER_HASH_SIZE * STICKER_HASH_SIZE, chunks: int = 4):
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self._mask = (1 << self.chunk_bits) - 1
+        self._tables: List[Dict[int, set]] = [{} for _ in range(chunks)]
+        self._values: Dict[str, int] = {}
+        self._flips: Dict[int, List[int]] = {}
+    
+    def __len__(self) -> int:
+        return len(self._values)
+    
+    def _flip_masks(self, radius: int) -> List[int]:
+        """段内翻转不超过 radius 位的所有掩码"""
+        masks = self._flips.get(radius)
+        if masks is None:
+            masks = [0]
+            for _ in range(radius):
+                masks = sorted({m | (1 << bit) for m in masks for bit in range(self.chunk_bits)} | set(masks))
+            self._flips[radius] = masks
+        return masks
+    
+    def add(self, value: int, key: str) -> None:
+        if key in self._values:
+            self.remove(key)
+        self._values[key] = value
+        for i, table in enumerate(self._tables):
+            chunk = (value >> (i * self.chunk_bits)) & self._mask
+            keys = table.get(chunk)
+            if keys is None:
+                table[chunk] = {key}
+            else:
+                keys.add(key)
+    
+    def remove(self, key: str) -> None:
+        value = self._values.pop(key, None)
+        if value is None:
+            return
+        for i, table in enumerate(self._tables):
+            chunk = (value >> (i * self.chunk_bits)) & self._mask
+            keys = table.get(chunk)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del table[chunk]
+    
+    def search(self, value: int, radius: int) -> List[Tuple[int, str]]:
+        """返回距离不超过 radius 的 (距离, 键) 按距离升序"""
+        masks = self._flip_masks(radius // self.chunks)
+        candidates: set = set()
+        for i, table in enumerate(self._tables):
+            chunk = (value >> (i * self.chunk_bits)) & self._mask
+            for mask in masks:
+                keys = table.get(chunk ^ mask)
+                if keys:
+                    candidates.update(keys)
+        values = self._values
+        result = []
+        for key in candidates:
+            distance = (values[key] ^ value).bit_count()
+            if distance <= radius:
+                result.append((distance, key))
+        result.sort()
+        return result
+
+def _to_signed64(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+class StickerStore:
+    """内容寻址的表情包仓库
+    
+    图片按 sha256 保存为 stickers/<前两位>/<sha256>.<扩展名> 元数据在 SQLite 感知哈希在内存多索引哈希表里
+    与已有图片的感知哈希距离不超过 distance 的视为同一张(重新编码、缩放过的副本) 不再保存
+    哈希在有界线程池里计算 文件和数据库操作在单独的线程里串行执行 总大小超过上限时淘汰最久未使用的图片
+    """
+    
+    def __init__(self, root: str, max_bytes: int, distance: int = DEFAULT_STICKER_DISTANCE,
+                 workers: int = DEFAULT_STICKER_WORKERS):
+        self.root = root
+        self.max_bytes = max(int(max_bytes), 1024 * 1024)
+        self.distance = max(int(distance), 0)
+        self.total_bytes = 0
+        self.counts: Dict[str, int] = {STICKER_ADDED: 0, STICKER_DUPLICATE: 0, STICKER_SIMILAR: 0, STICKER_REJECTED: 0}
+        self.evicted = 0
+        self._index = MultiIndexHash()
+        # sha256 -> (字节数, 感知哈希, 扩展名) 按最近使用排序
+        self._lru: "OrderedDict[str, Tuple[int, Optional[int], str]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._loaded: Optional[asyncio.Future] = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="XYTUSticker")
+        self._hash_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(int(workers), 1), thread_name_prefix="XYTUStickerHash"
+        )
+        try:
+            import PIL  # noqa: F401
+            self.perceptual = True
+        except ImportError:
+            logger.warning("[XYTUFunction] Pillow 未安装，表情包只按文件内容去重")
+            self.perceptual = False
+    
+    @property
+    def count(self) -> int:
+        return len(self._lru)
+    
+    def path_for(self, sha: str, ext: str) -> str:
+        return os.path.join(self.root, sha[:2], f"{sha}.{ext}")
+    
+    async def _run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    def _open_and_load(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.root, STICKER_DB_FILE), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stickers ("
+            "sha TEXT PRIMARY KEY, phash INTEGER, size INTEGER NOT NULL, ext TEXT NOT NULL, "
+            "source TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL, uses INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.commit()
+        for sha, phash, size, ext in self._conn.execute(
+            "SELECT sha, phash, size, ext FROM stickers ORDER BY last_used"
+        ):
+            if phash is not None:
+                phash &= (1 << 64) - 1
+                self._index.add(phash, sha)
+            self._lru[sha] = (size, phash, ext)
+            self.total_bytes += size
+        self._evict()
+        self._conn.commit()
+        logger.info(f"[XYTUFunction] 表情包仓库已载入 {len(self._lru)} 张 | {self.total_bytes / 1024 / 1024:.1f} MiB")
+    
+    async def load(self) -> None:
+        if self._loaded is None:
+            self._loaded = asyncio.ensure_future(self._run(self._open_and_load))
+        await self._loaded
+    
+    def _fingerprint(self, data: bytes) -> Tuple[str, Optional[int], Optional[str]]:
+        ext = sniff_image_ext(data)
+        sha = hashlib.sha256(data).hexdigest()
+        phash = None
+        if ext and self.perceptual:
+            try:
+                phash = compute_dhash(data)
+            except Exception as e:
+                logger.debug(f"[XYTUFunction] 计算感知哈希失败: {e}")
+        return sha, phash, ext
+    
+    async def add(self, data: bytes, source: str = "") -> Tuple[Optional[str], str]:
+        """保存一张图片 返回 (仓库中对应图片的 sha256, 结果)"""
+        await self.load()
+        sha, phash, ext = await asyncio.get_running_loop().run_in_executor(self._hash_pool, self._fingerprint, data)
+        sha, status = await self._run(self._store, data, sha, phash, ext, source)
+        self.counts[status] += 1
+        return sha, status
+    
+    def _store(self, data: bytes, sha: str, phash: Optional[int], ext: Optional[str],
+               source: str) -> Tuple[Optional[str], str]:
+        if ext is None:
+            return None, STICKER_REJECTED
+        if sha in self._lru:
+            self._touch(sha)
+            return sha, STICKER_DUPLICATE
+        if phash is not None:
+            matches = self._index.search(phash, self.distance)
+            if matches:
+                similar = matches[0][1]
+                self._touch(similar)
+                return similar, STICKER_SIMILAR
+        path = self.path_for(sha, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO stickers (sha, phash, size, ext, source, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (sha, _to_signed64(phash) if phash is not None else None, len(data), ext, source, now, now)
+        )
+        self._lru[sha] = (len(data), phash, ext)
+        if phash is not None:
+            self._index.add(phash, sha)
+        self.total_bytes += len(data)
+        self._evict()
+        self._conn.commit()
+        return sha, STICKER_ADDED
+    
+    def _touch(self, sha: str) -> None:
+        self._lru.move_to_end(sha)
+        self._conn.execute("UPDATE stickers SET last_used = ?, uses = uses + 1 WHERE sha = ?", (time.time(), sha))
+        self._conn.commit()
+    
+    def _evict(self) -> None:
+        # 至少保留最新的一张
+        while self.total_bytes > self.max_bytes and len(self._lru) > 1:
+            sha, (size, phash, ext) = self._lru.popitem(last=False)
+            try:
+                os.remove(self.path_for(sha, ext))
+            except OSError:
+                pass
+            self._conn.execute("DELETE FROM stickers WHERE sha = ?", (sha,))
+            if phash is not None:
+                self._index.remove(sha)
+            self.total_bytes -= size
+            self.evicted += 1
+    
+    def _pick_random(self) -> Optional[str]:
+        if not self._lru:
+            return None
+        sha = random.choice(list(self._lru))
+        self._touch(sha)
+        return self.path_for(sha, self._lru[sha][2])
+    
+    async def random_sticker(self) -> Optional[str]:
+        """随机取一张图片的路径 并记为最近使用"""
+        await self.load()
+        return await self._run(self._pick_random)
+    
+    def close(self) -> None:
+        self._hash_pool.shutdown(wait=False, cancel_futures=True)
+        self._executor.shutdown(wait=True)
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+class StickerCollector:
+    """表情包下载队列
+    
+    固定数量的下载协程从有界队列取任务 队列满时直接丢弃 最近见过的图片文件名不再重复下载
+    下载完成后交给仓库在线程池里哈希和保存
+    """
+    
+    def __init__(self, store: StickerStore, workers: int = DEFAULT_STICKER_WORKERS,
+                 timeout: float = STICKER_DOWNLOAD_TIMEOUT, max_bytes: int = STICKER_MAX_DOWNLOAD):
+        self.store = store
+        self.workers = max(int(workers), 1)
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self.failed = 0
+        self._queue: "asyncio.Queue[Tuple[str, str]]" = asyncio.Queue(STICKER_QUEUE_LIMIT)
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._tasks: List[asyncio.Task] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.workers, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+    
+    def submit(self, file_id: str, url: str, source: str) -> bool:
+        """加入下载队列 已经见过或队列已满时返回 False"""
+        key = file_id or url
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            return False
+        try:
+            self._queue.put_nowait((url, source))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self._recent[key] = None
+        if len(self._recent) > STICKER_RECENT_FILES:
+            self._recent.popitem(last=False)
+        return True
+    
+    def start(self) -> None:
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+    
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._session and not self._session.closed:
+            await self._session.close()
+    
+    async def _download(self, url: str) -> Optional[bytes]:
+        async with self._get_session().get(url) as resp:
+            resp.raise_for_status()
+            if (resp.content_length or 0) > self.max_bytes:
+                return None
+            data = bytearray()
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                data += chunk
+                if len(data) > self.max_bytes:
+                    return None
+            return bytes(data)
+    
+    async def _worker(self) -> None:
+        while True:
+            url, source = await self._queue.get()
+            try:
+                data = await self._download(url)
+                if data:
+                    await self.store.add(data, source)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.debug(f"[XYTUFunction] 表情包下载失败: {e}")
+            finally:
+                self._queue.task_done()
+
+# ==================== 指令分发器 ====================
+class CommandDispatcher:
+    """预编译的指令分发器
+    
+    按唤醒词首字符建立前缀索引 触发词归一化后放进哈希表
+    绝大多数非指令消息在首字符查表时就会被直接拒绝
+    带参数的指令在精确匹配失败后再按触发词前缀匹配 剩余部分作为参数
+    """
+    
+    def __init__(self, awake_words: List[str], commands: Dict[str, List[str]], arg_commands: Tuple[str, ...] = ()):
+        self._prefix_index: Dict[str, Tuple[str, ...]] = {}
+        self._triggers: Dict[str, str] = {}
+        self._arg_triggers: Tuple[Tuple[str, str], ...] = ()
+        for command, trigger_words in commands.items():
+            for word in trigger_words:
+                key = self.normalize(word)
+                if not key:
+                    continue
+                if key in self._triggers and self._triggers[key] != command:
+                    logger.warning(f"[XYTUFunction] 触发词 '{word}' 同时用于 {self._triggers[key]} 和 {command}，以前者为准")
+                    continue
+                self._triggers[key] = command
+        if not self._triggers:
+            return
+        self._arg_triggers = tuple(sorted(
+            ((key, command) for key, command in self._triggers.items() if command in arg_commands),
+            key=lambda item: len(item[0]), reverse=True
+        ))
+        grouped: Dict[str, List[str]] = {}
+        for awake_word in awake_words:
+            if awake_word and awake_word not in grouped.get(awake_word[0], []):
+                grouped.setdefault(awake_word[0], []).append(awake_word)
+        for first_char, words in grouped.items():
+            # 长唤醒词优先 保证 XYTUFT 不会被 XYTU 抢先截断
+            self._prefix_index[first_char] = tuple(sorted(words, key=len, reverse=True))
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        return text.strip().lower()
+    
+    def match(self, text: str) -> Optional[Tuple[str, str]]:
+        """返回命中的 (指令名, 参数) 未命中返回 None"""
+        if not text:
+            return None
+        candidates = self._prefix_index.get(text[0])
+        if candidates is None:
+            return None
+        for awake_word in candidates:
+            if text.startswith(awake_word):
+                remaining = self.normalize(text[len(awake_word):])
+                command = self._triggers.get(remaining)
+                if command is not None:
+                    return command, ""
+                for trigger, command in self._arg_triggers:
+                    if remaining.startswith(trigger):
+                        return command, text[len(awake_word):].strip()[len(trigger):].strip()
+        return None
+
+# ==================== 主插件类 ====================
+@register("astrbot_plugin_XYTUFunction", "Tangzixy , Slime , SLserver , XYTUworkshop", "Astrbot基础功能插件？ 一个就够了！", "v0.4.1", "https://github.com/XYTUworkshop/astrbot_plugin_XYTUFunction")
+class XYTUFunctionPlugin(Star):
+    def __init__(self, context: Context, config: AstrBotConfig):
+        super().__init__(context)
+        self.config = config
+        self.awake_words = config.get("awake_words", ["XYTU", "XYTUFT"])
+        logger.info(f"XYTUFunction 插件 v0.4.0 初始化，唤醒词: {self.awake_words}")
+        self._command_handlers = {
+            "status": self._handle_status,
+            "status_history": self._handle_status_history,
+            "like": self._handle_like,
+            "stats": self._handle_stats,
+            "like_other": self._handle_like_other,
+            "tcping": self._handle_tcping,
+            "motd": self._handle_motd,
+            "mcplayer": self._handle_mcplayer,
+            "balance": self._handle_balance,
+            "schedule": self._handle_schedule,
+            "lag": self._handle_lag,
+            "sticker": self._handle_sticker,
+        }
+        self._build_dispatcher()
+        
+        # 运行指标相关
+        self._metrics = MetricsRegistry()
+        if config.get("lag_monitor_enabled", False):
+            threshold = max(float(config.get("lag_monitor_threshold_ms", DEFAULT_LAG_THRESHOLD_MS)), MIN_LAG_THRESHOLD_MS) / 1000
+            # 心跳间隔不超过阈值 持续两倍阈值以上的阻塞一定会被抓到调用栈
+            self._metrics.lag_interval = min(LOOP_LAG_INTERVAL, threshold)
+            self._metrics.watchdog = LoopWatchdog(threshold)
+        self._process = psutil.Process()
+        self._exporter: Optional[MetricsExporter] = None
+        self._exporter_task: Optional[asyncio.Task] = None
+        export_mode = config.get("metrics_export_mode", EXPORT_MODE_OFF)
+        if export_mode in (EXPORT_MODE_FILE, EXPORT_MODE_HTTP):
+            self._exporter = MetricsExporter(
+                self._render_metrics,
+                export_mode,
+                config.get("metrics_export_path", "") or os.path.join(get_plugin_data_dir(), METRICS_FILE),
+                config.get("metrics_http_host", DEFAULT_METRICS_HOST),
+                config.get("metrics_http_port", DEFAULT_METRICS_PORT),
+                config.get("metrics_export_interval", DEFAULT_EXPORT_INTERVAL)
+            )
+        elif export_mode != EXPORT_MODE_OFF:
+            logger.warning(f"[XYTUFunction] 未知的指标导出方式: {export_mode}")
+        
+        # 状态功能相关
+        self.status_enabled = config.get("status_enabled", False)
+        self._sampler: Optional[MetricsSampler] = None
+        self._hardware: Optional[HardwareInfo] = None
+        self._hardware_task: Optional[asyncio.Future] = None
+        self._disk_prober: Optional[DiskProber] = None
+        self._status_cache = SingleFlightCache(config.get("status_cache_ttl", DEFAULT_STATUS_CACHE_TTL))
+        if self.status_enabled:
+            self._sampler = MetricsSampler(
+                config.get("status_sample_interval", DEFAULT_SAMPLE_INTERVAL),
+                config.get("status_sample_retention", DEFAULT_SAMPLE_RETENTION)
+            )
+            self._disk_prober = DiskProber(
+                config.get("disk_probe_timeout", DEFAULT_DISK_PROBE_TIMEOUT),
+                config.get("disk_include", []),
+                config.get("disk_exclude", [])
+            )
+        self._history: Optional[StatusHistory] = None
+        self._history_task: Optional[asyncio.Task] = None
+        if self.status_enabled and config.get("status_history_enabled", False):
+            try:
+                self._history = StatusHistory(os.path.join(get_plugin_data_dir(), HISTORY_FILE))
+                self._sampler.add_listener(self._record_history_sample)
+            except (OSError, ValueError) as e:
+                logger.error(f"[XYTUFunction] 打开状态历史文件失败: {e}")
+        
+        # 赞我功能相关
+        self._like_ledger: Optional[LikeLedger] = None
+        # 同一用户的赞我和赞他共用一次 API 调用 两条路径都取点赞结果字符串
+        self._like_flight = SingleFlightCache(0)
+        self._like_concurrency = max(int(config.get("like_max_concurrency", DEFAULT_LIKE_CONCURRENCY)), 1)
+        self._like_semaphore = asyncio.Semaphore(self._like_concurrency)
+        self._like_bucket = TokenBucket(
+            config.get("like_rate_per_second", DEFAULT_LIKE_RATE),
+            config.get("like_rate_burst", DEFAULT_LIKE_BURST)
+        )
+        self._active_users: Optional[ActiveUserTracker] = None
+        if config.get("like_enabled", False) or config.get("like_other_enabled", False):
+            self._like_ledger = LikeLedger(os.path.join(get_plugin_data_dir(), LIKE_LEDGER_FILE))
+        if config.get("like_other_enabled", False):
+            self._active_users = ActiveUserTracker()
+        
+        # 智能群管理相关
+        self._flood: Optional[FloodDetector] = None
+        self._moderation: Optional[ModerationQueue] = None
+        if config.get("flood_enabled", False):
+            self._flood = FloodDetector(
+                config.get("flood_window_seconds", DEFAULT_FLOOD_WINDOW),
+                config.get("flood_max_messages", DEFAULT_FLOOD_MAX_MESSAGES),
+                config.get("flood_max_duplicates", DEFAULT_FLOOD_MAX_DUPLICATES),
+                config.get("flood_group_max_duplicates", DEFAULT_FLOOD_GROUP_MAX_DUPLICATES),
+                config.get("flood_cooldown_seconds", DEFAULT_FLOOD_COOLDOWN)
+            )
+            self._moderation = ModerationQueue(config.get("flood_warn_text", DEFAULT_FLOOD_WARN_TEXT) or DEFAULT_FLOOD_WARN_TEXT)
+        self._flood_groups = frozenset(str(g) for g in config.get("flood_groups", []) or [])
+        self._flood_whitelist = frozenset(str(u) for u in config.get("flood_whitelist", []) or [])
+        self._flood_actions = frozenset(config.get("flood_actions", [FLOOD_ACTION_WARN]) or [])
+        self._flood_mute_seconds = max(int(config.get("flood_mute_seconds", DEFAULT_FLOOD_MUTE_SECONDS)), 60)
+        
+        # 表情包相关
+        self._stickers: Optional[StickerStore] = None
+        self._sticker_collector: Optional[StickerCollector] = None
+        if config.get("sticker_enabled", False):
+            workers = config.get("sticker_workers", DEFAULT_STICKER_WORKERS)
+            self._stickers = StickerStore(
+                os.path.join(get_plugin_data_dir(), STICKER_DIR),
+                int(config.get("sticker_max_size_mb", DEFAULT_STICKER_MAX_MB)) * 1024 * 1024,
+                config.get("sticker_hash_distance", DEFAULT_STICKER_DISTANCE),
+                workers
+            )
+            self._sticker_collector = StickerCollector(self._stickers, workers)
+        self._sticker_groups = frozenset(str(g) for g in config.get("sticker_groups", []) or [])
+        self._sticker_only_stickers = config.get("sticker_only_stickers", True)
+        
+        # 运维工具相关
+        self._tcpinger = TcpPinger(
+            config.get("tcping_count", DEFAULT_TCPING_COUNT),
+            config.get("tcping_timeout", DEFAULT_TCPING_TIMEOUT),
+            config.get("tcping_concurrency", DEFAULT_TCPING_CONCURRENCY),
+            config.get("net_tools_allow_private", False)
+        )
+        
+        self._mc_pinger = MinecraftPinger(
+            config.get("mc_timeout", DEFAULT_MC_TIMEOUT),
+            config.get("mc_cache_ttl", DEFAULT_MC_CACHE_TTL),
+            config.get("net_tools_allow_private", False),
+            [t for t in (parse_host_port(text, DEFAULT_MC_PORT) for text in config.get("mc_default_servers", [])) if t]
+        )
+        
+        self._balance = BalanceQuerier(
+            config.get("balance_timeout", DEFAULT_BALANCE_TIMEOUT),
+            config.get("balance_cache_ttl", DEFAULT_BALANCE_CACHE_TTL)
+        )
+        
+        # 定时任务相关
+        self._scheduler: Optional[JobScheduler] = None
+        if config.get("schedule_enabled", False):
+            self._scheduler = JobScheduler(
+                os.path.join(get_plugin_data_dir(), SCHEDULE_DB_FILE),
+                self._run_scheduled_job,
+                config.get("schedule_max_per_tick", DEFAULT_SCHEDULE_MAX_PER_TICK),
+                config.get("schedule_catch_up_seconds", DEFAULT_SCHEDULE_CATCH_UP)
+            )
         
         # 撤回防回复相关
         self.recall_enabled = config.get("recall_prevention_enabled", False)
         if self.recall_enabled:
-            self._state = RecallStateManager()
+            self._state = RecallStateManager(config.get("recall_max_records", DEFAULT_MAX_RECORDS))
+            self._grace = RecallGraceWindow(
+                config.get("recall_grace_mode", GRACE_MODE_ADAPTIVE),
+                config.get("recall_grace_seconds", DEFAULT_GRACE_SECONDS),
+                config.get("recall_grace_max_seconds", DEFAULT_GRACE_MAX_SECONDS),
+                config.get("recall_window_seconds", DEFAULT_RECALL_WINDOW_SECONDS)
+            )
             self._stats = PluginStats()
-            self._cleanup_task = None
+            self._provider_guard = ProviderCallGuard()
             logger.info("[XYTUFunction] 撤回防回复功能已启用")
         else:
             logger.info("[XYTUFunction] 撤回防回复功能未启用")
+        self._shared_recalls: Optional[SharedRecallLog] = None
+        self._shared_recall_task: Optional[asyncio.Task] = None
+        self._shared_recall_wakeup = asyncio.Event()
+        self._shared_poll_interval = max(float(config.get("recall_shared_poll_ms", DEFAULT_RECALL_SHARED_POLL_MS)), 1.0) / 1000
+        backend = config.get("recall_state_backend", RECALL_BACKEND_MEMORY)
+        if self.recall_enabled and backend == RECALL_BACKEND_SQLITE:
+            path = config.get("recall_shared_path", "")
+            if not path:
+                # 每个 AstrBot 实例有自己的数据目录 默认路径只在共用同一数据目录的进程之间共享
+                path = os.path.join(get_plugin_data_dir(), RECALL_SHARED_FILE)
+                logger.warning(f"[XYTUFunction] 未填写 recall_shared_path，使用本实例数据目录 {path} "
+                               f"不同 AstrBot 实例之间不会共享撤回记录，请在各实例填写相同路径")
+            try:
+                self._shared_recalls = SharedRecallLog(path)
+                logger.info(f"[XYTUFunction] 撤回记录跨进程共享已启用 | {path}")
+            except sqlite3.Error as e:
+                logger.error(f"[XYTUFunction] 打开共享撤回记录失败，仅在本进程内生效: {e}")
+        elif self.recall_enabled and backend != RECALL_BACKEND_MEMORY:
+            logger.warning(f"[XYTUFunction] 未知的撤回状态后端: {backend}，使用 {RECALL_BACKEND_MEMORY}")
+        self._cleanup_task: Optional[asyncio.Task] = None
+        
+        # 回复分段相关
+        self.segment_enabled = config.get("segment_enabled", False)
+        self._segment_min_chars = config.get("segment_min_chars", DEFAULT_SEGMENT_MIN_CHARS)
+        self._segment_max_chars = config.get("segment_max_chars", DEFAULT_SEGMENT_MAX_CHARS)
+        self._segment_interval = max(float(config.get("segment_interval", DEFAULT_SEGMENT_INTERVAL)), 0.0)
+        
+        # AstrBot 启动完成后才会触发 on_loaded 插件被重载时则不会 此时直接启动后台任务
+        try:
+            asyncio.get_running_loop()
+            self._start_background_tasks()
+        except RuntimeError:
+            pass
         
     # ==================== 原有状态和赞我功能 ====================
     def _get_cpu_model(self) -> str:
@@ -221,20 +3348,17 @@ class XYTUFunctionPlugin(Star):
             cpu_model = "未知"
         return cpu_model
     
-    def _get_cpu_info(self) -> tuple:
+    def _clean_cpu_model(self, cpu_model: str) -> str:
         try:
-            cpu_model = self._get_cpu_model()
-            cpu_percent = psutil.cpu_percent(interval=0.5)
             if "(" in cpu_model and ")" in cpu_model:
                 cpu_model = re.sub(r'\([^)]*\)', '', cpu_model).strip()
             redundant_words = ["CPU", "Processor", "processor", "@", "(R)", "(TM)", "  "]
             for word in redundant_words:
                 cpu_model = cpu_model.replace(word, "").strip()
-            cpu_model = ' '.join(cpu_model.split())
-            return cpu_model, f"{cpu_percent:.1f}%"
+            return ' '.join(cpu_model.split())
         except Exception as e:
             logger.error(f"获取CPU信息失败: {e}")
-            return "未知", "0%"
+            return "未知"
     
     def _get_greeting(self) -> str:
         hour = datetime.datetime.now().hour
@@ -251,25 +3375,23 @@ class XYTUFunctionPlugin(Star):
         else:
             return "深夜"
     
-    def _get_memory_info(self) -> tuple:
+    def _get_memory_info(self, sample: MetricsSample) -> tuple:
         try:
-            memory = psutil.virtual_memory()
-            total_gb = memory.total / (1024 ** 3)
-            used_gb = memory.used / (1024 ** 3)
-            percent = memory.percent
+            total_gb = sample.memory_total / (1024 ** 3)
+            used_gb = sample.memory_used / (1024 ** 3)
+            percent = sample.memory_percent
             return f"{used_gb:.1f}G/{total_gb:.1f}G", f"{percent:.1f}%"
         except Exception as e:
             logger.error(f"获取内存信息失败: {e}")
             return "0G/0G", "0%"
     
-    def _get_system_info(self) -> tuple:
+    def _get_system_name(self) -> str:
         try:
             if platform.system() == "Windows":
                 import winreg
                 try:
                     key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Windows NT\CurrentVersion")
                     product_name = winreg.QueryValueEx(key, "ProductName")[0]
-                    release_id = winreg.QueryValueEx(key, "ReleaseId")[0] if "ReleaseId" in [winreg.EnumValue(key, i)[0] for i in range(winreg.QueryInfoKey(key)[1])] else ""
                     winreg.CloseKey(key)
                     if "(" in product_name and ")" in product_name:
                         product_name = re.sub(r'\s*\([^)]*\)', '', product_name)
@@ -279,168 +3401,238 @@ class XYTUFunctionPlugin(Star):
                     system_info = re.sub(r'\s*\([^)]*\)', '', system_info)
             else:
                 system_info = f"{platform.system()} {platform.release()}"
-            boot_time = psutil.boot_time()
-            now = time.time()
-            uptime_seconds = now - boot_time
-            uptime_days = int(uptime_seconds // (24 * 3600))
-            uptime_hours = int((uptime_seconds % (24 * 3600)) // 3600)
-            uptime_minutes = int((uptime_seconds % 3600) // 60)
-            if uptime_days > 0:
-                uptime_str = f"{uptime_days}天{uptime_hours}小时{uptime_minutes}分"
-            else:
-                uptime_str = f"{uptime_hours}小时{uptime_minutes}分"
-            return system_info, uptime_str
+            return system_info
         except Exception as e:
             logger.error(f"获取系统信息失败: {e}")
-            return platform.platform(), "未知"
+            return platform.platform()
     
-    def _get_disk_info(self) -> List[str]:
-        disk_info = []
+    def _get_uptime(self, sample: MetricsSample) -> str:
+        uptime_seconds = sample.uptime_seconds
+        uptime_days = int(uptime_seconds // (24 * 3600))
+        uptime_hours = int((uptime_seconds % (24 * 3600)) // 3600)
+        uptime_minutes = int((uptime_seconds % 3600) // 60)
+        if uptime_days > 0:
+            return f"{uptime_days}天{uptime_hours}小时{uptime_minutes}分"
+        return f"{uptime_hours}小时{uptime_minutes}分"
+    
+    def _load_hardware_info(self) -> HardwareInfo:
+        """在工作线程中执行 优先读取与本次开机匹配的磁盘缓存"""
+        boot_id = get_boot_id()
+        cache_path = None
         try:
-            partitions = psutil.disk_partitions(all=False)
-            for partition in partitions:
-                try:
-                    if 'cdrom' in partition.opts or partition.fstype == '':
-                        continue
-                    usage = psutil.disk_usage(partition.mountpoint)
-                    total_gb = usage.total / (1024 ** 3)
-                    used_gb = usage.used / (1024 ** 3)
-                    percent = usage.percent
-                    device = partition.device
-                    if platform.system() == "Windows":
-                        device = partition.device
-                    elif platform.system() == "Linux":
-                        device = os.path.basename(partition.device)
-                    disk_info.append(f"   {device}: {used_gb:.1f}G/{total_gb:.1f}G | {percent:.1f}%")
-                except Exception as e:
-                    logger.warning(f"获取分区 {partition.mountpoint} 信息失败: {e}")
-                    continue
-        except Exception as e:
-            logger.error(f"获取硬盘信息失败: {e}")
-            disk_info.append("   无法获取硬盘信息")
-        return disk_info
+            cache_path = os.path.join(get_plugin_data_dir(), HARDWARE_CACHE_FILE)
+            with open(cache_path, "r", encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get("boot_id") == boot_id:
+                return HardwareInfo(cpu_model=cached["cpu_model"], system_name=cached["system_name"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        info = HardwareInfo(
+            cpu_model=self._clean_cpu_model(self._get_cpu_model()),
+            system_name=self._get_system_name()
+        )
+        if cache_path:
+            try:
+                with open(cache_path, "w", encoding='utf-8') as f:
+                    json.dump({"boot_id": boot_id, "cpu_model": info.cpu_model, "system_name": info.system_name}, f, ensure_ascii=False)
+            except OSError as e:
+                logger.warning(f"[XYTUFunction] 写入硬件信息缓存失败: {e}")
+        return info
     
-    async def _send_like(self, event: AstrMessageEvent) -> bool:
-        """给用户点赞"""
+    def _start_hardware_probe(self) -> asyncio.Future:
+        if self._hardware_task is None:
+            self._hardware_task = asyncio.ensure_future(asyncio.to_thread(self._load_hardware_info))
+        return self._hardware_task
+    
+    async def _get_hardware_info(self) -> HardwareInfo:
+        if self._hardware is None:
+            try:
+                self._hardware = await self._start_hardware_probe()
+            except Exception as e:
+                logger.error(f"[XYTUFunction] 获取硬件信息失败: {e}")
+                self._hardware_task = None
+                return HardwareInfo(cpu_model="未知", system_name=platform.platform())
+        return self._hardware
+    
+    def _get_onebot_client(self, event: AstrMessageEvent) -> Optional[Any]:
+        """取得 aiocqhttp 客户端 不支持的平台返回 None"""
+        platform_name = event.get_platform_name()
+        if platform_name != "aiocqhttp":
+            logger.warning(f"赞我功能不支持平台: {platform_name}")
+            return None
+        from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import AiocqhttpMessageEvent
+        if not isinstance(event, AiocqhttpMessageEvent):
+            logger.error("事件类型不是AiocqhttpMessageEvent")
+            return None
+        client = event.bot
+        if not client:
+            logger.error("无法获取QQ客户端")
+            return None
+        return client
+    
+    async def _call_send_like(self, client: Any, user_id: str) -> str:
+        """调用 send_like 并写入台账 返回点赞结果"""
         try:
-            platform_name = event.get_platform_name()
-            if platform_name != "aiocqhttp":
-                logger.warning(f"赞我功能不支持平台: {platform_name}")
-                return False
-            user_id = event.get_sender_id()
-            if not user_id:
-                logger.error("无法获取用户ID")
-                return False
-            from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import AiocqhttpMessageEvent
-            if not isinstance(event, AiocqhttpMessageEvent):
-                logger.error("事件类型不是AiocqhttpMessageEvent")
-                return False
-            client = event.bot
-            if not client:
-                logger.error("无法获取QQ客户端")
-                return False
-            payloads = {"user_id": int(user_id), "times": 10}
-            ret = await client.api.call_action('send_like', **payloads)
+            payloads = {"user_id": int(user_id), "times": LIKE_TIMES}
+            # 令牌桶控制速率 信号量限制同时进行的调用数 刷屏时平滑地排队发送
+            await self._like_bucket.acquire()
+            async with self._like_semaphore:
+                started = time.perf_counter()
+                try:
+                    ret = await client.api.call_action('send_like', **payloads)
+                finally:
+                    self._metrics.observe("like_api", time.perf_counter() - started)
             if ret is None:
                 logger.info(f"点赞API返回None，可能表示成功（用户ID: {user_id}）")
-                return True
-            if isinstance(ret, dict):
+                status = LIKE_STATUS_LIKED
+            elif isinstance(ret, dict):
                 if ret.get('status') == 'ok' or ret.get('retcode') == 0:
                     logger.info(f"成功给用户 {user_id} 点了10个赞")
-                    return True
+                    status = LIKE_STATUS_LIKED
                 else:
                     logger.error(f"点赞失败: {ret}")
-                    event.stop_event()
-                    return False
+                    if "上限" in str(ret.get('message', '')) or "上限" in str(ret.get('wording', '')):
+                        status = LIKE_STATUS_CAPPED
+                    else:
+                        status = LIKE_RESULT_FAILED
             else:
                 logger.info(f"点赞API返回: {ret}，视为成功")
-                return True
+                status = LIKE_STATUS_LIKED
         except Exception as e:
             error_msg = str(e)
             logger.error(f"调用点赞API失败: {error_msg}")
-            if "已达上限" in error_msg or "点赞失败" in error_msg:
-                event.stop_event()
-            return False
+            status = LIKE_STATUS_CAPPED if "已达上限" in error_msg else LIKE_RESULT_FAILED
+        if status != LIKE_RESULT_FAILED:
+            await self._record_like(user_id, status)
+        return status
     
-    def _get_raw_message(self, event: AstrMessageEvent) -> str:
-        """获取原始消息"""
-        try:
-            if hasattr(event, 'message_obj') and hasattr(event.message_obj, 'raw_message'):
-                if isinstance(event.message_obj.raw_message, str):
-                    return event.message_obj.raw_message
-                elif hasattr(event.message_obj.raw_message, '__str__'):
-                    raw_str = str(event.message_obj.raw_message)
-                    if "'raw_message':" in raw_str:
-                        try:
-                            start = raw_str.find("'raw_message':") + len("'raw_message':")
-                            end = raw_str.find(",", start)
-                            if end == -1:
-                                end = raw_str.find("}", start)
-                            if end != -1:
-                                raw_msg = raw_str[start:end].strip()
-                                if raw_msg.startswith("'") and raw_msg.endswith("'"):
-                                    raw_msg = raw_msg[1:-1]
-                                elif raw_msg.startswith('"') and raw_msg.endswith('"'):
-                                    raw_msg = raw_msg[1:-1]
-                                return raw_msg
-                        except:
-                            pass
-                    return raw_str
-            if hasattr(event, 'raw_message'):
-                return str(event.raw_message)
-            return event.message_str
+    async def _send_like(self, event: AstrMessageEvent) -> str:
+        """给用户点赞 返回点赞结果 与赞他共用同一个 single-flight 和结果取值"""
+        try:
+            user_id = event.get_sender_id()
+            if not user_id:
+                logger.error("无法获取用户ID")
+                return LIKE_RESULT_FAILED
+            client = self._get_onebot_client(event)
+            if client is None:
+                return LIKE_RESULT_FAILED
+            user_id = str(user_id)
+            status = await self._like_flight.get(user_id, lambda: self._call_send_like(client, user_id))
+            if status != LIKE_STATUS_LIKED:
+                event.stop_event()
+            return status
         except Exception as e:
-            logger.error(f"获取原始消息失败: {e}")
-            return ""
-    
-    def _check_awake_and_trigger(self, event: AstrMessageEvent, trigger_words: List[str]) -> bool:
-        """检查是否被唤醒并且消息匹配触发词"""
-        try:
-            raw_msg = self._get_raw_message(event)
-            if not raw_msg:
-                raw_msg = event.message_str
-            logger.info(f"原始消息内容: '{raw_msg}'，唤醒词列表: {self.awake_words}")
-            for awake_word in self.awake_words:
-                if raw_msg.startswith(awake_word):
-                    remaining = raw_msg[len(awake_word):].strip()
-                    for word in trigger_words:
-                        if remaining.lower() == word.lower():
-                            logger.info(f"匹配成功: 唤醒词='{awake_word}', 触发词='{word}'")
-                            return True
-            return False
+            logger.error(f"调用点赞API失败: {e}")
+            return LIKE_RESULT_FAILED
+    
+    async def _record_like(self, user_id: str, status: str) -> None:
+        if self._like_ledger:
+            await self._like_ledger.record(str(user_id), status)
+    
+    def _build_dispatcher(self) -> None:
+        """根据当前配置预编译指令分发器 配置变更时重新调用"""
+        config = self.config
+        commands: Dict[str, List[str]] = {}
+        if config.get("status_enabled", False):
+            commands["status"] = config.get("status_trigger_words", ["状态", "status"]) or ["状态", "status"]
+        if config.get("status_enabled", False) and config.get("status_history_enabled", False):
+            status_words = config.get("status_trigger_words", ["状态", "status"]) or ["状态", "status"]
+            history_words = config.get("status_history_trigger_words", ["历史", "history"]) or ["历史", "history"]
+            commands["status_history"] = [
+                f"{status}{sep}{history}" for status in status_words for history in history_words for sep in (" ", "")
+            ]
+        if config.get("like_enabled", False):
+            commands["like"] = config.get("like_trigger_words", ["赞我", "zanwo"]) or ["赞我", "zanwo"]
+        if config.get("stats_enabled", False):
+            commands["stats"] = config.get("stats_trigger_words", ["统计", "stats"]) or ["统计", "stats"]
+        if config.get("like_other_enabled", False):
+            commands["like_other"] = config.get("like_other_trigger_words", ["赞他", "zanta"]) or ["赞他", "zanta"]
+        if config.get("tcping_enabled", False):
+            commands["tcping"] = config.get("tcping_trigger_words", ["tcping"]) or ["tcping"]
+        if config.get("mc_enabled", False):
+            commands["motd"] = config.get("mc_motd_trigger_words", ["motd"]) or ["motd"]
+            commands["mcplayer"] = config.get("mc_player_trigger_words", ["mcplayer", "玩家"]) or ["mcplayer", "玩家"]
+        if config.get("balance_enabled", False):
+            commands["balance"] = config.get("balance_trigger_words", ["余额", "balance"]) or ["余额", "balance"]
+        if config.get("schedule_enabled", False):
+            commands["schedule"] = config.get("schedule_trigger_words", ["定时", "schedule"]) or ["定时", "schedule"]
+        if config.get("sticker_enabled", False):
+            commands["sticker"] = config.get("sticker_trigger_words", ["表情包", "sticker"]) or ["表情包", "sticker"]
+        if config.get("lag_monitor_enabled", False):
+            commands["lag"] = config.get("lag_monitor_trigger_words", ["卡顿", "lag"]) or ["卡顿", "lag"]
+        self._dispatcher = CommandDispatcher(
+            self.awake_words, commands, ("status_history", "like_other", "tcping", "motd", "mcplayer", "schedule", "sticker")
+        )
+        logger.debug(f"[XYTUFunction] 指令分发器已构建: {list(commands)}")
+    
+    @filter.event_message_type(filter.EventMessageType.ALL)
+    async def on_message_command(self, event: AstrMessageEvent):
+        """统一指令入口 非指令消息在这里直接返回"""
+        try:
+            started = time.perf_counter()
+            raw_msg = get_parsed_message(event).raw_text
+            if self._active_users is not None:
+                group_id = event.get_group_id()
+                if group_id:
+                    self._active_users.touch(group_id, event.get_sender_id())
+            matched = self._dispatcher.match(raw_msg)
+            self._metrics.observe("dispatch", time.perf_counter() - started)
+            if matched is None:
+                return
+            command, args = matched
+            logger.info(f"[XYTUFunction] 匹配指令: {command} | 消息: '{raw_msg}'")
         except Exception as e:
             logger.error(f"检查唤醒和触发失败: {e}")
-            return False
+            return
+        async for result in self._command_handlers[command](event, args):
+            yield result
     
-    @filter.event_message_type(filter.EventMessageType.ALL)
-    async def on_message_status(self, event: AstrMessageEvent):
+    async def _collect_status_body(self) -> str:
+        """采集并渲染状态正文 不含问候语和用户名"""
+        started = time.perf_counter()
+        self._sampler.start()
+        sample = self._sampler.latest()
+        hardware = await self._get_hardware_info()
+        cpu_model = hardware.cpu_model
+        cpu_percent = f"{sample.cpu_percent:.1f}%"
+        memory_str, memory_percent = self._get_memory_info(sample)
+        system_version = hardware.system_name
+        uptime = self._get_uptime(sample)
+        disk_info = await self._disk_prober.probe()
+        body = "当前状态：\n"
+        body += " CPU\n"
+        body += f"   {cpu_model} | {cpu_percent}\n"
+        body += " RAM\n"
+        body += f"   {memory_str} | {memory_percent}\n"
+        body += " System\n"
+        body += f"   {system_version} | {uptime}\n"
+        body += " Bot\n"
+        body += f"   {self._get_process_info()}\n"
+        if disk_info:
+            body += " Disk\n"
+            body += "\n".join(disk_info)
+        self._metrics.observe("status_collect", time.perf_counter() - started)
+        return body
+    
+    def _get_process_info(self) -> str:
+        """机器人进程自身的内存、线程数和事件循环卡顿"""
+        try:
+            with self._process.oneshot():
+                rss = self._process.memory_info().rss
+                threads = self._process.num_threads()
+            process_str = f"RSS {rss / 1024 / 1024:.1f} MiB | 线程 {threads}"
+        except psutil.Error:
+            process_str = "进程信息获取失败"
+        lag = self._metrics.histograms["loop_lag"]
+        return f"{process_str} | 卡顿 {self._metrics.last_lag * 1000:.1f}ms (p99 {lag.quantile(0.99) * 1000:.1f}ms)"
+    
+    async def _handle_status(self, event: AstrMessageEvent, args: str = ""):
         """处理状态请求"""
         try:
-            config = self.config
-            if not config.get("status_enabled", False):
-                return
-            trigger_words = config.get("status_trigger_words", ["状态", "status"])
-            if not trigger_words:
-                trigger_words = ["状态", "status"]
-            if not self._check_awake_and_trigger(event, trigger_words):
-                return
             username = event.get_sender_name()
             greeting = self._get_greeting()
-            cpu_model, cpu_percent = self._get_cpu_info()
-            memory_str, memory_percent = self._get_memory_info()
-            system_version, uptime = self._get_system_info()
-            disk_info = self._get_disk_info()
-            response = f"{greeting}好呀{username} 随时待命\n"
-            response += "当前状态：\n"
-            response += " CPU\n"
-            response += f"   {cpu_model} | {cpu_percent}\n"
-            response += " RAM\n"
-            response += f"   {memory_str} | {memory_percent}\n"
-            response += " System\n"
-            response += f"   {system_version} | {uptime}\n"
-            if disk_info:
-                response += " Disk\n"
-                response += "\n".join(disk_info)
+            body = await self._status_cache.get("status", self._collect_status_body)
+            response = f"{greeting}好呀{username} 随时待命\n" + body
             yield event.plain_result(response)
         except Exception as e:
             logger.error(f"处理状态请求失败: {e}")
@@ -449,22 +3641,90 @@ class XYTUFunctionPlugin(Star):
             except:
                 pass
     
-    @filter.event_message_type(filter.EventMessageType.ALL)
-    async def on_message_like(self, event: AstrMessageEvent):
-        """处理点赞请求"""
+    # ==================== 状态历史 ====================
+    def _record_history_sample(self, sample: MetricsSample) -> None:
+        self._history.record(sample.timestamp, {"cpu": sample.cpu_percent, "mem": sample.memory_percent})
+    
+    async def _history_loop(self) -> None:
+        """定时把磁盘占用写入状态历史 CPU 和内存由采样器回调写入"""
+        while True:
+            try:
+                values = {
+                    f"disk:{partition.mountpoint}": usage.percent
+                    for partition, usage in await self._disk_prober.probe_usage() if usage is not None
+                }
+                if values:
+                    self._history.record(time.time(), values)
+                await asyncio.sleep(HISTORY_DISK_INTERVAL)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[XYTUFunction] 记录状态历史出错: {e}")
+                await asyncio.sleep(HISTORY_DISK_INTERVAL)
+    
+    @staticmethod
+    def _format_duration(seconds: float) -> str:
+        seconds = int(seconds)
+        for unit, size in (("天", 86400), ("小时", 3600), ("分钟", 60)):
+            if seconds >= size and seconds % size == 0:
+                return f"{seconds // size}{unit}"
+        return f"{seconds}秒"
+    
+    @staticmethod
+    def _sparkline(points: List[Optional[Tuple[float, float, float]]]) -> str:
+        chars = HISTORY_SPARK_CHARS
+        return "".join(
+            chars[min(int(p[1] / 100 * len(chars)), len(chars) - 1)] if p else " " for p in points
+        )
+    
+    async def _handle_status_history(self, event: AstrMessageEvent, args: str = ""):
+        """处理状态历史请求 例如 状态 历史 1h"""
         try:
-            config = self.config
-            if not config.get("like_enabled", False):
+            if self._history is None:
+                yield event.plain_result("状态历史不可用 请检查插件日志")
                 return
-            trigger_words = config.get("like_trigger_words", ["赞我", "zanwo"])
-            if not trigger_words:
-                trigger_words = ["赞我", "zanwo"]
-            if not self._check_awake_and_trigger(event, trigger_words):
+            seconds = parse_schedule_duration(args.strip()) if args.strip() else HISTORY_DEFAULT_RANGE
+            if not seconds:
+                yield event.plain_result("用法: 状态 历史 [时长] 例如 状态 历史 1h / 6h / 7d")
                 return
+            step, series = self._history.query(seconds)
+            if not series:
+                yield event.plain_result("还没有历史数据 稍后再试")
+                return
+            labels = {"cpu": "CPU", "mem": "RAM"}
+            lines = [f"最近 {self._format_duration(seconds)} 的状态 (每格 {self._format_duration(step)})"]
+            for name, points in series.items():
+                present = [p for p in points if p]
+                low = min(p[0] for p in present)
+                high = max(p[2] for p in present)
+                average = sum(p[1] for p in present) / len(present)
+                lines.append(f" {labels.get(name, name[len('disk:'):])}  {self._sparkline(points)}")
+                lines.append(f"   最低 {low:.1f}% | 平均 {average:.1f}% | 最高 {high:.1f}%")
+            yield event.plain_result("\n".join(lines))
+        except Exception as e:
+            logger.error(f"处理状态历史请求失败: {e}")
+            try:
+                yield event.plain_result("获取状态历史时出现错误")
+            except:
+                pass
+    
+    async def _handle_like(self, event: AstrMessageEvent, args: str = ""):
+        """处理点赞请求"""
+        try:
             username = event.get_sender_name()
-            success = await self._send_like(event)
-            if success:
+            user_id = event.get_sender_id()
+            status = await self._like_ledger.get_status(str(user_id)) if self._like_ledger and user_id else None
+            if status == LIKE_STATUS_LIKED:
+                yield event.plain_result(f"今天已经给你点过赞啦{username} 明天再来罢")
+                return
+            if status == LIKE_STATUS_CAPPED:
+                yield event.plain_result(f"今天的赞已经点满了{username} 明天再来罢")
+                return
+            status = await self._send_like(event)
+            if status == LIKE_STATUS_LIKED:
                 response = f"给你点了10个赞 记得回我哦{username}"
+            elif status == LIKE_STATUS_CAPPED:
+                response = f"今天的赞已经点满了{username} 明天再来罢"
             else:
                 response = f"呀 怎么失败了{username} 明天再来罢"
             yield event.plain_result(response)
@@ -476,55 +3736,437 @@ class XYTUFunctionPlugin(Star):
             except:
                 pass
     
-    # ==================== 撤回防回复功能 ====================
-    def _get_message_id(self, event: AstrMessageEvent) -> Optional[str]:
-        """从事件中提取原始消息 ID"""
-        try:
-            raw = getattr(event.message_obj, 'raw_message', None)
-            if raw:
-                if isinstance(raw, dict):
-                    msg_id = raw.get('message_id')
-                    if msg_id:
-                        return str(msg_id)
-                elif hasattr(raw, 'message_id'):
-                    msg_id = getattr(raw, 'message_id', None)
-                    if msg_id:
-                        return str(msg_id)
-            msg_id = getattr(event.message_obj, 'message_id', None)
-            if msg_id:
-                msg_id_str = str(msg_id)
-                compact = msg_id_str.replace("-", "")
-                if len(compact) == 32 and compact.isalnum():
-                    return None
-                return msg_id_str
+    def _parse_like_targets(self, event: AstrMessageEvent, args: str) -> Optional[List[str]]:
+        """解析赞他的目标 @提及 / QQ号列表 / 今日活跃 返回 None 表示没有可识别的目标"""
+        if args in ("全体", "所有人", "今日活跃", "活跃", "all"):
+            if self._active_users is None:
+                return None
+            group_id = event.get_group_id()
+            return self._active_users.get(group_id) if group_id else None
+        targets = CQ_AT_PATTERN.findall(args)
+        for component in getattr(event.message_obj, 'message', None) or []:
+            qq = getattr(component, 'qq', None)
+            if qq is not None and type(component).__name__ == "At":
+                targets.append(str(qq))
+        targets.extend(re.findall(r"(?<![\d=])\d{5,11}(?!\d)", CQ_AT_PATTERN.sub(" ", args)))
+        self_id = str(getattr(event.message_obj, 'self_id', "") or "")
+        # 去重并排除机器人自己和 @全体成员
+        unique = [t for t in dict.fromkeys(targets) if t not in ("all", self_id)]
+        return unique or None
+    
+    async def _bulk_like(self, client: Any, user_ids: List[str]) -> Dict[str, List[str]]:
+        """用固定数量的 worker 消费队列 返回按结果分组的用户"""
+        results: Dict[str, List[str]] = {
+            LIKE_STATUS_LIKED: [], LIKE_STATUS_CAPPED: [], LIKE_RESULT_FAILED: [], LIKE_RESULT_SKIPPED: []
+        }
+        queue: asyncio.Queue = asyncio.Queue()
+        for user_id in user_ids:
+            status = await self._like_ledger.get_status(user_id) if self._like_ledger else None
+            if status is not None:
+                results[LIKE_RESULT_SKIPPED if status == LIKE_STATUS_LIKED else status].append(user_id)
+            else:
+                queue.put_nowait(user_id)
+        
+        async def worker() -> None:
+            while True:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                # 排队期间用户可能已经自己发了赞我 调用前再查一次台账
+                status = await self._like_ledger.get_status(user_id) if self._like_ledger else None
+                if status is not None:
+                    results[LIKE_RESULT_SKIPPED if status == LIKE_STATUS_LIKED else status].append(user_id)
+                    continue
+                status = await self._like_flight.get(str(user_id), lambda: self._call_send_like(client, user_id))
+                results[status].append(user_id)
+        
+        workers = min(self._like_concurrency, queue.qsize())
+        if workers:
+            await asyncio.gather(*(worker() for _ in range(workers)))
+        return results
+    
+    async def _handle_like_other(self, event: AstrMessageEvent, args: str = ""):
+        """处理赞他请求 批量给多个用户点赞并汇总结果"""
+        try:
+            username = event.get_sender_name()
+            targets = self._parse_like_targets(event, args)
+            if not targets:
+                yield event.plain_result(f"要赞谁呀{username} @他们 或者直接发QQ号 发送'全体'给今天群里活跃的人点赞")
+                return
+            max_targets = int(self.config.get("like_bulk_max_targets", DEFAULT_BULK_LIKE_MAX_TARGETS))
+            truncated = len(targets) > max_targets
+            targets = targets[:max_targets]
+            client = self._get_onebot_client(event)
+            if client is None:
+                yield event.plain_result(f"呀 当前平台不支持点赞{username}")
+                return
+            results = await self._bulk_like(client, targets)
+            response = f"赞他完成 共 {len(targets)} 人\n"
+            response += f" 成功 {len(results[LIKE_STATUS_LIKED])} 人 每人10个赞\n"
+            if results[LIKE_RESULT_SKIPPED]:
+                response += f" 今天已点过 {len(results[LIKE_RESULT_SKIPPED])} 人\n"
+            if results[LIKE_STATUS_CAPPED]:
+                response += f" 已达上限 {len(results[LIKE_STATUS_CAPPED])} 人\n"
+            if results[LIKE_RESULT_FAILED]:
+                response += f" 失败 {len(results[LIKE_RESULT_FAILED])} 人\n"
+            if truncated:
+                response += f" 单次最多 {max_targets} 人 其余已忽略\n"
+            yield event.plain_result(response.rstrip("\n"))
         except Exception as e:
-            logger.debug(f"[XYTUFunction] 提取消息ID失败: {e}")
-        return None
+            logger.error(f"处理赞他请求失败: {e}")
+            try:
+                yield event.plain_result(f"点赞过程中出现错误{event.get_sender_name()}")
+            except:
+                pass
+    
+    # ==================== 运维工具 ====================
+    async def _handle_tcping(self, event: AstrMessageEvent, args: str = ""):
+        """处理 tcping 请求 同时探测多个 host:port"""
+        try:
+            if self.config.get("tcping_admin_only", True) and not event.is_admin():
+                yield event.plain_result("tcping 仅限管理员使用")
+                return
+            targets = []
+            invalid = []
+            for text in args.replace(",", " ").replace("，", " ").split():
+                parsed = parse_host_port(text, DEFAULT_TCPING_PORT)
+                if parsed is None:
+                    invalid.append(text)
+                else:
+                    targets.append((text, parsed[0], parsed[1]))
+            if not targets:
+                yield event.plain_result("用法: tcping host:port [host:port ...]")
+                return
+            max_targets = int(self.config.get("tcping_max_targets", DEFAULT_TCPING_MAX_TARGETS))
+            truncated = len(targets) > max_targets
+            targets = targets[:max_targets]
+            results = await self._tcpinger.ping(targets)
+            response = f"tcping 每个目标 {self._tcpinger.count} 次\n"
+            for result in results:
+                if result.error:
+                    response += f" {result.target}: {result.error}\n"
+                elif not result.samples:
+                    response += f" {result.target}: 全部失败 | 丢失 100%\n"
+                else:
+                    samples = result.samples
+                    response += (f" {result.target}: min {min(samples) * 1000:.1f} / avg {sum(samples) / len(samples) * 1000:.1f} / "
+                                 f"max {max(samples) * 1000:.1f} / p95 {result.percentile(0.95) * 1000:.1f} ms | 丢失 {result.loss:.0%}\n")
+            if invalid:
+                response += f" 无法识别: {' '.join(invalid[:5])}\n"
+            if truncated:
+                response += f" 单次最多 {max_targets} 个目标 其余已忽略\n"
+            yield event.plain_result(response.rstrip("\n"))
+        except Exception as e:
+            logger.error(f"处理 tcping 请求失败: {e}")
+            try:
+                yield event.plain_result("tcping 过程中出现错误")
+            except:
+                pass
+    
+    def _parse_mc_targets(self, args: str) -> List[Tuple[str, int]]:
+        texts = args.replace(",", " ").replace("，", " ").split() or list(self.config.get("mc_default_servers", []))
+        targets = []
+        for text in texts:
+            parsed = parse_host_port(text, DEFAULT_MC_PORT)
+            if parsed and parsed not in targets:
+                targets.append(parsed)
+        return targets[:MC_MAX_TARGETS]
+    
+    @staticmethod
+    def _format_mc_error(host: str, port: int, error: BaseException) -> str:
+        if isinstance(error, asyncio.TimeoutError):
+            return f" {host}:{port}: 查询超时"
+        return f" {host}:{port}: 查询失败 {str(error) or type(error).__name__}"
+    
+    async def _handle_motd(self, event: AstrMessageEvent, args: str = ""):
+        """处理 motd 请求 并发查询一个或多个服务器"""
+        try:
+            targets = self._parse_mc_targets(args)
+            if not targets:
+                yield event.plain_result("用法: motd host[:port] [host[:port] ...]")
+                return
+            results = await self._mc_pinger.query_many(targets)
+            lines = []
+            for (host, port), result in zip(targets, results):
+                if isinstance(result, BaseException):
+                    lines.append(self._format_mc_error(host, port, result))
+                    continue
+                lines.append(f" {host}:{port} | 延迟 {result.latency * 1000:.0f}ms")
+                lines.append(f"   版本: {result.version} (协议 {result.protocol})")
+                lines.append(f"   在线: {result.online}/{result.max_players}")
+                if result.motd:
+                    lines.append(f"   MOTD: {result.motd}")
+            yield event.plain_result("服务器状态\n" + "\n".join(lines))
+        except Exception as e:
+            logger.error(f"处理 motd 请求失败: {e}")
+            try:
+                yield event.plain_result("查询服务器时出现错误")
+            except:
+                pass
+    
+    async def _handle_mcplayer(self, event: AstrMessageEvent, args: str = ""):
+        """处理 mcplayer 请求 显示在线人数和服务器返回的玩家列表"""
+        try:
+            targets = self._parse_mc_targets(args)
+            if not targets:
+                yield event.plain_result("用法: mcplayer host[:port] [host[:port] ...]")
+                return
+            results = await self._mc_pinger.query_many(targets)
+            lines = []
+            for (host, port), result in zip(targets, results):
+                if isinstance(result, BaseException):
+                    lines.append(self._format_mc_error(host, port, result))
+                    continue
+                lines.append(f" {host}:{port} 在线 {result.online}/{result.max_players}")
+                if result.players:
+                    names = "、".join(name for name in result.players if name)
+                    more = result.online - len(result.players)
+                    lines.append(f"   {names}" + (f" 等 {result.online} 人" if more > 0 else ""))
+            yield event.plain_result("在线玩家\n" + "\n".join(lines))
+        except Exception as e:
+            logger.error(f"处理 mcplayer 请求失败: {e}")
+            try:
+                yield event.plain_result("查询服务器时出现错误")
+            except:
+                pass
+    
+    def _get_balance_targets(self) -> List[BalanceTarget]:
+        """收集 AstrBot 中已配置的提供商 Key 以及插件配置里额外填写的 Key"""
+        targets: List[BalanceTarget] = []
+        seen = set()
+        
+        def add(name: str, api_base: str, key: str) -> None:
+            api_base = (api_base or DEFAULT_OPENAI_API_BASE).strip().rstrip("/")
+            key = (key or "").strip()
+            if key and (api_base, key) not in seen:
+                seen.add((api_base, key))
+                targets.append(BalanceTarget(name, api_base, key))
+        
+        try:
+            for provider in self.context.get_all_providers():
+                provider_config = getattr(provider, "provider_config", None) or {}
+                keys = provider_config.get("key") or []
+                if isinstance(keys, str):
+                    keys = [keys]
+                for key in keys:
+                    add(provider_config.get("id", "unknown"), provider_config.get("api_base", ""), key)
+        except Exception as e:
+            logger.warning(f"[XYTUFunction] 读取提供商配置失败: {e}")
+        for line in self.config.get("balance_extra_providers", []):
+            parts = [p.strip() for p in str(line).split("|")]
+            if len(parts) == 3:
+                add(*parts)
+        return targets
+    
+    async def _handle_balance(self, event: AstrMessageEvent, args: str = ""):
+        """处理余额查询请求 仅管理员可用"""
+        try:
+            if not event.is_admin():
+                yield event.plain_result("余额查询仅限管理员使用")
+                return
+            targets = self._get_balance_targets()
+            if not targets:
+                yield event.plain_result("没有可查询的 API Key")
+                return
+            results = await self._balance.query_many(targets)
+            lines = ["提供商 | Key | 余额"]
+            for target, ok, text in results:
+                lines.append(f"{target.name} | {target.key_hint} | {text if ok else '❌ ' + text}")
+            yield event.plain_result("API 余额\n" + "\n".join(lines))
+        except Exception as e:
+            logger.error(f"处理余额查询失败: {e}")
+            try:
+                yield event.plain_result("查询余额时出现错误")
+            except:
+                pass
+    
+    # ==================== 定时任务 ====================
+    async def _run_scheduled_job(self, job: ScheduledJob) -> None:
+        await self.context.send_message(job.umo, MessageChain().message(f"⏰ 定时提醒\n{job.content}"))
+    
+    @staticmethod
+    def _format_schedule_time(timestamp: float) -> str:
+        return datetime.datetime.fromtimestamp(timestamp).strftime("%m-%d %H:%M")
+    
+    @staticmethod
+    def _format_interval(seconds: float) -> str:
+        seconds = int(seconds)
+        parts = []
+        for unit, size in (("天", 86400), ("小时", 3600), ("分钟", 60), ("秒", 1)):
+            if seconds >= size:
+                parts.append(f"{seconds // size}{unit}")
+                seconds %= size
+        return "".join(parts)
     
-    def _is_recall_event(self, event: AstrMessageEvent) -> Tuple[bool, Optional[str], Optional[str]]:
-        """检查是否为撤回事件"""
-        try:
-            raw = getattr(event.message_obj, 'raw_message', None)
-            if not raw:
-                return False, None, None
-            notice_type = None
-            if isinstance(raw, dict):
-                notice_type = raw.get('notice_type')
-            elif hasattr(raw, 'notice_type'):
-                notice_type = getattr(raw, 'notice_type', None)
-            if notice_type not in (NOTICE_GROUP_RECALL, NOTICE_FRIEND_RECALL):
-                return False, None, None
-            if isinstance(raw, dict):
-                recalled_msg_id = raw.get('message_id')
-                operator_id = raw.get('operator_id') or raw.get('user_id')
+    async def _handle_schedule(self, event: AstrMessageEvent, args: str = ""):
+        """处理定时请求
+        
+        定时 <时长|HH:MM> 内容 / 定时 每天 HH:MM 内容 / 定时 每隔 <时长> 内容 / 定时 列表 / 定时 删除 编号
+        """
+        usage = ("用法:\n 定时 10分钟 内容\n 定时 08:00 内容\n 定时 每天 08:00 内容\n"
+                 " 定时 每隔 2h 内容\n 定时 列表\n 定时 删除 编号")
+        try:
+            parts = args.split(maxsplit=1)
+            action = parts[0] if parts else ""
+            rest = parts[1] if len(parts) > 1 else ""
+            umo = event.unified_msg_origin
+            sender_id = str(event.get_sender_id())
+            
+            if action in ("列表", "list"):
+                jobs = await self._scheduler.list_jobs(umo)
+                if not jobs:
+                    yield event.plain_result("当前会话没有定时任务")
+                    return
+                lines = []
+                for job in jobs[:30]:
+                    repeat = f" 每隔{self._format_interval(job.interval)}" if job.interval else ""
+                    lines.append(f" #{job.job_id} {self._format_schedule_time(job.next_run)}{repeat} {job.content[:30]}")
+                more = f"\n 共 {len(jobs)} 个" if len(jobs) > 30 else ""
+                yield event.plain_result("定时任务\n" + "\n".join(lines) + more)
+                return
+            
+            if action in ("删除", "del"):
+                if not rest.strip().lstrip("#").isdigit():
+                    yield event.plain_result("用法: 定时 删除 编号")
+                    return
+                job_id = int(rest.strip().lstrip("#"))
+                removed = await self._scheduler.remove(job_id, None if event.is_admin() else sender_id)
+                yield event.plain_result(f"已删除定时任务 #{job_id}" if removed else "没有找到该任务或无权删除")
+                return
+            
+            interval = 0.0
+            if action in ("每天", "每隔"):
+                parts = rest.split(maxsplit=1)
+                when = parts[0] if parts else ""
+                content = parts[1].strip() if len(parts) > 1 else ""
+                if action == "每天":
+                    next_run = next_clock_time(when)
+                    interval = 86400.0
+                else:
+                    interval = parse_schedule_duration(when) or 0.0
+                    next_run = time.time() + interval if interval >= SCHEDULE_MIN_INTERVAL else None
             else:
-                recalled_msg_id = getattr(raw, 'message_id', None)
-                operator_id = getattr(raw, 'operator_id', None) or getattr(raw, 'user_id', None)
-            if recalled_msg_id:
-                return True, str(recalled_msg_id), str(operator_id) if operator_id else None
+                when, content = action, rest.strip()
+                duration = parse_schedule_duration(when)
+                next_run = time.time() + duration if duration else next_clock_time(when)
+            if next_run is None or not content:
+                yield event.plain_result(usage)
+                return
+            
+            limit = int(self.config.get("schedule_max_jobs_per_user", DEFAULT_SCHEDULE_MAX_JOBS_PER_USER))
+            if not event.is_admin() and await self._scheduler.count_by_creator(sender_id) >= limit:
+                yield event.plain_result(f"每人最多创建 {limit} 个定时任务")
+                return
+            job = await self._scheduler.add(next_run, interval, umo, sender_id, content)
+            repeat = f" 之后每隔 {self._format_interval(interval)} 重复" if interval else ""
+            yield event.plain_result(f"已创建定时任务 #{job.job_id} 将于 {self._format_schedule_time(next_run)} 提醒{repeat}")
+        except Exception as e:
+            logger.error(f"处理定时请求失败: {e}")
+            try:
+                yield event.plain_result("处理定时任务时出现错误")
+            except:
+                pass
+    
+    # ==================== 运行统计 ====================
+    async def _collect_metric_values(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+        gauges: Dict[str, float] = {}
+        counters: Dict[str, float] = {}
+        if self.recall_enabled:
+            pending, recalled = await self._state.get_stats()
+            pending_evicted, recalled_evicted = self._state.get_eviction_stats()
+            gauges["pending_requests"] = pending
+            gauges["recalled_messages"] = recalled
+            gauges["recall_grace_window_seconds"] = self._grace.window()
+            counters["pending_evicted"] = pending_evicted
+            counters["recalled_evicted"] = recalled_evicted
+            for name in PluginStats.__dataclass_fields__:
+                counters[name] = getattr(self._stats, name)
+        return gauges, counters
+    
+    async def _render_metrics(self) -> str:
+        gauges, counters = await self._collect_metric_values()
+        return render_prometheus(self._metrics.histograms, gauges, counters)
+    
+    async def _handle_stats(self, event: AstrMessageEvent, args: str = ""):
+        """处理统计请求 仅管理员可用"""
+        try:
+            if not event.is_admin():
+                yield event.plain_result("统计功能仅限管理员使用")
+                return
+            response = "XYTUFunction 运行统计\n"
+            response += " 耗时 (次数 | 平均 | p50 | p99 | 最大)\n"
+            for name, histogram in self._metrics.histograms.items():
+                if not histogram.count:
+                    continue
+                label = MetricsRegistry.HOOK_DESCRIPTIONS.get(name, name)
+                response += (f"   {label}: {histogram.count} | {histogram.mean * 1000:.2f}ms | "
+                             f"{histogram.quantile(0.5) * 1000:.2f}ms | {histogram.quantile(0.99) * 1000:.2f}ms | "
+                             f"{histogram.max * 1000:.2f}ms\n")
+            gauges, counters = await self._collect_metric_values()
+            if gauges or counters:
+                response += " 撤回防回复\n"
+                for name, value in {**gauges, **counters}.items():
+                    if name.endswith("_estimate"):
+                        response += f"   {name}: {value} (估算)\n"
+                    elif isinstance(value, float):
+                        response += f"   {name}: {value:.3f}\n"
+                    else:
+                        response += f"   {name}: {value}\n"
+            yield event.plain_result(response.rstrip("\n"))
+        except Exception as e:
+            logger.error(f"处理统计请求失败: {e}")
+    
+    async def _handle_lag(self, event: AstrMessageEvent, args: str = ""):
+        """处理卡顿查询 仅管理员可用"""
+        try:
+            if not event.is_admin():
+                yield event.plain_result("卡顿查询仅限管理员使用")
+                return
+            watchdog = self._metrics.watchdog
+            lag = self._metrics.histograms["loop_lag"]
+            response = "XYTUFunction 事件循环卡顿\n"
+            response += (f" 心跳 {self._metrics.lag_interval * 1000:.0f}ms | 阈值 {watchdog.threshold * 1000:.0f}ms | "
+                         f"样本 {lag.count}\n")
+            response += (f" 延迟 p50 {lag.quantile(0.5) * 1000:.1f}ms | p99 {lag.quantile(0.99) * 1000:.1f}ms | "
+                         f"最大 {lag.max * 1000:.1f}ms\n")
+            response += f" 超过阈值 {watchdog.over_threshold} 次 抓到调用栈 {watchdog.captured} 次\n"
+            if watchdog.stalls:
+                response += " 最近卡顿\n"
+                for stall in list(watchdog.stalls)[-5:][::-1]:
+                    moment = datetime.datetime.fromtimestamp(stall.timestamp).strftime("%m-%d %H:%M:%S")
+                    response += f"   {moment} {stall.lag * 1000:.0f}ms {stall.blame}\n"
+            if watchdog.offenders:
+                response += " 卡顿来源 (次数 | 累计 | 最长)\n"
+                ranked = sorted(watchdog.offenders.items(), key=lambda item: item[1][1], reverse=True)
+                for blame, (count, total, longest) in ranked[:5]:
+                    response += f"   {blame}: {int(count)} | {total * 1000:.0f}ms | {longest * 1000:.0f}ms\n"
+            yield event.plain_result(response.rstrip("\n"))
         except Exception as e:
-            logger.debug(f"[XYTUFunction] 检查撤回事件失败: {e}")
-        return False, None, None
+            logger.error(f"处理卡顿查询失败: {e}")
+    
+    # ==================== 撤回防回复功能 ====================
+    @staticmethod
+    def _get_completion_tokens(resp: LLMResponse) -> Optional[int]:
+        """从 LLM 响应中读取输出 token 数 不同版本的 AstrBot/提供商字段不同"""
+        usage = getattr(resp, 'usage', None) or getattr(getattr(resp, 'raw_completion', None), 'usage', None)
+        if usage is None:
+            return None
+        for name in ('completion_tokens', 'output_tokens', 'output'):
+            value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+            if isinstance(value, int):
+                return value
+        return None
+    
+    def _get_using_provider(self, umo: str) -> Any:
+        """当前会话使用的提供商 旧版本 AstrBot 的 get_using_provider 不接受会话参数"""
+        try:
+            try:
+                return self.context.get_using_provider(umo=umo)
+            except TypeError:
+                return self.context.get_using_provider()
+        except Exception:
+            return None
     
     @filter.platform_adapter_type(filter.PlatformAdapterType.AIOCQHTTP)
     @filter.event_message_type(filter.EventMessageType.ALL, priority=100)
@@ -532,88 +4174,381 @@ class XYTUFunctionPlugin(Star):
         """监听所有消息，检测撤回事件"""
         if not self.recall_enabled:
             return
-        is_recall, recalled_msg_id, operator_id = self._is_recall_event(event)
-        if not is_recall or not recalled_msg_id:
+        parsed = get_parsed_message(event)
+        if not parsed.is_recall:
             return
         self._stats.recalls_detected += 1
-        umo = event.unified_msg_origin
+        recalled_msg_id = parsed.message_id
+        operator_id = parsed.operator_id
+        umo = parsed.session
         logger.info(f"[XYTUFunction] 检测到撤回事件 | 消息ID: {recalled_msg_id} | 操作者: {operator_id} | 会话: {umo}")
-        await self._state.add_recalled_message(recalled_msg_id, umo, operator_id or "")
-        pending = await self._state.get_pending_request(recalled_msg_id, umo)
-        if pending and pending.event:
-            logger.info(f"[XYTUFunction] 找到待处理的 LLM 请求，正在取消 | 消息ID: {recalled_msg_id}")
-            pending.event.stop_event()
-            self._stats.llm_requests_blocked += 1
+        await self._apply_recall(recalled_msg_id, umo, operator_id or "", parsed.timestamp)
+        if self._shared_recalls:
+            await self._shared_recalls.publish(recalled_msg_id, umo, operator_id or "")
         event.stop_event()
     
+    async def _apply_recall(self, recalled_msg_id: str, umo: str, operator_id: str,
+                            recalled_at: Optional[float] = None) -> None:
+        """记录撤回 唤醒等待中的发送 并停止该消息仍在进行的 LLM 请求"""
+        await self._state.add_recalled_message(recalled_msg_id, umo, operator_id)
+        self._grace.notify_recall(recalled_msg_id, umo, recalled_at)
+        pending = await self._state.get_pending_request(recalled_msg_id, umo)
+        if pending is None:
+            return
+        pending.recalled = True
+        task = pending.provider_task
+        if pending.cancelled:
+            pass
+        elif task is not None and not task.done():
+            # 只取消提供商调用本身 AstrBot 的流水线任务照常结束
+            logger.info(f"[XYTUFunction] 找到进行中的 LLM 调用，正在取消 | 消息ID: {recalled_msg_id}")
+            pending.cancelled = True
+            task.cancel()
+            self._stats.generations_cancelled += 1
+        elif pending.generating:
+            logger.info(f"[XYTUFunction] LLM 调用无法取消，响应到达后丢弃 | 消息ID: {recalled_msg_id}")
+        pending_event = pending.event
+        if pending_event:
+            pending_event.stop_event()
+    
+    async def _shared_recall_loop(self) -> None:
+        """轮询其他进程记录的撤回 按本进程收到撤回通知的方式处理"""
+        loaded = False
+        while True:
+            try:
+                if not loaded:
+                    for umo, message_id, operator_id in await self._shared_recalls.load_recent(time.time() - RECORD_EXPIRE_SECONDS):
+                        await self._state.add_recalled_message(message_id, umo, operator_id)
+                    loaded = True
+                for umo, message_id, operator_id in await self._shared_recalls.poll():
+                    self._stats.recalls_from_peers += 1
+                    logger.debug(f"[XYTUFunction] 收到其他进程的撤回 | 消息ID: {message_id} | 会话: {umo}")
+                    await self._apply_recall(message_id, umo, operator_id)
+                pending, _ = await self._state.get_stats()
+                if pending:
+                    await asyncio.sleep(self._shared_poll_interval)
+                    continue
+                self._shared_recall_wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._shared_recall_wakeup.wait(), max(self._shared_poll_interval, RECALL_SHARED_IDLE_POLL)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"[XYTUFunction] 同步共享撤回记录出错: {e}")
+                await asyncio.sleep(1.0)
+    
     @filter.on_llm_request(priority=100)
     async def on_llm_request(self, event: AstrMessageEvent, req: ProviderRequest) -> None:
         if not self.recall_enabled:
             return
-        msg_id = self._get_message_id(event)
+        parsed = get_parsed_message(event)
+        msg_id = parsed.message_id
         if not msg_id:
             return
-        umo = event.unified_msg_origin
+        umo = parsed.session
         sender_id = event.get_sender_id()
-        await self._state.add_pending_request(msg_id, umo, sender_id, event)
+        pending = await self._state.add_pending_request(msg_id, umo, sender_id, event, generating=True)
+        self._provider_guard.install(self._get_using_provider(umo))
+        self._provider_guard.bind(pending)
+        if self._shared_recalls:
+            # 立即切换到快速轮询 不等慢速轮询的这一轮结束
+            self._shared_recall_wakeup.set()
         if await self._state.is_recalled(msg_id, umo):
             logger.info(f"[XYTUFunction] LLM 请求阶段拦截 | 消息已被撤回，阻止请求 | 消息ID: {msg_id}")
+            pending.recalled = True
             event.stop_event()
-            self._stats.llm_requests_blocked += 1
+            self._stats.record_blocked()
     
     @filter.on_llm_response(priority=100)
     async def on_llm_response(self, event: AstrMessageEvent, resp: LLMResponse) -> None:
         if not self.recall_enabled:
             return
-        msg_id = self._get_message_id(event)
+        parsed = get_parsed_message(event)
+        msg_id = parsed.message_id
         if not msg_id:
             return
-        umo = event.unified_msg_origin
+        umo = parsed.session
+        pending = await self._state.get_pending_request(msg_id, umo)
+        completion_tokens = self._get_completion_tokens(resp)
+        cancelled = pending is not None and pending.cancelled
+        if pending and pending.generating:
+            pending.generating = False
+            if not cancelled:
+                self._stats.record_generation(time.time() - pending.timestamp, completion_tokens)
         if await self._state.is_recalled(msg_id, umo):
             logger.info(f"[XYTUFunction] LLM 响应阶段拦截 | 消息已被撤回，阻止响应 | 消息ID: {msg_id}")
             event.stop_event()
+            event.clear_result()
             self._stats.llm_responses_blocked += 1
+            if not cancelled:
+                self._stats.record_discarded(completion_tokens)
     
     @filter.on_decorating_result(priority=100)
     async def on_decorating_result(self, event: AstrMessageEvent) -> None:
-        if not self.recall_enabled:
+        if self.recall_enabled and await self._recall_blocks_send(event):
             return
-        msg_id = self._get_message_id(event)
+        if self.segment_enabled:
+            await self._segment_result(event)
+    
+    async def _recall_blocks_send(self, event: AstrMessageEvent) -> bool:
+        """发送前检查原消息是否已撤回 必要时等待撤回宽限期 已撤回则阻止发送"""
+        parsed = get_parsed_message(event)
+        msg_id = parsed.message_id
         if not msg_id:
-            return
-        umo = event.unified_msg_origin
-        await asyncio.sleep(0.1)
-        if await self._state.is_recalled(msg_id, umo):
+            return False
+        umo = parsed.session
+        recalled = await self._state.is_recalled(msg_id, umo)
+        if not recalled:
+            # 只有正在跟踪的 LLM 请求才需要等待 且原消息仍在可撤回时限内
+            if await self._state.get_pending_request(msg_id, umo) is None or not self._grace.should_wait(parsed.timestamp):
+                self._stats.grace_skipped += 1
+                return False
+            self._stats.grace_waits += 1
+            started = time.perf_counter()
+            recalled = await self._grace.wait(msg_id, umo)
+            self._metrics.observe("decorating_wait", time.perf_counter() - started)
+        if recalled:
             logger.info(f"[XYTUFunction] 发送阶段拦截 | 消息已被撤回，阻止发送 | 消息ID: {msg_id}")
             event.stop_event()
+            event.clear_result()
             self._stats.send_blocked += 1
+        return recalled
+    
+    # ==================== 智能群管理 ====================
+    @filter.platform_adapter_type(filter.PlatformAdapterType.AIOCQHTTP)
+    @filter.event_message_type(filter.EventMessageType.ALL, priority=99)
+    async def on_group_flood(self, event: AstrMessageEvent) -> None:
+        """刷屏检测 每条群消息只更新计数 触发规则时把处理动作交给批量队列"""
+        if self._flood is None:
+            return
+        try:
+            group_id = event.get_group_id()
+            if not group_id or (self._flood_groups and group_id not in self._flood_groups):
+                return
+            parsed = get_parsed_message(event)
+            user_id = event.get_sender_id()
+            if parsed.notice_type or not user_id or user_id in self._flood_whitelist:
+                return
+            started = time.perf_counter()
+            verdict = self._flood.check(group_id, user_id, parsed.raw_text, time.monotonic())
+            self._metrics.observe("flood_check", time.perf_counter() - started)
+            if verdict is None or event.is_admin() or user_id == str(event.get_self_id()):
+                return
+            raw = getattr(getattr(event, 'message_obj', None), 'raw_message', None)
+            sender = _raw_field(raw, 'sender') if raw is not None and not isinstance(raw, str) else None
+            if isinstance(sender, dict) and sender.get('role') in ("owner", "admin"):
+                # 群主和管理员无法被禁言或撤回
+                return
+            reason, fresh = verdict
+            client = self._get_onebot_client(event)
+            if client is None:
+                return
+            if FLOOD_ACTION_RECALL in self._flood_actions and parsed.message_id:
+                self._moderation.recall(client, parsed.message_id)
+            if fresh:
+                logger.info(f"[XYTUFunction] 检测到{reason} | 群: {group_id} | 用户: {user_id}")
+                if FLOOD_ACTION_MUTE in self._flood_actions:
+                    self._moderation.mute(client, group_id, user_id, self._flood_mute_seconds)
+                if FLOOD_ACTION_WARN in self._flood_actions:
+                    self._moderation.warn(client, group_id, user_id, reason)
+            # 不让刷屏消息继续触发指令和 LLM 回复
+            event.stop_event()
+        except Exception as e:
+            logger.error(f"[XYTUFunction] 刷屏检测出错: {e}")
+    
+    # ==================== 表情包 ====================
+    @filter.platform_adapter_type(filter.PlatformAdapterType.AIOCQHTTP)
+    @filter.event_message_type(filter.EventMessageType.ALL)
+    async def on_sticker_message(self, event: AstrMessageEvent) -> None:
+        """收集群聊中的表情包 只把图片地址放进下载队列"""
+        if self._sticker_collector is None:
+            return
+        try:
+            group_id = event.get_group_id()
+            if not group_id or (self._sticker_groups and group_id not in self._sticker_groups):
+                return
+            raw = getattr(getattr(event, 'message_obj', None), 'raw_message', None)
+            segments = _raw_field(raw, 'message') if raw is not None and not isinstance(raw, str) else None
+            if not isinstance(segments, list):
+                return
+            for segment in segments:
+                if not isinstance(segment, dict) or segment.get('type') != 'image':
+                    continue
+                data = segment.get('data') or {}
+                url = data.get('url')
+                if not url:
+                    continue
+                # NapCat 用 sub_type 1 标记表情包 普通图片为 0
+                if self._sticker_only_stickers and str(data.get('sub_type', '0')) != '1' and "表情" not in str(data.get('summary', '')):
+                    continue
+                self._sticker_collector.submit(str(data.get('file', '')), url, f"{group_id}:{event.get_sender_id()}")
+        except Exception as e:
+            logger.error(f"[XYTUFunction] 收集表情包出错: {e}")
+    
+    async def _handle_sticker(self, event: AstrMessageEvent, args: str = ""):
+        """处理表情包请求 不带参数时随机发一张 带 统计 时回复仓库状态"""
+        try:
+            store = self._stickers
+            if args.strip() in ("统计", "stats"):
+                await store.load()
+                counts = store.counts
+                response = "表情包仓库\n"
+                response += f" 共 {store.count} 张 | {store.total_bytes / 1024 / 1024:.1f}/{store.max_bytes / 1024 / 1024:.0f} MiB\n"
+                response += (f" 本次运行: 新增 {counts[STICKER_ADDED]} | 重复 {counts[STICKER_DUPLICATE]} | "
+                             f"近似 {counts[STICKER_SIMILAR]} | 淘汰 {store.evicted}\n")
+                collector = self._sticker_collector
+                response += f" 下载: 丢弃 {collector.dropped} | 失败 {collector.failed}"
+                yield event.plain_result(response)
+                return
+            path = await store.random_sticker()
+            if path is None:
+                yield event.plain_result("表情包仓库还是空的 多发点表情包吧")
+                return
+            yield event.image_result(path)
+        except Exception as e:
+            logger.error(f"处理表情包请求失败: {e}")
+            try:
+                yield event.plain_result("获取表情包时出现错误")
+            except:
+                pass
+    
+    # ==================== 回复分段 ====================
+    async def _segment_recalled(self, event: AstrMessageEvent) -> bool:
+        """每段发送前检查原消息是否已被撤回"""
+        if not self.recall_enabled:
+            return False
+        parsed = get_parsed_message(event)
+        if not parsed.message_id or not await self._state.is_recalled(parsed.message_id, parsed.session):
+            return False
+        logger.info(f"[XYTUFunction] 分段发送中止 | 消息已被撤回 | 消息ID: {parsed.message_id}")
+        self._stats.send_blocked += 1
+        return True
+    
+    def _segment_reply(self, event: AstrMessageEvent) -> SegmentedReply:
+        async def send(item: Any) -> None:
+            await event.send(MessageChain().message(item) if isinstance(item, str) else item)
+        return SegmentedReply(
+            send,
+            lambda: self._segment_recalled(event),
+            self._segment_interval,
+            lambda seconds: self._metrics.observe("segment_first", seconds)
+        )
+    
+    async def _segment_stream(self, event: AstrMessageEvent, stream):
+        """包装流式结果 边接收边按句子切分发送 最后一段交还给原流程发送"""
+        reply = self._segment_reply(event)
+        segmenter = StreamSegmenter(self._segment_min_chars, self._segment_max_chars)
+        try:
+            async for item in stream:
+                text = _chain_text(item)
+                if text is None:
+                    # 非文本组件(图片等)原样发送 先把已缓冲的文字发出去保持顺序
+                    segments = [segmenter.flush(), item]
+                else:
+                    segments = segmenter.feed(text)
+                for segment in segments:
+                    if segment and not await reply.send(segment):
+                        event.stop_event()
+                        return
+            rest = segmenter.flush()
+            if rest and await reply.ready():
+                reply.mark_sent()
+                yield MessageChain().message(rest)
+            elif reply.stopped:
+                event.stop_event()
+        finally:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+    
+    async def _segment_result(self, event: AstrMessageEvent) -> None:
+        """对 LLM 回复分段
+        
+        流式结果替换为边收边发的包装 非流式的纯文本结果先发送前面的分段 最后一段留给原流程发送
+        """
+        result = event.get_result()
+        if result is None:
+            return
+        stream = getattr(result, "async_stream", None)
+        if stream is not None:
+            result.async_stream = self._segment_stream(event, stream)
+            return
+        is_llm_result = getattr(result, "is_llm_result", None)
+        if not callable(is_llm_result) or not is_llm_result():
+            return
+        chain = getattr(result, "chain", None) or []
+        text = _chain_text(chain)
+        if not text or len(text) < self._segment_min_chars * 2:
+            return
+        segmenter = StreamSegmenter(self._segment_min_chars, self._segment_max_chars)
+        segments = segmenter.feed(text)
+        rest = segmenter.flush()
+        if rest:
+            segments.append(rest)
+        if len(segments) < 2:
+            return
+        reply = self._segment_reply(event)
+        for segment in segments[:-1]:
+            if not await reply.send(segment):
+                break
+        if not await reply.ready():
+            event.stop_event()
+            result.chain = []
+            return
+        # 原来的组件可能还被对话记录等其他地方引用 换成新的组件而不是改写它
+        result.chain = [Plain(segments[-1])]
     
     @filter.after_message_sent(priority=100)
     async def after_message_sent(self, event: AstrMessageEvent) -> None:
         if not self.recall_enabled:
             return
-        msg_id = self._get_message_id(event)
+        parsed = get_parsed_message(event)
+        msg_id = parsed.message_id
         if not msg_id:
             return
-        await self._state.remove_pending_request(msg_id, event.unified_msg_origin)
+        await self._state.remove_pending_request(msg_id, parsed.session)
         logger.debug(f"[XYTUFunction] 消息已发送，清理记录 | 消息ID: {msg_id}")
     
     @filter.on_astrbot_loaded()
     async def on_loaded(self, *args, **kwargs) -> None:
-        if not self.recall_enabled:
-            return
-        if self._cleanup_task is None:
+        self._start_background_tasks()
+    
+    def _start_background_tasks(self) -> None:
+        """启动后台任务 可重复调用"""
+        self._metrics.start()
+        if self._exporter and (self._exporter_task is None or self._exporter_task.done()):
+            self._exporter_task = asyncio.ensure_future(self._exporter.start())
+        if self._sampler:
+            self._sampler.start()
+            self._start_hardware_probe()
+        if self._history and (self._history_task is None or self._history_task.done()):
+            self._history_task = asyncio.create_task(self._history_loop())
+        if self._scheduler:
+            self._scheduler.start()
+        if self._moderation:
+            self._moderation.start()
+        if self._sticker_collector:
+            self._sticker_collector.start()
+        if self.recall_enabled and self._cleanup_task is None:
             self._cleanup_task = asyncio.create_task(self._cleanup_loop())
             logger.debug("[XYTUFunction] 后台清理任务已启动")
+        if self._shared_recalls and self._shared_recall_task is None:
+            self._shared_recall_task = asyncio.create_task(self._shared_recall_loop())
     
     async def _cleanup_loop(self) -> None:
         while True:
             try:
                 await asyncio.sleep(CLEANUP_INTERVAL)
                 cleaned = await self._state.cleanup_expired()
+                if self._shared_recalls:
+                    await self._shared_recalls.cleanup()
                 if cleaned > 0:
                     pending, recalled = await self._state.get_stats()
-                    logger.debug(f"[XYTUFunction] 已清理 {cleaned} 条过期记录 | 当前: 待处理 {pending}, 已撤回 {recalled}")
+                    pending_evicted, recalled_evicted = self._state.get_eviction_stats()
+                    logger.debug(f"[XYTUFunction] 已清理 {cleaned} 条过期记录 | 当前: 待处理 {pending}, 已撤回 {recalled} | 累计淘汰: 待处理 {pending_evicted}, 已撤回 {recalled_evicted}")
             except asyncio.CancelledError:
                 break
             except Exception as e:
@@ -621,10 +4556,46 @@ class XYTUFunctionPlugin(Star):
     
     async def terminate(self):
         """插件卸载时清理"""
-        if hasattr(self, '_cleanup_task') and self._cleanup_task:
+        if self._cleanup_task:
             self._cleanup_task.cancel()
             try:
                 await self._cleanup_task
             except asyncio.CancelledError:
                 pass
+        if self._shared_recall_task:
+            self._shared_recall_task.cancel()
+            try:
+                await self._shared_recall_task
+            except asyncio.CancelledError:
+                pass
+        if self._shared_recalls:
+            self._shared_recalls.close()
+        if self.recall_enabled:
+            self._provider_guard.uninstall()
+        if self._sampler:
+            await self._sampler.stop()
+        if self._history_task:
+            self._history_task.cancel()
+            try:
+                await self._history_task
+            except asyncio.CancelledError:
+                pass
+        if self._history:
+            self._history.close()
+        if self._disk_prober:
+            self._disk_prober.shutdown()
+        if self._like_ledger:
+            self._like_ledger.close()
+        await self._metrics.stop()
+        if self._exporter:
+            await self._exporter.stop()
+        await self._balance.close()
+        if self._scheduler:
+            await self._scheduler.stop()
+        if self._moderation:
+            await self._moderation.stop()
+        if self._sticker_collector:
+            await self._sticker_collector.stop()
+        if self._stickers:
+            self._stickers.close()
         logger.info("XYTUFunction 插件卸载")